@@ -1,35 +1,472 @@
 # Battle City Remake
 # by Qianzhou Wang
 
-# import the library needed, which are 'pygame', 'sys' and 'random'
+# import the library needed, which are 'time', 'pygame', 'os', 'random', 'argparse', 'json', 'mmap', 'struct', 'heapq',
+# 'collections', 'threading', 'pickle', 'zlib', 'io', 'sys', 'subprocess', 'shlex' and 'queue'
+# time is imported first to record the moment the module started loading
+import time
+import_time = time.perf_counter()
+
 import pygame
-import sys
+import os
 import random
+import argparse
+import json
+import mmap
+import struct
+import heapq
+import collections
+import threading
+import pickle
+import zlib
+import io
+import sys
+import subprocess
+import shlex
+import queue
 
 # 'pygame.locals' will allow me to use some variables such as a key on the keyboard directly
 from pygame.locals import *
 
+# the images, sounds and levels are found next to this file, so the game can be started from any directory
+base_dir = os.path.dirname(os.path.abspath(__file__))
+
+# the display, the sound mixer and the assets are only set up when they are needed for the first time.
+# importing this file doesn't open a window, which allows tools, tests and servers to use the game logic.
+# a display created without calling main() is headless (no window is shown)
+screen = None
+display = None
+headless = True
+
+# the whole game runs in the coordinates of a frame 3 times as large as the 256x224 frame of the NES, which is the
+# game scale. For example, a brick wall has a 16x16 image, but it is a 48x48 square in the game.
+# render scale is the size of a NES pixel in the frame being composed on the screen surface. With 3, the frame is
+# composed in the coordinates of the game from sheets scaled 3 times; with 1, it is composed at the native
+# resolution from the sheets as they are. The frame is scaled to the size of the window once at the end (see present)
+nes_size = (256, 224)
+game_scale = 3
+render_scale = 3
+window_size = (768, 672)
+
+# mixer ready is None before the mixer has been tried, then True or False
+mixer_ready = None
+
+# NumPy, imported by import_numpy
+numpy = None
+
+# decoded and scaled images and loaded sounds, shared by all the sprites
+image_cache = {}
+sound_cache = {}
+
+# frames cut out of the sheets, each converted for the fastest way of drawing it (see get_frame)
+frame_cache = {}
+
+# the asset pack holds all the images already scaled and converted, so they can be used without decoding them.
+# it is built by "python BattleCityRemake.py --build-assets"; the PNG files are used when there is no pack
+# or when a PNG file has been changed after the pack was built
+asset_pack_file = "images/assets.pack"
+use_asset_pack = True
+
+# asset pack is None before the pack has been opened, then a dictionary with the memory map and the index,
+# or False if there is no usable pack
+asset_pack = None
+
+# the pack starts with a header of a magic word, a version and the length of the index
+asset_pack_header = struct.Struct("<4sII")
+asset_pack_magic = b"BCAP"
+asset_pack_version = 1
+
+
+# function to get the full path of a file shipped with the game
+def resource_path(name):
+    return os.path.join(base_dir, name)
+
+
+# function to create the screen when it is needed for the first time
+# the screen is the window itself when the frame has the size of the window, otherwise a surface of the frame size
+def init_display(run_headless=None):
+    global screen, display, headless
+
+    if screen is None:
+
+        # keep the current mode if no mode is given
+        if run_headless is not None:
+            headless = run_headless
+
+        # the dummy video driver renders into memory instead of a window
+        if headless:
+            os.environ["SDL_VIDEODRIVER"] = "dummy"
+
+        # only the display module is initialized here, the mixer is initialized separately
+        pygame.display.init()
+
+        # create a window with a given size and name the window as "Battle City"
+        display = pygame.display.set_mode(window_size)
+        pygame.display.set_caption("Battle City")
+
+        # create the screen where the frames are composed
+        frame_size = (nes_size[0] * render_scale, nes_size[1] * render_scale)
+        if frame_size == window_size:
+            screen = display
+        else:
+            screen = pygame.Surface(frame_size).convert()
+
+    return screen
+
+
+# function to show the composed frame in the window, it is scaled only if the sizes are different
+def present():
+    if screen is not display:
+        pygame.transform.scale(screen, window_size, display)
+    pygame.display.update()
+
+
+# function to convert a length or a coordinate of the game to the pixels of the frame being composed
+def to_frame(value):
+    return value * render_scale // game_scale
+
+
+# function to convert a rect of the game, or a rect on a sprite sheet of the game scale, to the pixels of the frame
+# the edges are converted, so rects next to each other stay next to each other
+def frame_rect(rect):
+    if render_scale == game_scale:
+        return rect
+    left, top, width, height = rect
+    x, y = to_frame(left), to_frame(top)
+    return Rect(x, y, to_frame(left + width) - x, to_frame(top + height) - y)
+
+
+# function to fill a rect of the game with a color on the frame
+def fill_rect(surface, color, rect):
+    pygame.draw.rect(surface, color, frame_rect(rect), 0)
+
+
+# function to draw sprites on the frame in one batch of blits, at their positions converted from the game
+# the sprites of a large arena are moved by an offset from the arena to the screen, see LayeredRenderer.draw_view
+# the blits are given one at a time rather than as a list, so drawing a frame doesn't build a list of every sprite
+def draw_sprites(surface, sprites, offset_x=0, offset_y=0):
+    if render_scale == game_scale and not offset_x and not offset_y:
+        surface.blits(((sprite.image, sprite.rect) for sprite in sprites), False)
+    else:
+        surface.blits(((sprite.image, (to_frame(sprite.rect.x + offset_x), to_frame(sprite.rect.y + offset_y)))
+                       for sprite in sprites), False)
+
+
+# function to import NumPy when it is needed for the first time
+# NumPy is only used by the observations of the battle (see Observation), the game is played without it
+def import_numpy():
+    global numpy
+
+    if numpy is None:
+        import numpy as module
+        numpy = module
+    return numpy
+
+
+# function to initialize the sound mixer when the first sound is played
+def init_mixer():
+    global mixer_ready
+
+    if mixer_ready is None:
+
+        # a computer without an audio device simply runs the game without sound
+        try:
+            pygame.mixer.init()
+            mixer_ready = True
+        except pygame.error:
+            mixer_ready = False
+
+    return mixer_ready
+
+
+# function to get a sprite sheet which is ready to use
+# the sheet is scaled with the render scale, so the pieces cut out of it are converted with frame_rect
+def get_image(filename):
+    if filename not in image_cache:
+
+        # images can only be converted when the screen exists
+        init_display()
+
+        # use the image in the asset pack if possible, the pack holds the images of the game scale
+        image = None
+        if use_asset_pack and render_scale == game_scale:
+            image = load_packed_image(filename)
+
+        # otherwise, decode and convert the image, then resize it with the scale factor
+        if image is None:
+            image = load_scaled_image(filename, render_scale)
+
+        image_cache[filename] = image
+
+    return image_cache[filename]
+
+
+# function to decode an image file and resize it with a scale factor
+def load_scaled_image(filename, scale):
+    image = pygame.image.load(resource_path(filename)).convert_alpha()
+    if scale == 1:
+        return image
+    m_width, m_height = image.get_size()
+    return pygame.transform.scale(image, (m_width*scale, m_height*scale))
+
+
+# function to find out how a frame is drawn from the alpha values of its pixels
+# "opaque" frames have no transparent pixel and are copied as they are, "colorkey" frames have only fully
+# transparent and fully opaque pixels so the transparent ones are skipped, and "alpha" frames are blended
+def classify_frame(image):
+    alphas = set(pygame.image.tobytes(image, "RGBA")[3::4])
+    if alphas == {255}:
+        return "opaque"
+    if alphas <= {0, 255}:
+        return "colorkey"
+    return "alpha"
+
+
+# function to find a color which isn't used by the opaque pixels of a frame, so it can be the color key
+def unused_color(image):
+    pixels = pygame.image.tobytes(image, "RGBA")
+    used = set(pixels[i:i + 3] for i in range(0, len(pixels), 4) if pixels[i + 3])
+    for color in [(255, 0, 255), (0, 255, 255), (1, 2, 3)]:
+        if bytes(color) not in used:
+            return color
+    color = 0
+    while bytes(((color >> 16) & 255, (color >> 8) & 255, color & 255)) in used:
+        color += 1
+    return (color >> 16) & 255, (color >> 8) & 255, color & 255
+
+
+# function to get a frame of a sheet, cut out once and converted for its kind
+# opaque frames lose their alpha channel, colorkey frames are run-length encoded with a color key, only the frames
+# with translucent pixels keep the per-pixel alpha. the rect is in the coordinates of the game like a sheet rect
+def get_frame(sheet, rect):
+    return cut_frame(sheet, frame_rect(Rect(rect)))
+
+
+# function to get a frame of a sheet from a rect which is already in the pixels of the sheet, see get_frame
+def cut_frame(sheet, rect):
+    key = (sheet, rect.x, rect.y, rect.width, rect.height)
+    if key not in frame_cache:
+        image = sheet.subsurface(rect)
+        kind = classify_frame(image)
+        if kind == "opaque":
+            image = image.convert()
+        elif kind == "colorkey":
+            color = unused_color(image)
+            frame = pygame.Surface(image.get_size()).convert()
+            frame.fill(color)
+            frame.blit(image, (0, 0))
+            frame.set_colorkey(color, RLEACCEL)
+            image = frame
+        frame_cache[key] = image
+    return frame_cache[key]
+
+
+# function to open the asset pack and read its index
+# return None if there is no pack or the pack can't be used
+def open_asset_pack():
+    global asset_pack
+
+    if asset_pack is None:
+        asset_pack = False
+        try:
+            with open(resource_path(asset_pack_file), "rb") as file:
+
+                # map the whole file into memory, the pixel data is only read when a surface is drawn
+                data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+            magic, version, index_size = asset_pack_header.unpack_from(data, 0)
+            if magic == asset_pack_magic and version == asset_pack_version:
+                start = asset_pack_header.size
+                index = json.loads(data[start:start + index_size].decode("utf-8"))
+                asset_pack = {"data": data, "view": memoryview(data), "index": index,
+                              "data_start": asset_pack_data_start(index_size)}
+        except (OSError, ValueError, struct.error):
+            pass
+
+    return asset_pack or None
+
+
+# function to create a surface from the pixel data in the asset pack
+# return None if the image is not in the pack or the PNG file has been changed after building the pack
+def load_packed_image(filename):
+    pack = open_asset_pack()
+    if pack is None:
+        return None
+
+    entry = pack["index"].get(filename)
+    if entry is None:
+        return None
+
+    # compare the PNG file with the one the pack was built from
+    try:
+        source = os.stat(resource_path(filename))
+        if source.st_size != entry["source_size"] or int(source.st_mtime) != entry["source_mtime"]:
+            return None
+    except OSError:
+        pass
+
+    # the surface uses the pixels in the memory map directly, no decoding or scaling is needed
+    start = pack["data_start"] + entry["offset"]
+    pixels = pack["view"][start:start + entry["width"] * entry["height"] * 4]
+    image = pygame.image.frombuffer(pixels, (entry["width"], entry["height"]), entry["format"])
+
+    # the pixels are stored in the format of the screen, convert them only if the screen uses another format
+    if image.get_masks() != screen_alpha_masks():
+        image = image.convert_alpha()
+    return image
+
+
+# function to get the pixel format which convert_alpha creates for the screen
+def screen_alpha_masks():
+    return pygame.Surface((1, 1), SRCALPHA).convert_alpha().get_masks()
+
+
+# function to calculate where the pixel data starts in the asset pack
+def asset_pack_data_start(index_size):
+    start = asset_pack_header.size + index_size
+    return start + (-start) % 64
+
+
+# function to build the asset pack from all the PNG files in the images folder
+def build_asset_pack():
+    init_display()
+
+    # the index records where the pixels of each image are, and the PNG file they are built from
+    index = {}
+    blobs = []
+    offset = 0
+    for name in sorted(os.listdir(resource_path("images"))):
+        if not name.endswith(".png"):
+            continue
+        filename = "images/" + name
+        image = load_scaled_image(filename, game_scale)
+        source = os.stat(resource_path(filename))
+        pixels = pygame.image.tobytes(image, "BGRA")
+        index[filename] = {"offset": offset, "width": image.get_width(), "height": image.get_height(),
+                           "format": "BGRA", "source_size": source.st_size,
+                           "source_mtime": int(source.st_mtime)}
+        blobs.append(pixels)
+        offset += len(pixels)
+
+    # the pixel data starts after the header and the index, aligned to 64 bytes
+    index_data = json.dumps(index, sort_keys=True).encode("utf-8")
+    padding = asset_pack_data_start(len(index_data)) - asset_pack_header.size - len(index_data)
+
+    # write the header, the index and the pixels
+    path = resource_path(asset_pack_file)
+    with open(path, "wb") as file:
+        file.write(asset_pack_header.pack(asset_pack_magic, asset_pack_version, len(index_data)))
+        file.write(index_data)
+        file.write(b"\0" * padding)
+        for pixels in blobs:
+            file.write(pixels)
+
+    return path
+
+
+# function to get a sound clip, which is loaded from the sounds folder when it is used for the first time
+def get_sound(sound):
+    if sound not in sound_cache:
+        sound_cache[sound] = pygame.mixer.Sound(resource_path("sounds/" + sound + ".ogg"))
+    return sound_cache[sound]
+
+
+# sheets of the sprites which change their frames, with the size of a frame, every frame of them is cut out
+warm_up_sheets = [("images/tanks.png", 48, 48), ("images/explosions.png", 96, 96), ("images/power_ups.png", 48, 48),
+                  ("images/environment.png", 48, 48)]
+
+# other frames, which aren't a whole frame of the sheets above
+warm_up_frames = [("images/environment.png", (0, 48, 12, 12)), ("images/environment.png", (12, 48, 12, 12)),
+                  ("images/environment.png", (48, 48, 24, 24)), ("images/environment.png", (192, 144, 24, 24)),
+                  ("images/environment.png", (216, 144, 24, 24)), ("images/bullet.png", (0, 3, 9, 12)),
+                  ("images/bullet.png", (15, 6, 12, 9)), ("images/bullet.png", (30, 3, 9, 12)),
+                  ("images/bullet.png", (45, 6, 12, 9)), ("images/letters.png", (0, 0, 120, 24)),
+                  ("images/letters.png", (0, 72, 48, 24)), ("images/letters.png", (0, 120, 96, 48)),
+                  ("images/board_s.png", (0, 0, 768, 672)), ("images/game_over.png", (0, 0, 768, 672))]
+
+# number of loading steps run in each frame of the menu and of the stage screen, shared by the level of the stage
+# (see Game.prepare) and the warm-up of the assets. a step is a small part of the work of about a millisecond, such as
+# an asset, 13 tiles of the map or a part of the flow field. as steps are counted rather than time, the level takes
+# the same number of frames to load on every computer, so the stage screen waits for it and replays still play the
+# same. 0 turns the loading before the game off
+loading_steps = 8
+
+# the assets left to warm up, None until the warm-up starts
+warm_up_queue = None
+
+
+# function to list the assets to warm up, each as its number of loading steps, a function and its arguments
+# a step is about a millisecond: a frame costs a step for each 256x256 pixels and a sound for each 4 KB of its file
+def warm_up_jobs():
+    jobs = []
+
+    # every frame of the sprites, then the digits of each color, the frames of a sheet are listed once it is loaded
+    for filename, width, height in warm_up_sheets:
+        jobs.append((2, warm_up_sheet, (filename, width, height)))
+    for filename, rect in warm_up_frames:
+        jobs.append((1 + rect[2] * rect[3] // 65536, warm_up_frame, (filename, rect)))
+    for num_color in ["black", "yellow", "white"]:
+        jobs.append((1, get_glyph, (0, num_color)))
+
+    # the sounds are only decoded when there is a mixer to play them
+    if init_mixer():
+        for name in sorted(os.listdir(resource_path("sounds"))):
+            if name.endswith(".ogg"):
+                size = os.path.getsize(resource_path("sounds/" + name))
+                jobs.append((1 + size // 4096, get_sound, (name[:-4],)))
+
+    return jobs
+
+
+# function to load a sheet and put the warm-up of each of its frames next in the queue
+def warm_up_sheet(filename, width, height):
+    sheet_width, sheet_height = get_image(filename).get_size()
+    frames = []
+    for y in range(0, sheet_height * game_scale // render_scale - height + 1, height):
+        for x in range(0, sheet_width * game_scale // render_scale - width + 1, width):
+            frames.append((1, warm_up_frame, (filename, (x, y, width, height))))
+    warm_up_queue.extendleft(reversed(frames))
+
+
+# function to cut out a frame of a sheet before it is used
+def warm_up_frame(filename, rect):
+    get_frame(get_image(filename), rect)
+
+
+# function to decode, scale and convert the sheets, the frames and the sounds before they are used, for a number of
+# loading steps, so the first stage doesn't have to. an asset which needs more steps than there are left waits for
+# the next frame, unless it needs more than a whole frame of steps, then it is loaded alone in a frame
+def warm_up_assets(steps):
+    global warm_up_queue
+
+    if not steps:
+        return
+    if warm_up_queue is None:
+        warm_up_queue = collections.deque(warm_up_jobs())
+
+    while warm_up_queue:
+        cost, function, arguments = warm_up_queue[0]
+        if cost > steps and steps < loading_steps:
+            break
+        warm_up_queue.popleft()
+        function(*arguments)
+        steps -= cost
+        if steps <= 0:
+            break
+
+
 # Point class
 # Vector which has two parameter can be treated as a point have x, y coordinate.
 # Such as position, velocity etc.
 class Point(object):
 
+    # a point only holds its two coordinates, so it is kept without a dictionary of attributes
+    __slots__ = ("x", "y")
+
     # initialize Point class
     def __init__(self, x, y):
-        self.__x = x
-        self.__y = y
-
-    # X property
-    def getx(self): return self.__x
-
-    def setx(self, x): self.__x = x
-    x = property(getx, setx)
-
-    # Y property
-    def gety(self): return self.__y
-
-    def sety(self, y): self.__y = y
-    y = property(gety, sety)
+        self.x = x
+        self.y = y
 
 
 # Sprite is widely used in game design. Anything appearing in the game can be a sprite.
@@ -65,36 +502,46 @@ class DynamicSprite(pygame.sprite.Sprite):
         # time is also recorded to control the fps
         self.last_time = 0
 
+    # arguments given to the update function by the update scheduler, most sprites animate per 30 ticks
+    update_arguments = (30,)
+
+    # the collision world which keeps the sprite in its spatial hash, told when the position changes (see
+    # CollisionWorld.moved)
+    world = None
+
     # X property, where X is the x-coordinate of the sprite position on the screen
     def _getx(self): return self.rect.x
 
-    def _setx(self, value): self.rect.x = value
+    def _setx(self, value):
+        self.rect.x = value
+        if self.world:
+            self.world.moved(self)
     X = property(_getx, _setx)
 
     # Y property, where Y is the y-coordinate of the sprite position on the screen
     def _gety(self): return self.rect.y
 
-    def _sety(self, value): self.rect.y = value
+    def _sety(self, value):
+        self.rect.y = value
+        if self.world:
+            self.world.moved(self)
     Y = property(_gety, _sety)
 
     # position property, where position is a combination of x and y
     def _getpos(self): return self.rect.topleft
 
-    def _setpos(self, pos): self.rect.topleft = pos
+    def _setpos(self, pos):
+        self.rect.topleft = pos
+        if self.world:
+            self.world.moved(self)
     position = property(_getpos, _setpos)
 
     # function to load the image for the sprite
     def load(self, filename, width, height, columns):
 
         # load a image file as master_image
-        self.master_image = pygame.image.load(filename).convert_alpha()
-
-        # get_size return the size of the image
-        m_width, m_height = self.master_image.get_size()
-
-        # the whole game is running with a scale factor 3. For example, a brick wall has a 16x16 image.
-        # But it appears as a 48x48 square on the screen
-        self.master_image = pygame.transform.scale(self.master_image, (m_width*3, m_height*3))
+        # the image is decoded and scaled only once and then shared by all the sprites (see get_image)
+        self.master_image = get_image(filename)
 
         # set up frame size
         self.frame_width = width
@@ -122,9 +569,9 @@ class DynamicSprite(pygame.sprite.Sprite):
             frame_x = (self.frame % self.columns) * self.frame_width
             frame_y = (self.frame // self.columns) * self.frame_height
 
-            # cut the subsurface out of the sprite sheet
+            # get the frame out of the sprite sheet
             rect = Rect(frame_x, frame_y, self.frame_width, self.frame_height)
-            self.image = self.master_image.subsurface(rect)
+            self.image = get_frame(self.master_image, rect)
             self.old_frame = self.frame
 
 
@@ -139,40 +586,48 @@ class StaticSprite(pygame.sprite.Sprite):
         self.rect = None
         self.image = None
 
+    # the collision world which keeps the sprite, see DynamicSprite
+    world = None
+
     # X property
     def _getx(self): return self.rect.x
 
-    def _setx(self, value): self.rect.x = value
+    def _setx(self, value):
+        self.rect.x = value
+        if self.world:
+            self.world.moved(self)
     X = property(_getx, _setx)
 
     # Y property
     def _gety(self): return self.rect.y
 
-    def _sety(self, value): self.rect.y = value
+    def _sety(self, value):
+        self.rect.y = value
+        if self.world:
+            self.world.moved(self)
     Y = property(_gety, _sety)
 
     # position property
     def _getpos(self): return self.rect.topleft
 
-    def _setpos(self, pos): self.rect.topleft = pos
+    def _setpos(self, pos):
+        self.rect.topleft = pos
+        if self.world:
+            self.world.moved(self)
     position = property(_getpos, _setpos)
 
     # load up the image for the sprite from a file
     def load(self, filename, width, height, topleft_x, topleft_y):
 
         # load the master image from sprite sheet file
-        self.master_image = pygame.image.load(filename).convert_alpha()
-        m_width, m_height = self.master_image.get_size()
-
-        # resize the master image to fix the screen with a scale factor of 3
-        self.master_image = pygame.transform.scale(self.master_image, (m_width*3, m_height*3))
+        self.master_image = get_image(filename)
 
         # calculate the subsurface size and position
         self.rect = Rect(0, 0, width, height)
         rect = Rect(topleft_x, topleft_y, width, height)
 
         # cut out the useful area on the master_image
-        self.image = self.master_image.subsurface(rect)
+        self.image = get_frame(self.master_image, rect)
 
 
 # classes to define environment objects
@@ -189,6 +644,9 @@ class Water(DynamicSprite):
         self.first_frame = 0
         self.last_frame = 1
 
+    # water flashes per 600 ticks
+    update_arguments = (600,)
+
 
 class Bricks(StaticSprite):
 
@@ -366,35 +824,48 @@ class ArmorTank(pygame.sprite.Sprite):
         self.last_flash_time = 0
         self.last_move_time = 0
 
+    # arguments given to the update function by the update scheduler
+    update_arguments = (30, 10)
+
+    # the collision world which keeps the sprite, see DynamicSprite
+    world = None
+
     # X property, where X is the x-coordinate of the sprite position on the screen
     def _getx(self): return self.rect.x
 
-    def _setx(self, value): self.rect.x = value
+    def _setx(self, value):
+        self.rect.x = value
+        if self.world:
+            self.world.moved(self)
     X = property(_getx, _setx)
 
     # Y property, where Y is the y-coordinate of the sprite position on the screen
     def _gety(self): return self.rect.y
 
-    def _sety(self, value): self.rect.y = value
+    def _sety(self, value):
+        self.rect.y = value
+        if self.world:
+            self.world.moved(self)
     Y = property(_gety, _sety)
 
     # position property
     def _getpos(self): return self.rect.topleft
 
-    def _setpos(self, pos): self.rect.topleft = pos
+    def _setpos(self, pos):
+        self.rect.topleft = pos
+        if self.world:
+            self.world.moved(self)
     position = property(_getpos, _setpos)
 
     # same with the load function for DynamicSprite
     def load(self, filename, width, height, columns):
-        self.master_image = pygame.image.load(filename).convert_alpha()
-        m_width, m_height = self.master_image.get_size()
-        self.master_image = pygame.transform.scale(self.master_image, (m_width*3, m_height*3))
+        self.master_image = get_image(filename)
         self.frame_width = width
         self.frame_height = height
         self.rect = Rect(0, 0, width, height)
         self.columns = columns
         rect = self.master_image.get_rect()
-        self.last_frame = (rect.width // width) * (rect.height // height) - 1
+        self.last_frame = (rect.width // to_frame(width)) * (rect.height // to_frame(height)) - 1
 
     # update function includes two different part
     # update loads the image of next frame(+1) for the tank
@@ -405,8 +876,10 @@ class ArmorTank(pygame.sprite.Sprite):
         if current_time > self.last_update_time + update_rate:
 
             # automatically refresh the frame
+            # the frame also goes back to the first one when it leaves the eight frames of its color, which happens
+            # when the tank flashes to the other color after its frames were chosen
             self.frame += 1
-            if self.frame > self.last_frame:
+            if self.frame > self.last_frame or self.frame % 8 == 0:
                 self.frame = self.first_frame
             self.last_update_time = current_time
 
@@ -458,7 +931,7 @@ class ArmorTank(pygame.sprite.Sprite):
             frame_x = (self.frame % self.columns) * self.frame_width
             frame_y = (self.frame // self.columns) * self.frame_height
             rect = Rect(frame_x, frame_y, self.frame_width, self.frame_height)
-            self.image = self.master_image.subsurface(rect)
+            self.image = get_frame(self.master_image, rect)
             self.old_frame = self.frame
 
 
@@ -472,10 +945,8 @@ class PowerUp(DynamicSprite):
         # the spawn time is recorded in order to kill the PowerUps object when time out
         self.spawn_time = ticks
 
-    # kill the PowerUps object when time out
-    def time_out(self, current_time):
-        if current_time > self.spawn_time + 20000:
-            self.kill()
+    # power-ups flash per 360 ticks
+    update_arguments = (360,)
 
 
 class Grenade(PowerUp):
@@ -495,8 +966,9 @@ class Grenade(PowerUp):
         # kill the grenade image itself
         self.kill()
 
-        # tell the game that no enemy left on the map
+        # tell the game that no enemy left on the map, so the enemies can spawn again
         game_object.enemy_on_map = 0
+        game_object.schedule_spawn()
 
         # remove all the enemies from their group
         game_object.enemy_group.empty()
@@ -539,6 +1011,8 @@ class Helmet(PowerUp):
 
         # record the starting time of apply matchless in order to stop it later
         tank_object.last_powerup_matchless_time = ticks
+        game_object.events.schedule("powerup matchless", ticks + 15000, game_object.end_matchless, tank_object,
+                                    "powerup")
 
 
 class Shovel(PowerUp):
@@ -564,6 +1038,7 @@ class Shovel(PowerUp):
 
         # record the shoveling time in order to cancel the steel walls
         game_object.last_shovel_time = ticks
+        game_object.events.schedule("shovel", ticks + 20000, game_object.end_shovel)
 
 
 class Star(PowerUp):
@@ -622,60 +1097,159 @@ class Timer(PowerUp):
 
         # record the timer time in order to cancel the timer later
         game_object.last_timer_time = ticks
+        game_object.events.schedule("timer", ticks + 15000, game_object.end_timer)
 
         # apply timer
         game_object.apply_timer = True
 
 
-# objects on the right grey edge
-class Counter(StaticSprite):
+# digit images of each color, cut out of the letters sheet once and shared by all the numbers
+glyph_cache = {}
 
-    # initialize Counter object
-    def __init__(self, sprite_type="enemy"):
-        StaticSprite.__init__(self)
 
-        # there are two types of counter for enemies and players
-        # load the images for the counters
-        if sprite_type == "enemy":
-            self.load("images/environment.png", 24, 24, 192, 144)
+# function to get the image of a digit in one of the colors "black", "yellow" and "white"
+def get_glyph(num, num_color="black"):
 
-        elif sprite_type == "player":
-            self.load("images/environment.png", 24, 24, 216, 144)
+    # the ten digits of a color are all prepared the first time the color is used
+    if (num, num_color) not in glyph_cache:
+        letters = get_image("images/letters.png")
+        for digit in range(10):
 
+            # position of frame of the digit needs to be carefully calculated
+            x = digit % 5 * 24
+            y = (digit // 5 + 1) * 24
 
-# same with above
-class Flag(StaticSprite):
-    def __init__(self):
-        StaticSprite.__init__(self)
-        self.load("images/environment.png", 48, 48, 192, 48)
+            # colors also affect the position of the subsurface
+            if num_color == "yellow":
+                y = (digit // 5 + 7) * 24
+            elif num_color == "white":
+                y = (digit // 5 + 9) * 24
+            glyph_cache[(digit, num_color)] = letters.subsurface(frame_rect(Rect(x, y, 24, 24))).copy()
 
+    return glyph_cache[(num, num_color)]
 
-class Number(StaticSprite):
-    def __init__(self, num, num_color="black"):
+
+# NumberText is a whole number drawn as one sprite, with its top right corner at a fixed position.
+# the digits are drawn into a surface which is reused, and only drawn again when the value changes
+class NumberText(StaticSprite):
+    def __init__(self, num_color, topright_x, y, max_digits=6):
         StaticSprite.__init__(self)
+        self.num_color = num_color
+        self.topright = topright_x, y
 
-        # position of frame of the digit needs to be carefully calculated
-        x = num % 5 * 24
-        y = (num // 5 + 1) * 24
+        # value is None until the first number is set
+        self.value = None
 
-        # colors also affect the position of the subsurface
-        if num_color == "yellow":
-            y = (num // 5 + 7) * 24
-        elif num_color == "white":
-            y = (num // 5 + 9) * 24
-        self.load("images/letters.png", 24, 24, x, y)
+        # the digits are drawn on the right side of the surface, which is in the pixels of the frame
+        self.surface = pygame.Surface((to_frame(24) * max_digits, to_frame(24)), SRCALPHA)
 
+        # the part of the surface used for each length of number is also reused
+        self.views = {}
+        self.rect = Rect(topright_x, y, 0, 24)
 
-class PlayerName(StaticSprite):
+    # change the number shown by the sprite
+    def set_value(self, num):
+        if num == self.value:
+            return
+        self.value = num
+        text = str(num)
+        width = 24 * len(text)
+        image_width = to_frame(width)
+
+        # make the surface larger if the number has too many digits
+        if image_width > self.surface.get_width():
+            self.surface = pygame.Surface((image_width, to_frame(24)), SRCALPHA)
+            self.views = {}
+
+        # draw the digits from the right side of the surface
+        surface_width = self.surface.get_width()
+        self.surface.fill((0, 0, 0, 0))
+        x = surface_width - image_width
+        for char in text:
+            self.surface.blit(get_glyph(int(char), self.num_color), (x, 0))
+            x += to_frame(24)
+
+        # use the right part of the surface as the image
+        if width not in self.views:
+            self.views[width] = self.surface.subsurface(Rect(surface_width - image_width, 0, image_width,
+                                                             to_frame(24)))
+        self.image = self.views[width]
+        self.rect = Rect(self.topright[0] - width, self.topright[1], width, 24)
+
+
+# HudPanel is the right grey edge of the battle as one sprite, with the enemy counters, the player life counter,
+# the flag and the number of the level drawn on a surface which is kept, and only drawn again when one of the values
+# shown on it changes
+class HudPanel(StaticSprite):
+
+    # the panel covers the grey edge from the first enemy counter to the number of the level
+    left = 696
+    top = 48
 
-    # initialization of another StaticSprite
-    def __init__(self, name):
+    def __init__(self):
         StaticSprite.__init__(self)
-        if name == 1:
-            self.load("images/letters.png", 48, 24, 0, 72)
+        self.rect = Rect(self.left, self.top, 72, 552)
+
+        # the panel is opaque, and the grey of the edge is its background
+        self.image = pygame.Surface((to_frame(72), to_frame(552))).convert()
+
+        # images drawn on the panel, cut out of the sprite sheets only once
+        environment = get_image("images/environment.png")
+        self.enemy_counter = get_frame(environment, (192, 144, 24, 24))
+        self.player_counter = get_frame(environment, (216, 144, 24, 24))
+        self.flag = get_frame(environment, (192, 48, 48, 48))
+        self.player_name = get_frame(get_image("images/letters.png"), (0, 72, 48, 24))
+
+        # values shown on the panel, None until the first values are set
+        self.enemies = None
+        self.lives = None
+        self.level = None
+
+        # number of times the panel was drawn
+        self.redraws = 0
+
+    # change the values shown on the panel, and draw it again only if one of them is different
+    def set_values(self, enemies, lives, level):
+        if enemies == self.enemies and lives == self.lives and level == self.level:
+            return
+        self.enemies = enemies
+        self.lives = lives
+        self.level = level
+        self.redraw()
+
+    # draw an image on the panel at a position of the game
+    def blit(self, image, x, y):
+        self.image.blit(image, (to_frame(x - self.left), to_frame(y - self.top)))
+
+    # draw a number on the panel, from its top left or its top right corner
+    def blit_number(self, num, x, y, right=False):
+        text = str(num)
+        if right:
+            x -= 24 * len(text)
+        for char in text:
+            self.blit(get_glyph(int(char)), x, y)
+            x += 24
+
+    # draw all the values on the panel
+    def redraw(self):
+        self.redraws += 1
+        self.image.fill((127, 127, 127))
+
+        # two columns of enemy counters, one for each enemy which hasn't spawned yet
+        for i in range(self.enemies):
+            x = 720
+            if i % 2 == 0:
+                x = 696
+            self.blit(self.enemy_counter, x, 48 + (i // 2) * 24)
+
+        # the name and the life counter of the player
+        self.blit(self.player_name, 696, 360)
+        self.blit(self.player_counter, 696, 384)
+        self.blit_number(self.lives, 720, 384)
 
-        elif name == 2:
-            self.load("images/letters.png", 48, 24, 24, 72)
+        # the flag and the number of the level
+        self.blit(self.flag, 696, 528)
+        self.blit_number(self.level, 744, 576, True)
 
 
 # objects may appear on the screen as texts
@@ -781,10 +1355,16 @@ class Explosion(DynamicSprite):
         # Explosion has a frame size of 96 * 96 pixel
         rect = Rect(0, 0, 96, 96)
 
-        # get the subsurface for the explosion master image
-        self.image = self.master_image.subsurface(rect)
+        # get the first frame of the explosion
+        self.image = get_frame(self.master_image, rect)
         self.explosion_type = explosion_type
 
+    # explosion has a special update function, which is the explode function below
+    update_arguments = (120,)
+
+    def update(self, current_time, rate=120):
+        self.explode(current_time, rate)
+
     # explode function changes the frame of the Explosion object to form an explosion
     def explode(self, current_time, rate=120):
         kill_frame = 0
@@ -808,7 +1388,7 @@ class Explosion(DynamicSprite):
             rect = Rect(x, y, 96, 96)
 
             # update the image
-            self.image = self.master_image.subsurface(rect)
+            self.image = get_frame(self.master_image, rect)
 
             # when the frame number is greater than the kill frame number, kill the object
             if self.frame == kill_frame:
@@ -823,19 +1403,23 @@ class MenuImage(StaticSprite):
         self.position = 0, 672
 
 
-# function to calculate the velocity depending on directions
+# the change of x and y of one pixel of movement towards each direction
 # direction are recorded in even numbers which also represent the frame position of each direction
-def calc_velocity(direction, vel):
-    velocity = Point(0, 0)
-    if direction == 0:  # north
-        velocity.y = -vel
-    elif direction == 2:  # west
-        velocity.x = -vel
-    elif direction == 4:  # south
-        velocity.y = vel
-    elif direction == 6:  # east
-        velocity.x = vel
-    return velocity
+direction_steps = ((0, -1), (0, 0), (-1, 0), (0, 0), (0, 1), (0, 0), (1, 0), (0, 0))
+
+
+# function to set the velocity of a sprite depending on directions
+# the velocity point of the sprite is changed in place, so moving doesn't create a new point every frame
+def set_velocity(velocity, direction, vel):
+    step_x, step_y = direction_steps[direction]
+    velocity.x = vel * step_x if step_x else 0
+    velocity.y = vel * step_y if step_y else 0
+
+
+# function to choose the target of an enemy tank
+# an enemy attacks the base, hunts the player or, half of the time, wanders around (target None)
+def choose_target(enemy):
+    enemy.target = random.choice(["eagle", "player", None, None])
 
 
 # function to reverse the direction of moving objects, especially for enemy tanks
@@ -909,45 +1493,1362 @@ def fire_position(x, y, direction):
     return x, y
 
 
-# function to play the audio clip
-def play_sound(sound):
+# priority of each sound, when all the channels are busy a sound takes the channel of a sound which matters less
+sound_priorities = {"brick": 0, "steel": 0, "fire": 1, "explosion": 2, "bonus": 2, "score": 2, "gamestart": 3,
+                    "gameover": 3}
+
+# number of channels used for the sounds of the game
+channel_budget = 8
+
+
+# Mixer plays the sounds of the game on a fixed number of channels.
+# a sound asked for more than once in the same frame is played only once, and when all the channels are busy the
+# sound takes the channel of the oldest sound with the lowest priority, or is dropped if every sound playing matters
+# more. the sounds asked for and the sounds played are counted
+class Mixer(object):
+
+    # initialize Mixer class with the number of channels
+    def __init__(self, budget):
+        self.budget = budget
+
+        # the channels are created when the first sound is played
+        self.channels = None
+
+        # priority and order of start of the sound playing on each channel
+        self.priorities = [0] * budget
+        self.started = [0] * budget
+        self.sequence = 0
+
+        # sounds already asked for in the current frame, the frame is known by the ticks
+        self.frame_ticks = None
+        self.frame_sounds = set()
+
+        # counters of the sounds
+        self.requested = 0
+        self.played = 0
+        self.coalesced = 0
+        self.stolen = 0
+        self.dropped = 0
+
+    # find the channel for a sound of a priority, None if every channel plays a sound of a higher priority
+    def find_channel(self, priority):
+        best = None
+        for index, channel in enumerate(self.channels):
+
+            # a free channel is used at once
+            if not channel.get_busy():
+                return index
+
+            # otherwise the oldest sound with the lowest priority gives its channel
+            if self.priorities[index] <= priority:
+                if best is None or (self.priorities[index], self.started[index]) < \
+                        (self.priorities[best], self.started[best]):
+                    best = index
+        return best
+
+    # play a sound by its name
+    def play(self, sound):
+        self.requested += 1
+
+        # the same sound is only played once in a frame
+        if ticks != self.frame_ticks:
+            self.frame_ticks = ticks
+            self.frame_sounds.clear()
+        if sound in self.frame_sounds:
+            self.coalesced += 1
+            return
+        self.frame_sounds.add(sound)
 
-    # combine the name str to make a file name
-    file_name = "sounds/" + sound + ".ogg"
+        # no sound is played if the mixer cannot be (or must not be) initialized, for example in a headless run
+        if not init_mixer():
+            return
+
+        if self.channels is None:
+            pygame.mixer.set_num_channels(self.budget)
+            self.channels = [pygame.mixer.Channel(i) for i in range(self.budget)]
+
+        priority = sound_priorities.get(sound, 1)
+        index = self.find_channel(priority)
+        if index is None:
+            self.dropped += 1
+            return
+        if self.channels[index].get_busy():
+            self.stolen += 1
 
-    # load the sound from a file
-    audio_clip = pygame.mixer.Sound(file_name)
+        # play the sound clip, which is loaded from a file the first time it is played
+        self.priorities[index] = priority
+        self.sequence += 1
+        self.started[index] = self.sequence
+        self.channels[index].play(get_sound(sound))
+        self.played += 1
 
-    # find an empty channel to play the sound
-    # "True" force the program to find a channel, which can be the least using channel
-    channel = pygame.mixer.find_channel(True)
 
-    # play the sound clip
-    channel.play(audio_clip)
+# the mixer of the game, see main for the number of channels
+sound_mixer = Mixer(channel_budget)
+
+
+# function to play the audio clip
+def play_sound(sound):
+    sound_mixer.play(sound)
 
 
 # print the numbers with the original font on the screen
+# the number is a NumberText sprite, which is returned so that its value can be changed later
 def print_number(num, num_color, topright_x, y, group):
+    number = NumberText(num_color, topright_x, y)
+    number.set_value(num)
+    group.add(number)
+    return number
+
+
+# kinds of environment recorded on the terrain grid
+TERRAIN_BRICKS = 0
+TERRAIN_STEEL = 1
+TERRAIN_WATER = 2
+TERRAIN_TREES = 3
+TERRAIN_ICE = 4
+TERRAIN_EAGLE = 5
+terrain_kinds = 6
+
+# the environment that tanks can't drive through
+tank_blocking_kinds = (TERRAIN_BRICKS, TERRAIN_STEEL, TERRAIN_WATER, TERRAIN_EAGLE)
+
+# layers of the battle drawn by the layered renderer, from the bottom to the top
+# the counters on the grey edge are below the tanks, so a large explosion at the edge of the battlefield covers
+# them, the enemies are above the player and its matchless when they meet at a spawn position, trees are drawn
+# above the tanks and the bullets to hide them, power-ups are drawn above the trees and the game over text rises
+# above everything
+LAYER_TERRAIN = 0
+LAYER_HUD = 1
+LAYER_PLAYER = 2
+LAYER_MATCHLESS = 3
+LAYER_ENEMIES = 4
+LAYER_BULLETS = 5
+LAYER_EXPLOSIONS = 6
+LAYER_TREES = 7
+LAYER_POWERUPS = 8
+LAYER_TEXT = 9
+layer_count = 10
+
+# the layers which are drawn on the screen itself, the others are drawn on the battlefield
+screen_layers = (LAYER_HUD, LAYER_TEXT)
+
+# the layers whose sprites never move
+static_layers = (LAYER_TERRAIN, LAYER_TREES)
+
+# bits of the things found by the collision world (see CollisionWorld), a query looks for the bits of a mask
+HIT_BRICKS = 1
+HIT_STEEL = 2
+HIT_WATER = 4
+HIT_TREES = 8
+HIT_ICE = 16
+HIT_EAGLE = 32
+HIT_PLAYER = 64
+HIT_ENEMIES = 128
+HIT_ARMOR = 256
+HIT_BULLETS = 512
+HIT_POWERUPS = 1024
+
+# the bits of the kinds of environment, in the order of the kinds, and the bits of the sprites which aren't
+terrain_hits = (HIT_BRICKS, HIT_STEEL, HIT_WATER, HIT_TREES, HIT_ICE, HIT_EAGLE)
+sprite_hits = HIT_PLAYER | HIT_ENEMIES | HIT_ARMOR | HIT_BULLETS | HIT_POWERUPS
+
+# the environment that tanks can't drive through, and the things a bullet collides with
+tank_blocking_hits = HIT_BRICKS | HIT_STEEL | HIT_WATER | HIT_EAGLE
+bullet_hits = HIT_BRICKS | HIT_STEEL | HIT_EAGLE | HIT_BULLETS | HIT_PLAYER | HIT_ENEMIES | HIT_ARMOR
+
+
+# TerrainGrid records which kinds of environment cover each 12x12 square of the battlefield.
+# 12 pixels is the size of the smallest environment object, a small brick.
+# the grid is kept up to date by the terrain groups (see TerrainGroup), so the rest of the game can look at the
+# terrain around a position without going through the thousands of sprites in the groups
+class TerrainGrid(object):
+
+    # initialize TerrainGrid class with the area of the battlefield on the screen
+    def __init__(self, left, top, width, height):
+        self.left = left
+        self.top = top
+        self.cols = width // 12
+        self.rows = height // 12
+
+        # a counter of sprites for each square and each kind of environment
+        self.counts = [bytearray(self.cols * self.rows) for kind in range(terrain_kinds)]
+
+        # version is changed every time the terrain changes, which allows other objects to detect the change
+        self.version = 0
+
+        # listeners are functions which are told about every change of the terrain
+        # they are called with the changed squares, the kind of the environment and whether it was added
+        self.listeners = []
+
+    # function to find the squares covered by a rectangle on the screen
+    # return the first column, the first row and the column and row after the last ones
+    def squares(self, rect):
+        col_0 = max((rect.left - self.left) // 12, 0)
+        row_0 = max((rect.top - self.top) // 12, 0)
+        col_1 = min((rect.right - self.left + 11) // 12, self.cols)
+        row_1 = min((rect.bottom - self.top + 11) // 12, self.rows)
+        return col_0, row_0, col_1, row_1
+
+    # function to add or remove a piece of environment
+    def change(self, rect, kind, added):
+        col_0, row_0, col_1, row_1 = self.squares(rect)
+        amount = 1 if added else -1
+        counts = self.counts[kind]
+        for row in range(row_0, row_1):
+            for i in range(row * self.cols + col_0, row * self.cols + col_1):
+                counts[i] += amount
+
+        self.version += 1
+        for listener in self.listeners:
+            listener(col_0, row_0, col_1, row_1, kind, added)
+
+    # function to check whether any of the squares in an area has one of the given kinds of environment
+    def has(self, col_0, row_0, col_1, row_1, kinds):
+        for kind in kinds:
+            counts = self.counts[kind]
+            for row in range(row_0, row_1):
+                start = row * self.cols
+                if any(counts[start + col_0:start + col_1]):
+                    return True
+        return False
+
+
+# UpdateScheduler keeps the sprites which animate or think, such as water, tanks, power-ups, the matchless
+# pattern and explosions, and updates them with the arguments of their update function (see update_arguments).
+# static sprites such as bricks, steel, trees and ice never join it, so they cost nothing in a frame
+class UpdateScheduler(object):
+
+    # initialize UpdateScheduler class
+    def __init__(self):
 
-    # length of the number is calculated as each digit is a individual sprite
-    length = len(str(num))
-    for i in range(length):
+        # the registered sprites, in the order they were registered
+        self.sprites = {}
 
-        # get the digit by modding 10
-        digit = num % 10
+        # number of update calls in the last frame
+        self.calls = 0
 
-        # remove the digit which has been recorded
-        num //= 10
+        # the sprites being updated in this frame, as updating a sprite may register or unregister others
+        # the same list is used for every frame
+        self.updating = []
 
-        # calculate the x coordinate for the digit based on the x coordinate of the last digit of the whole number
-        x = topright_x - 24 * (i + 1)
+    def register(self, sprite):
+        self.sprites[sprite] = None
 
-        # create a number sprite
-        number = Number(digit, num_color)
+    def unregister(self, sprite):
+        self.sprites.pop(sprite, None)
 
-        # place the sprite on the map
-        number.position = x, y
-        group.add(number)
+    # update all the registered sprites
+    def update(self, current_time):
+        self.calls = 0
+        updating = self.updating
+        updating.extend(self.sprites)
+        for sprite in updating:
+            sprite.update(current_time, *sprite.update_arguments)
+            self.calls += 1
+        updating.clear()
+
+
+# EventScheduler calls functions at deadlines, such as the end of a shovel or the next spawn of an enemy.
+# the events are kept in a heap ordered by their time, so a frame only looks at the events which are due.
+# every event has a key, scheduling an event with the key of a pending event replaces the pending one
+class EventScheduler(object):
+
+    # initialize EventScheduler class
+    def __init__(self):
+
+        # heap of the events, each event is a list of time, sequence number, key, function and arguments
+        # the sequence number keeps the events of the same time in the order they were scheduled
+        self.heap = []
+        self.sequence = 0
+
+        # the pending events by key, a cancelled event stays in the heap without its function
+        self.pending = {}
+
+    # schedule a function to be called with the given arguments once the time has passed
+    def schedule(self, key, time, function, *arguments):
+        self.cancel(key)
+        event = [time, self.sequence, key, function, arguments]
+        self.sequence += 1
+        self.pending[key] = event
+        heapq.heappush(self.heap, event)
+
+    def cancel(self, key):
+        event = self.pending.pop(key, None)
+        if event:
+            event[3] = None
+
+    # time of the next pending event, None when there is no event
+    def next_time(self):
+        while self.heap and self.heap[0][3] is None:
+            heapq.heappop(self.heap)
+        if self.heap:
+            return self.heap[0][0]
+        return None
+
+    # call the functions of the events whose time has passed, in the order of their times
+    def run(self, current_time):
+        while self.heap and self.heap[0][0] < current_time:
+            time, sequence, key, function, arguments = heapq.heappop(self.heap)
+            if function:
+                del self.pending[key]
+                function(*arguments)
+
+
+# LayeredRenderer draws the sprites of the battle in one pass, layer by layer (see LAYER_TERRAIN and others).
+# every sprite is registered once by its group, the sprites of a layer are drawn in the order they were added.
+# the sprites of the static layers are also kept in square chunks of the battlefield, so that the view of a large
+# arena only looks at the chunks it shows
+class LayeredRenderer(object):
+
+    # size of a chunk in pixels
+    chunk_size = 624
+
+    # initialize LayeredRenderer class
+    def __init__(self):
+
+        # the sprites of each layer, in the order they were added
+        self.layers = [{} for i in range(layer_count)]
+
+        # the chunks of each static layer by their column and row
+        self.chunks = dict((layer, {}) for layer in static_layers)
+
+    # function to find the chunk of a sprite, static sprites are placed before they are added
+    def chunk(self, sprite, layer):
+        key = sprite.rect.x // self.chunk_size, sprite.rect.y // self.chunk_size
+        return self.chunks[layer].setdefault(key, {})
+
+    def add(self, sprite, layer):
+        self.layers[layer][sprite] = None
+        if layer in self.chunks:
+            self.chunk(sprite, layer)[sprite] = None
+
+    def remove(self, sprite, layer):
+        self.layers[layer].pop(sprite, None)
+        if layer in self.chunks:
+            self.chunk(sprite, layer).pop(sprite, None)
+
+    # draw all the sprites on the surface with a single batch of blits
+    def draw(self, surface):
+        draw_sprites(surface, (sprite for layer in self.layers for sprite in layer))
+
+    # draw the part of a large arena seen through a view, with the top left corner of the view at a position on the
+    # screen, the sprites of the screen layers are drawn at their own positions above the arena
+    def draw_view(self, surface, view, left, top):
+
+        # the sprites only cover the battlefield on the screen
+        clip = surface.get_clip()
+        surface.set_clip(frame_rect(Rect(left, top, view.width, view.height)))
+        draw_sprites(surface, self.sprites_seen(view), left - view.x, top - view.y)
+        surface.set_clip(clip)
+        draw_sprites(surface, (sprite for layer in screen_layers for sprite in self.layers[layer]))
+
+    # function to go through the sprites of the arena seen through a view, layer by layer
+    # the sprites are given one at a time to the blits, without building a list of them
+    def sprites_seen(self, view):
+        for layer, layer_sprites in enumerate(self.layers):
+            if layer in screen_layers:
+                continue
+
+            # a static sprite is found in the chunk of its top left corner, which may be up to a tile before the view
+            if layer in self.chunks:
+                chunks = self.chunks[layer]
+                for row in range((view.top - 48) // self.chunk_size, (view.bottom - 1) // self.chunk_size + 1):
+                    for col in range((view.left - 48) // self.chunk_size, (view.right - 1) // self.chunk_size + 1):
+                        chunk = chunks.get((col, row))
+                        if chunk:
+                            for sprite in chunk:
+                                if view.colliderect(sprite.rect):
+                                    yield sprite
+            else:
+                for sprite in layer_sprites:
+                    if view.colliderect(sprite.rect):
+                        yield sprite
+
+
+# GameGroup is a sprite group of the battle which registers its sprites on the layered renderer, on an update
+# scheduler and on a collision world when they are added, and unregisters them when they are removed or killed.
+# a group without a renderer isn't drawn, a group without a scheduler isn't updated and a group without a world isn't
+# found by collision queries
+class GameGroup(pygame.sprite.Group):
+
+    # initialize GameGroup class
+    def __init__(self, renderer=None, layer=LAYER_TERRAIN, scheduler=None, world=None, hit=0):
+        pygame.sprite.Group.__init__(self)
+        self.renderer = renderer
+        self.layer = layer
+        self.scheduler = scheduler
+        self.world = world
+        self.hit = hit
+
+    def add_internal(self, sprite, layer=None):
+        pygame.sprite.Group.add_internal(self, sprite)
+        if self.renderer:
+            self.renderer.add(sprite, self.layer)
+        if self.scheduler:
+            self.scheduler.register(sprite)
+        if self.world:
+            self.world.add(sprite, self.hit)
+
+    def remove_internal(self, sprite):
+        pygame.sprite.Group.remove_internal(self, sprite)
+        if self.renderer:
+            self.renderer.remove(sprite, self.layer)
+        if self.scheduler:
+            self.scheduler.unregister(sprite)
+        if self.world:
+            self.world.remove(sprite)
+
+
+# TerrainGroup is a sprite group which writes its sprites on the terrain grid.
+# the grid is changed whenever a sprite is added to the group or removed from it, including sprite.kill(),
+# so sprites must be placed at their position before being added.
+# the group also keeps its sprites by the squares they cover, so the sprites hit at a position are found without
+# going through the whole group
+class TerrainGroup(GameGroup):
+
+    # initialize TerrainGroup class with the grid and the kind of environment of the sprites
+    # environment which animates, such as water, also needs the update scheduler
+    # the collision world finds the sprites of the group in its squares, so they aren't added to the spatial hash
+    def __init__(self, terrain, kind, renderer=None, layer=LAYER_TERRAIN, scheduler=None, world=None):
+        GameGroup.__init__(self, renderer, layer, scheduler)
+        self.terrain = terrain
+        self.kind = kind
+
+        # the sprites covering each square, by the index of the square
+        self.cells = {}
+
+        if world:
+            world.add_grid(self, terrain_hits[kind])
+
+    # function to find the indices of the squares covered by a rectangle
+    def cell_indices(self, rect):
+        col_0, row_0, col_1, row_1 = self.terrain.squares(rect)
+        cols = self.terrain.cols
+        return [i for row in range(row_0, row_1) for i in range(row * cols + col_0, row * cols + col_1)]
+
+    def add_internal(self, sprite, layer=None):
+        GameGroup.add_internal(self, sprite)
+        self.terrain.change(sprite.rect, self.kind, True)
+        for i in self.cell_indices(sprite.rect):
+            self.cells.setdefault(i, {})[sprite] = None
+
+    def remove_internal(self, sprite):
+        GameGroup.remove_internal(self, sprite)
+        self.terrain.change(sprite.rect, self.kind, False)
+        for i in self.cell_indices(sprite.rect):
+            self.cells[i].pop(sprite, None)
+
+    # function to find the sprites of the group colliding with a rectangle
+    def colliding(self, rect):
+        found = {}
+        for i in self.cell_indices(rect):
+            for sprite in self.cells.get(i, ()):
+                if rect.colliderect(sprite.rect):
+                    found[sprite] = None
+        return list(found)
+
+    # function to check whether any sprite of the group collides with a rectangle
+    def collides(self, rect):
+        col_0, row_0, col_1, row_1 = self.terrain.squares(rect)
+        return self.terrain.has(col_0, row_0, col_1, row_1, (self.kind,))
+
+
+# CollisionWorld finds what collides with a rectangle across several groups of the battle in one query.
+# every group which collides has a bit (see HIT_BRICKS and others) and a query looks for the bits of a mask.
+# the environment is found on the terrain grid and in the squares of the terrain groups, while tanks, bullets and
+# power-ups are kept in a spatial hash of buckets, which follows the sprites when their position changes (see moved)
+class CollisionWorld(object):
+
+    # size of a bucket of the spatial hash in pixels
+    bucket_size = 48
+
+    # the empty bucket and the empty result of a query, shared so that looking at nothing builds nothing
+    # neither of them is ever changed
+    no_sprites = {}
+    no_hits = {}
+
+    # initialize CollisionWorld class with the terrain grid
+    def __init__(self, terrain):
+        self.terrain = terrain
+
+        # the terrain groups by their bits
+        self.grids = {}
+
+        # the sprites in each bucket with their bits, by the column and the row of the bucket
+        self.buckets = {}
+
+        # the bit, the buckets and the area of the buckets of each sprite in the spatial hash
+        self.places = {}
+
+        # the order the sprites were added in, so the sprites of a group are found in the order of the group
+        self.order = {}
+        self.sequence = 0
+
+        # the kinds of environment and the terrain groups of each mask asked for
+        self.masks = {}
+        self.mask_grids = {}
+
+    # function to find the buckets covered by a rectangle
+    # return the first column, the first row and the column and row after the last ones
+    def bucket_range(self, rect):
+        size = self.bucket_size
+        return rect.left // size, rect.top // size, (rect.right - 1) // size + 1, (rect.bottom - 1) // size + 1
+
+    # function to find the kinds of environment of the bits of a mask
+    def terrain_kinds(self, mask):
+        if mask not in self.masks:
+            self.masks[mask] = tuple(kind for kind, bit in enumerate(terrain_hits) if mask & bit)
+        return self.masks[mask]
+
+    # function to find the bits and the squares of the terrain groups of the bits of a mask
+    def terrain_grids(self, mask):
+        if mask not in self.mask_grids:
+            self.mask_grids[mask] = tuple((bit, group.cells) for bit, group in self.grids.items() if mask & bit)
+        return self.mask_grids[mask]
+
+    # a terrain group keeps its sprites by the squares of the terrain grid, so they are found there
+    def add_grid(self, group, bit):
+        self.grids[bit] = group
+        self.mask_grids.clear()
+
+    def add(self, sprite, bit):
+        self.fill(sprite, bit, self.bucket_range(sprite.rect))
+        self.order[sprite] = self.sequence
+        self.sequence += 1
+        sprite.world = self
+
+    def remove(self, sprite):
+        bit, place, area = self.places.pop(sprite)
+        self.empty(sprite, place)
+        del self.order[sprite]
+        sprite.world = None
+
+    # function called by a sprite of the spatial hash when its position has changed
+    # the sprite stays in its buckets as long as it is inside them, being in a bucket too many only costs a test
+    def moved(self, sprite):
+        bit, place, area = self.places[sprite]
+        if not area.contains(sprite.rect):
+            self.empty(sprite, place)
+            self.fill(sprite, bit, self.bucket_range(sprite.rect))
+
+    # function to put a sprite in the buckets of an area
+    def fill(self, sprite, bit, place):
+        col_0, row_0, col_1, row_1 = place
+        for row in range(row_0, row_1):
+            for col in range(col_0, col_1):
+                bucket = self.buckets.get((col, row))
+                if bucket is None:
+                    bucket = self.buckets[(col, row)] = {}
+                bucket[sprite] = bit
+        size = self.bucket_size
+        area = Rect(col_0 * size, row_0 * size, (col_1 - col_0) * size, (row_1 - row_0) * size)
+        self.places[sprite] = bit, place, area
+
+    # function to take a sprite out of the buckets of an area
+    def empty(self, sprite, place):
+        col_0, row_0, col_1, row_1 = place
+        for row in range(row_0, row_1):
+            for col in range(col_0, col_1):
+                bucket = self.buckets[(col, row)]
+                del bucket[sprite]
+                if not bucket:
+                    del self.buckets[(col, row)]
+
+    # function to find everything of the bits of a mask colliding with a rectangle, except a sprite which may be
+    # given, such as the bullet asking. return the colliding sprites by their bits, only for the bits found
+    # nothing is built while nothing is found, as most queries of a bullet find nothing
+    def query(self, rect, mask, ignore=None):
+        hits = None
+
+        # the environment is looked for square by square, in the same order as TerrainGroup.colliding
+        grids = self.terrain_grids(mask)
+        if grids:
+            col_0, row_0, col_1, row_1 = self.terrain.squares(rect)
+            cols = self.terrain.cols
+            for row in range(row_0, row_1):
+                for i in range(row * cols + col_0, row * cols + col_1):
+                    for bit, cells in grids:
+                        for sprite in cells.get(i, ()):
+                            if rect.colliderect(sprite.rect):
+                                if hits is None:
+                                    hits = {}
+                                if bit not in hits:
+                                    hits[bit] = {}
+                                hits[bit][sprite] = None
+
+        # the other sprites are looked for in the buckets, and given in the order they were added
+        if mask & sprite_hits:
+            found = None
+            col_0, row_0, col_1, row_1 = self.bucket_range(rect)
+            for row in range(row_0, row_1):
+                for col in range(col_0, col_1):
+                    for sprite, bit in self.buckets.get((col, row), self.no_sprites).items():
+                        if mask & bit and sprite is not ignore and rect.colliderect(sprite.rect):
+                            if found is None:
+                                found = {}
+                            found[sprite] = bit
+            if found:
+                if hits is None:
+                    hits = {}
+                for sprite in sorted(found, key=self.order.get):
+                    bit = found[sprite]
+                    if bit not in hits:
+                        hits[bit] = {}
+                    hits[bit][sprite] = None
+
+        if hits is None:
+            return self.no_hits
+        return dict((bit, list(sprites)) for bit, sprites in hits.items())
+
+    # function to check whether anything of the bits of a mask collides with a rectangle, except a sprite which may
+    # be given. the environment only needs a look at the terrain grid
+    def collides(self, rect, mask, ignore=None):
+        kinds = self.terrain_kinds(mask)
+        if kinds and self.terrain.has(*self.terrain.squares(rect), kinds=kinds):
+            return True
+        if not mask & sprite_hits:
+            return False
+        col_0, row_0, col_1, row_1 = self.bucket_range(rect)
+        for row in range(row_0, row_1):
+            for col in range(col_0, col_1):
+                for sprite, bit in self.buckets.get((col, row), self.no_sprites).items():
+                    if mask & bit and sprite is not ignore and rect.colliderect(sprite.rect):
+                        return True
+        return False
+
+
+# FlowField is a map of distances towards the targets of the enemies ("eagle" and "player").
+# a node is a position where a tank can stand, which is every 24 pixels on the battlefield.
+# the distances are calculated once for all the enemies, so an enemy only needs to compare its 4 neighbour
+# nodes to find the way. bricks can be passed by shooting them, which costs more than driving,
+# while steel, water and the eagle can't be passed at all.
+# when bricks are destroyed the distances are improved from the opened nodes only, other changes of the
+# terrain (such as the shovel) calculate the distances again.
+# a target may have a limit, the distances are only spread up to the limit and the nodes further away can't reach it
+class FlowField(object):
+
+    # moving onto a node costs 1, or brick cost if there are bricks to shoot through
+    brick_cost = 5
+
+    # distance used for the nodes which can't reach the target
+    unreachable = 1 << 30
+
+    # the directions a tank can move towards and the change of node of each direction
+    steps = ((0, 0, -1), (2, -1, 0), (4, 0, 1), (6, 1, 0))
+
+    # initialize FlowField class with the terrain grid
+    def __init__(self, terrain):
+        self.terrain = terrain
+
+        # a tank covers 4x4 squares and nodes are 2 squares apart
+        self.cols = (terrain.cols - 4) // 2 + 1
+        self.rows = (terrain.rows - 4) // 2 + 1
+
+        # cost of moving onto each node, None means the node can't be passed
+        self.costs = [1] * (self.cols * self.rows)
+
+        # the changes of terrain which haven't been applied to the costs yet
+        self.pending = []
+
+        # number of nodes whose costs have been calculated by prepare
+        self.prepared_nodes = 0
+
+        # fields records the goals, the direction to face at each goal and the distances of each target
+        self.fields = {}
+
+        # follow the changes of the terrain
+        terrain.listeners.append(self.terrain_changed)
+
+    # function called by the terrain grid when some squares are changed
+    def terrain_changed(self, col_0, row_0, col_1, row_1, kind, added):
+
+        # only environment blocking tanks changes the costs
+        if kind in tank_blocking_kinds:
+            self.pending.append((col_0, row_0, col_1, row_1))
+
+    # function to find the node of a tank on the screen, None if the tank isn't exactly on a node
+    def node_at(self, x, y):
+        x -= self.terrain.left
+        y -= self.terrain.top
+        if x % 24 != 0 or y % 24 != 0:
+            return None
+        col = x // 24
+        row = y // 24
+        if 0 <= col < self.cols and 0 <= row < self.rows:
+            return row * self.cols + col
+        return None
+
+    # function to find the node nearest to a position on the screen
+    def nearest_node(self, x, y):
+        col = min(max((x - self.terrain.left + 12) // 24, 0), self.cols - 1)
+        row = min(max((y - self.terrain.top + 12) // 24, 0), self.rows - 1)
+        return row * self.cols + col
+
+    # function to calculate the distance from a position to the next node when moving towards a direction
+    def distance_to_node(self, x, y, direction):
+        if direction == 0:
+            return (y - self.terrain.top) % 24 or 24
+        elif direction == 2:
+            return (x - self.terrain.left) % 24 or 24
+        elif direction == 4:
+            return -(y - self.terrain.top) % 24 or 24
+        return -(x - self.terrain.left) % 24 or 24
+
+    # function to set the goals of a target
+    # goals is a dictionary of the goal nodes and the direction a tank should face at each of them
+    def set_goal(self, target, goals, limit=None):
+        field = self.fields.get(target)
+        if field is None or field["goals"] != goals:
+            self.fields[target] = {"goals": goals, "distances": None, "limit": limit}
+
+    # function to set a single goal node of a target, with no direction to face at it
+    # the goals are only built again when the node has changed, as the goal of the player is set every frame
+    def set_goal_node(self, target, node, limit=None):
+        field = self.fields.get(target)
+        if field is None or len(field["goals"]) != 1 or field["goals"].get(node, 0) is not None:
+            self.set_goal(target, {node: None}, limit)
+
+    # function to set the goals around a rectangle, such as the eagle
+    # goals are the nodes right above, below, left and right of the rectangle, facing the rectangle
+    def set_goal_around(self, target, rect):
+        col = (rect.x - self.terrain.left) // 24
+        row = (rect.y - self.terrain.top) // 24
+        size_x = rect.width // 24
+        size_y = rect.height // 24
+        goals = {}
+        for direction, goal_col, goal_row in [(4, col, row - 2), (6, col - 2, row),
+                                              (2, col + size_x, row), (0, col, row + size_y)]:
+            if 0 <= goal_col < self.cols and 0 <= goal_row < self.rows:
+                goals[goal_row * self.cols + goal_col] = direction
+        self.set_goal(target, goals)
+
+    # function to calculate the cost of moving onto a node from the terrain
+    def node_cost(self, node):
+        col_0 = node % self.cols * 2
+        row_0 = node // self.cols * 2
+        area = col_0, row_0, col_0 + 4, row_0 + 4
+        if self.terrain.has(*area, kinds=(TERRAIN_STEEL, TERRAIN_WATER, TERRAIN_EAGLE)):
+            return None
+        if self.terrain.has(*area, kinds=(TERRAIN_BRICKS,)):
+            return 1 + self.brick_cost
+        return 1
+
+    # function to apply the pending terrain changes to the costs
+    # return the nodes which became cheaper, or None if any node became more expensive
+    def apply_pending(self):
+        cheaper = []
+        more_expensive = False
+        changed = set()
+
+        # find the nodes covering the changed squares
+        for col_0, row_0, col_1, row_1 in self.pending:
+            for row in range(max((row_0 - 4) // 2 + 1, 0), min((row_1 - 1) // 2 + 1, self.rows)):
+                for col in range(max((col_0 - 4) // 2 + 1, 0), min((col_1 - 1) // 2 + 1, self.cols)):
+                    changed.add(row * self.cols + col)
+        self.pending = []
+
+        for node in changed:
+            old_cost = self.costs[node]
+            new_cost = self.node_cost(node)
+            self.costs[node] = new_cost
+            if new_cost == old_cost:
+                continue
+            if new_cost is None or (old_cost is not None and new_cost > old_cost):
+                more_expensive = True
+            else:
+                cheaper.append(node)
+
+        if more_expensive:
+            return None
+        return cheaper
+
+    # function to find the neighbour nodes of a node with the direction towards them
+    def neighbours(self, node):
+        col = node % self.cols
+        row = node // self.cols
+        for direction, step_col, step_row in self.steps:
+            next_col = col + step_col
+            next_row = row + step_row
+            if 0 <= next_col < self.cols and 0 <= next_row < self.rows:
+                yield direction, next_row * self.cols + next_col
+
+    # function to spread the distances from some nodes to the rest of the map, or up to the limit
+    # the nodes are taken in order of distance so that each node gets its shortest distance.
+    # with a budget, at most that many nodes are taken and the spreading goes on from the heap at the next call
+    # return True when the spreading has finished
+    def spread(self, distances, heap, limit=None, budget=None):
+        costs = self.costs
+        while heap:
+            if budget is not None:
+                if budget == 0:
+                    return False
+                budget -= 1
+            distance, node = heapq.heappop(heap)
+            if distance > distances[node]:
+                continue
+            if limit is not None and distance >= limit:
+                break
+
+            # reaching this node from a neighbour costs the cost of the node
+            # a goal is spread from even when a tank can't stand on it, as when the shovel has turned the base around
+            # the eagle to steel, so the tanks still find their way next to it
+            cost = costs[node]
+            if cost is None:
+                if distance > 0:
+                    continue
+                cost = 1
+            distance += cost
+            for direction, neighbour in self.neighbours(node):
+                if costs[neighbour] is not None and distance < distances[neighbour]:
+                    distances[neighbour] = distance
+                    heapq.heappush(heap, (distance, neighbour))
+        return True
+
+    # function to start the distances of a target from its goals, return the distances and the heap to spread
+    def start_distances(self, field):
+        distances = [self.unreachable] * len(self.costs)
+        heap = []
+        for node in field["goals"]:
+            distances[node] = 0
+            heap.append((0, node))
+        return distances, heap
+
+    # function to calculate the distances of a target from its goals
+    def calculate(self, field):
+        distances, heap = self.start_distances(field)
+        self.spread(distances, heap, field["limit"])
+        field["distances"] = distances
+
+    # function to calculate the costs and the distances of a target a part at a time, when the map has just been
+    # loaded: the costs of prepare_costs nodes or prepare_budget nodes spread at each call, about a millisecond each.
+    # return True when the distances are ready
+    # the costs of all the nodes are calculated from the terrain, so the changes of the terrain made by loading the
+    # map don't need to be applied one by one
+    prepare_costs = 96
+    prepare_budget = 512
+
+    def prepare(self, target):
+        field = self.fields[target]
+        if field["distances"] is not None:
+            return True
+        if self.prepared_nodes < len(self.costs):
+            if self.prepared_nodes == 0:
+                self.pending = []
+            start = self.prepared_nodes
+            self.prepared_nodes = min(start + self.prepare_costs, len(self.costs))
+            for node in range(start, self.prepared_nodes):
+                self.costs[node] = self.node_cost(node)
+            return False
+        if field.get("spreading") is None:
+            field["spreading"] = self.start_distances(field)
+        distances, heap = field["spreading"]
+        if self.spread(distances, heap, field["limit"], self.prepare_budget):
+            field["distances"] = distances
+            field["spreading"] = None
+            return True
+        return False
+
+    # function to bring the costs and all the calculated distances up to date
+    def refresh(self):
+        if not self.pending:
+            return
+        cheaper = self.apply_pending()
+        for field in self.fields.values():
+            if field["distances"] is None:
+                continue
+
+            # some nodes became more expensive, calculate the distances again when they are needed
+            if cheaper is None:
+                field["distances"] = None
+                continue
+
+            # the cheaper nodes may now have a shorter distance through a neighbour, and may give their
+            # neighbours a shorter distance
+            distances = field["distances"]
+            heap = []
+            for node in cheaper:
+                if node not in field["goals"]:
+                    for direction, neighbour in self.neighbours(node):
+                        if self.costs[neighbour] is not None:
+                            distances[node] = min(distances[node], distances[neighbour] + self.costs[neighbour])
+                heapq.heappush(heap, (distances[node], node))
+            self.spread(distances, heap, field["limit"])
+
+    # function to get the distances of a target
+    def distances(self, target):
+        self.refresh()
+        field = self.fields.get(target)
+        if field is None:
+            return None
+        if field["distances"] is None:
+            self.calculate(field)
+        return field["distances"]
+
+    # function to find the best direction for a tank on a node to reach a target
+    # return None if the target can't be reached from the node
+    def best_direction(self, node, target, current_direction):
+        distances = self.distances(target)
+        if distances is None or distances[node] == self.unreachable:
+            return None
+
+        # face the target when the tank has arrived
+        if distances[node] == 0:
+            return self.fields[target]["goals"][node]
+
+        # move towards the neighbour with the shortest distance, keep the direction when it's as good
+        # the neighbours are found as in the neighbours function, without a generator as every enemy asks every frame
+        best_direction = None
+        best_distance = self.unreachable
+        col = node % self.cols
+        row = node // self.cols
+        for direction, step_col, step_row in self.steps:
+            next_col = col + step_col
+            next_row = row + step_row
+            if not (0 <= next_col < self.cols and 0 <= next_row < self.rows):
+                continue
+            neighbour = next_row * self.cols + next_col
+            cost = self.costs[neighbour]
+            if cost is None:
+
+                # face a goal which the tank can't move onto, it has come as close as it can
+                if distances[neighbour] != 0:
+                    continue
+                cost = 0
+            distance = distances[neighbour] + cost
+            if distance < best_distance or (distance == best_distance and direction == current_direction):
+                best_direction = direction
+                best_distance = distance
+        return best_direction
+
+
+# LineOfSight looks along the four directions from a tank to see what a bullet fired by the tank would meet.
+# a bullet flies over water, trees and ice, destroys bricks and is stopped by steel, the eagle or the edge of the
+# battlefield. each ray covers the 2 squares wide path of a bullet fired from a node, and is kept until the
+# terrain on that path changes, so the enemies can decide to fire without scanning the map every frame
+class LineOfSight(object):
+
+    # the environment which bullets can't fly over
+    bullet_kinds = (TERRAIN_BRICKS, TERRAIN_STEEL, TERRAIN_EAGLE)
+
+    # initialize LineOfSight class with the terrain grid
+    def __init__(self, terrain):
+        self.terrain = terrain
+
+        # rays fired upwards and downwards, for each column of nodes
+        # and rays fired to the left and to the right, for each row of nodes
+        self.vertical_rays = {}
+        self.horizontal_rays = {}
+
+        # follow the changes of the terrain
+        terrain.listeners.append(self.terrain_changed)
+
+    # function called by the terrain grid when some squares are changed
+    def terrain_changed(self, col_0, row_0, col_1, row_1, kind, added):
+        if kind not in self.bullet_kinds:
+            return
+
+        # forget the rays whose path goes through the changed squares
+        # the path of the node in column c covers the squares 2c+1 and 2c+2
+        for col in range((col_0 - 1) // 2, (col_1 - 2) // 2 + 1):
+            self.vertical_rays.pop(col, None)
+        for row in range((row_0 - 1) // 2, (row_1 - 2) // 2 + 1):
+            self.horizontal_rays.pop(row, None)
+
+    # function to follow the path of a bullet fired from a node towards a direction (0, 2, 4 or 6)
+    # return the distance the bullet flies before meeting bricks, the distance before it is stopped and
+    # what stops it (TERRAIN_STEEL, TERRAIN_EAGLE or None for the edge of the battlefield)
+    # distances are in pixels from the edge of the tank
+    def ray(self, col, row, direction):
+        if direction in (0, 4):
+            rays = self.vertical_rays.setdefault(col, {})
+            key = row, direction
+        else:
+            rays = self.horizontal_rays.setdefault(row, {})
+            key = col, direction
+        if key not in rays:
+            rays[key] = self.follow(col, row, direction)
+        return rays[key]
+
+    # function to scan the squares in front of a node, used when a ray isn't known yet
+    def follow(self, col, row, direction):
+        terrain = self.terrain
+        bricks = terrain.counts[TERRAIN_BRICKS]
+        steel = terrain.counts[TERRAIN_STEEL]
+        eagle = terrain.counts[TERRAIN_EAGLE]
+
+        # the two squares across the path, the first square in front of the tank and the step between squares
+        if direction == 0:
+            across = [2 * col + 1, 2 * col + 2]
+            start, step, end = 2 * row - 1, -1, -1
+        elif direction == 4:
+            across = [2 * col + 1, 2 * col + 2]
+            start, step, end = 2 * row + 4, 1, terrain.rows
+        elif direction == 2:
+            across = [2 * row + 1, 2 * row + 2]
+            start, step, end = 2 * col - 1, -1, -1
+        else:
+            across = [2 * row + 1, 2 * row + 2]
+            start, step, end = 2 * col + 4, 1, terrain.cols
+
+        clear = None
+        count = 0
+        for along in range(start, end, step):
+            for other in across:
+                if direction in (0, 4):
+                    i = along * terrain.cols + other
+                else:
+                    i = other * terrain.cols + along
+                if steel[i] or eagle[i]:
+                    if clear is None:
+                        clear = count * 12
+                    return clear, count * 12, TERRAIN_STEEL if steel[i] else TERRAIN_EAGLE
+                if bricks[i] and clear is None:
+                    clear = count * 12
+            count += 1
+
+        if clear is None:
+            clear = count * 12
+        return clear, count * 12, None
+
+    # function to check whether a tank at a position can hit the eagle, or a target such as the player,
+    # by firing towards a direction
+    # return "clear" if nothing is in the way, "bricks" if the bullets need to go through bricks, otherwise None
+    def sight(self, x, y, direction, target=None):
+        left = x - self.terrain.left
+        top = y - self.terrain.top
+
+        # the ray is taken from the node the tank has just left, the tank is offset pixels in front of it
+        if direction == 0:
+            col, row = left // 24, -(-top // 24)
+            offset = row * 24 - top
+        elif direction == 4:
+            col, row = left // 24, top // 24
+            offset = top - row * 24
+        elif direction == 2:
+            col, row = -(-left // 24), top // 24
+            offset = col * 24 - left
+        else:
+            col, row = left // 24, top // 24
+            offset = left - col * 24
+        clear, reach, blocker = self.ray(col, row, direction)
+        clear -= offset
+        reach -= offset
+
+        # without a target, look for the eagle
+        if target is None:
+            if blocker != TERRAIN_EAGLE:
+                return None
+            distance = reach
+        else:
+
+            # the target needs to be across the path of the bullet, in front of the tank
+            if direction in (0, 4):
+                if target.right <= x + 18 or target.left >= x + 27:
+                    return None
+                distance = y - target.bottom if direction == 0 else target.top - (y + 48)
+            else:
+                if target.bottom <= y + 21 or target.top >= y + 30:
+                    return None
+                distance = x - target.right if direction == 2 else target.left - (x + 48)
+            if distance < -48 or distance > reach:
+                return None
+
+        if distance <= clear:
+            return "clear"
+        return "bricks"
+
+
+# channels of an observation of the battle, see Observation
+# the first channels are the kinds of environment of the terrain grid, in the same order
+OBSERVE_PLAYER = terrain_kinds
+OBSERVE_ENEMIES = OBSERVE_PLAYER + 1
+OBSERVE_BULLETS = OBSERVE_ENEMIES + 4
+OBSERVE_POWERUPS = OBSERVE_BULLETS + 4
+observation_channels = OBSERVE_POWERUPS + 6
+
+# the power-ups in the order of their channels
+observed_powerups = (Grenade, Helmet, Shovel, Star, Tank, Timer)
+
+
+# Observation describes the battle as a NumPy array of channels of the 12x12 squares of the terrain grid, with a 1
+# where the square is covered: bricks, steel, water, trees, ice and the eagle, then the player, the four types of
+# enemies (basic, fast, power and armor, with or without a power-up), the bullets going up, left, down and right, and
+# the six power-ups.
+# the terrain channels are changed when the terrain changes, the other channels are drawn again by update
+class Observation(object):
+
+    # initialize Observation class with the game observed
+    def __init__(self, game):
+        import_numpy()
+        self.game = game
+        self.terrain = terrain = game.terrain
+        self.array = numpy.zeros((observation_channels, terrain.rows, terrain.cols), numpy.uint8)
+
+        # the counters of the terrain grid are read without copying them
+        self.counts = [numpy.frombuffer(counts, numpy.uint8).reshape(terrain.rows, terrain.cols)
+                       for counts in terrain.counts]
+        for kind in range(terrain_kinds):
+            numpy.not_equal(self.counts[kind], 0, out=self.array[kind])
+        terrain.listeners.append(self.terrain_changed)
+
+    # copy the changed squares of the terrain grid
+    def terrain_changed(self, col_0, row_0, col_1, row_1, kind, added):
+        numpy.not_equal(self.counts[kind][row_0:row_1, col_0:col_1], 0, out=self.array[kind, row_0:row_1, col_0:col_1])
+
+    # mark the squares covered by a rectangle on a channel
+    def mark(self, channel, rect):
+        col_0, row_0, col_1, row_1 = self.terrain.squares(rect)
+        self.array[channel, row_0:row_1, col_0:col_1] = 1
+
+    # draw the tanks, the bullets and the power-ups at their current positions and return the array
+    # the same array is returned every time, so it has to be copied to be kept
+    def update(self):
+        game = self.game
+        self.array[OBSERVE_PLAYER:] = 0
+        for player in game.player_group:
+            self.mark(OBSERVE_PLAYER, player.rect)
+        for enemy in game.enemy_group:
+            self.mark(OBSERVE_ENEMIES + enemy.enemy_type // 2, enemy.rect)
+        for enemy in game.armor_tank_group:
+            self.mark(OBSERVE_ENEMIES + 3, enemy.rect)
+        for bullet in game.bullet_group:
+            self.mark(OBSERVE_BULLETS + bullet.direction, bullet.rect)
+        for powerup in game.powerup_group:
+            self.mark(OBSERVE_POWERUPS + observed_powerups.index(type(powerup)), powerup.rect)
+        return self.array
+
+
+# function to make a surface which draws directly into the memory of an array of pixels, such as a NumPy array of
+# height x width x 4 bytes in shared memory, with the red, green and blue of each pixel followed by an unused byte
+def buffer_surface(pixels):
+    height, width = pixels.shape[:2]
+    if (width, height) != (nes_size[0] * render_scale, nes_size[1] * render_scale):
+        raise ValueError("the pixels need the size of a frame, %dx%d" % (nes_size[0] * render_scale,
+                                                                         nes_size[1] * render_scale))
+    return pygame.image.frombuffer(pixels, (width, height), "RGBX")
+
+
+# keys pressed and keys released for the actions of a game of a batch, see GameBatch.step
+# an action is a direction (0 is none, then up, left, down and right) plus 5 when the player fires
+batch_keys = [collections.defaultdict(bool) for direction in range(5)]
+for direction, key in enumerate((K_w, K_a, K_s, K_d)):
+    batch_keys[direction + 1][key] = True
+batch_releases = ([], ["SPACE"])
+
+
+# GameBatch plays a level in several games at once, each one drawing its frames into its part of a block of pixels
+# given by the caller, which has one frame of pixels for each game (see buffer_surface).
+# all the games share the time, so they are run one after the other in each step, and a game which has ended is
+# started again at the next step
+class GameBatch(object):
+
+    # initialize GameBatch class with the block of pixels and the level played
+    def __init__(self, frames, game_level):
+        self.frames = frames
+        self.level = game_level
+        self.surfaces = [buffer_surface(frame) for frame in frames]
+        self.games = [None] * len(frames)
+        self.done = [False] * len(frames)
+        self.episodes = 0
+        for i in range(len(frames)):
+            self.reset(i)
+
+        # numbers added up to make the gray pixels, see grayscale
+        self.gray_sums = None
+
+    # start the level again in a game, with a new player tank which has the lives of a new session
+    # the level is loaded at once, so the first step draws the first frame
+    def reset(self, i):
+        global player_1, life, keys, release
+
+        player_1 = PlayerTank(0)
+        life = 2
+        self.games[i] = Game(self.surfaces[i], self.level)
+        keys = batch_keys[0]
+        release = batch_releases[0]
+        self.games[i].run()
+        self.done[i] = False
+        self.episodes += 1
+
+    # run a frame of every game with an action for each game, return whether each game has ended
+    def step(self, actions):
+        global ticks, keys, release
+
+        ticks += 33
+        for i, action in enumerate(actions):
+            if self.done[i]:
+                self.reset(i)
+            game = self.games[i]
+            keys = batch_keys[action % 5]
+            release = batch_releases[action // 5]
+            game.run()
+            self.done[i] = game.game_over or game.success
+        return self.done
+
+    # write the frames in gray into an array of games x height x width bytes, taking one pixel out of factor x factor
+    def grayscale(self, out, factor=1):
+        import_numpy()
+        pixels = self.frames[:, ::factor, ::factor]
+        if self.gray_sums is None or self.gray_sums[0].shape != out.shape:
+            self.gray_sums = numpy.empty(out.shape, numpy.uint16), numpy.empty(out.shape, numpy.uint16)
+        total, part = self.gray_sums
+
+        # the weights of red, green and blue add up to 256
+        numpy.multiply(pixels[..., 0], 77, out=total, dtype=numpy.uint16)
+        numpy.multiply(pixels[..., 1], 150, out=part, dtype=numpy.uint16)
+        total += part
+        numpy.multiply(pixels[..., 2], 29, out=part, dtype=numpy.uint16)
+        total += part
+        numpy.right_shift(total, 8, out=out, casting="unsafe")
+        return out
+
+
+# the levels are read from the levels folder, which has level_count levels named 1.txt, 2.txt and so on.
+# a level file has 13 rows of 13 tile codes (see Game.map_loader) and may have a 14th line with the enemy spawn
+# string, otherwise the spawn string of the level number is used, counting again from 1 after level 35
+# (see Game.enemy_spawn_list_loader)
+levels_dir = "levels"
+level_count = 35
+
+# size of the battlefield in tiles as columns and rows, and the number of enemies allowed on the map at the same time
+# a larger arena is filled with copies of the level, see Game.map_loader
+arena_size = (13, 13)
+enemy_cap = 4
+
+# quarters of a tile which are covered with steel or water, as top left, top right, bottom left and bottom right
+# bricks and trees are left out as tanks can shoot through bricks and drive under trees
+solid_quarters = {"06": (0, 1, 0, 1), "07": (0, 0, 1, 1), "08": (1, 0, 1, 0), "09": (1, 1, 0, 0),
+                  "10": (1, 1, 1, 1), "11": (1, 1, 1, 1)}
+
+# tiles kept empty in every generated level: the spawn positions of the enemies and of the two players, and the
+# tiles of the eagle and its base, as (row, column)
+reserved_tiles = [(0, 0), (0, 6), (0, 12), (12, 4), (12, 8), (11, 5), (11, 6), (11, 7), (12, 5), (12, 6), (12, 7)]
+
+# tank nodes, as (column, row) on the 25x25 nodes of a quarter of a tile, where the enemies and the player spawn
+spawn_nodes = [(0, 0), (12, 0), (24, 0), (8, 24)]
+
+# tank nodes next to the eagle, which is on the quarters in the columns 12 and 13 of the rows 24 and 25
+eagle_nodes = [(11, 22), (12, 22), (13, 22), (10, 23), (10, 24), (14, 23), (14, 24)]
+
+# tile codes of generated levels with their weights, and the codes of the tiles seen in a mirror
+tile_weights = [("05", 30), ("01", 3), ("02", 3), ("03", 3), ("04", 3), ("10", 6), ("06", 1), ("07", 1),
+                ("08", 1), ("09", 1), ("11", 5), ("12", 7), ("13", 2)]
+mirrored_tiles = {"01": "03", "03": "01", "06": "08", "08": "06"}
+
+
+# function to check that the eagle can be reached from all the spawn positions in a level given as 13 rows of
+# tile codes. a tank stands on 2x2 quarters of tiles, so the grid is flooded from the nodes next to the eagle over
+# the nodes with no steel or water under the tank, then all the spawn nodes need to be flooded
+def level_reachable(tiles):
+
+    # quarters of tiles blocked with steel or water on a 26x26 grid
+    blocked = bytearray(26 * 26)
+    for row in range(13):
+        for col in range(13):
+            quarters = solid_quarters.get(tiles[row][col])
+            if quarters:
+                for i in range(4):
+                    if quarters[i]:
+                        blocked[(row * 2 + i // 2) * 26 + col * 2 + i % 2] = 1
+
+    # a node is free when the 4 quarters under the tank are free
+    free = bytearray(25 * 25)
+    for row in range(25):
+        for col in range(25):
+            i = row * 26 + col
+            if not (blocked[i] or blocked[i + 1] or blocked[i + 26] or blocked[i + 27]):
+                free[row * 25 + col] = 1
+
+    # flood the free nodes from the nodes next to the eagle
+    reached = bytearray(25 * 25)
+    stack = []
+    for col, row in eagle_nodes:
+        node = row * 25 + col
+        if free[node]:
+            reached[node] = 1
+            stack.append(node)
+    while stack:
+        node = stack.pop()
+        col = node % 25
+        for next_node in (node - 25, node + 25, node - 1 if col > 0 else -1, node + 1 if col < 24 else -1):
+            if 0 <= next_node < 625 and free[next_node] and not reached[next_node]:
+                reached[next_node] = 1
+                stack.append(next_node)
+
+    for col, row in spawn_nodes:
+        if not reached[row * 25 + col]:
+            return False
+    return True
+
+
+# function to create the tiles of a random level, the left half is mirrored to the right half like most of the
+# original levels
+def random_tiles(rng):
+    codes = [code for code, weight in tile_weights]
+    weights = [weight for code, weight in tile_weights]
+    density = rng.uniform(0.3, 0.65)
+
+    tiles = [["00"] * 13 for row in range(13)]
+    for row in range(13):
+        for col in range(7):
+            if rng.random() < density:
+                code = rng.choices(codes, weights)[0]
+                tiles[row][col] = code
+                if col < 6:
+                    tiles[row][12 - col] = mirrored_tiles.get(code, code)
+
+    for row, col in reserved_tiles:
+        tiles[row][col] = "00"
+    return tiles
+
+
+# function to create an enemy spawn string of 20 enemies, like the strings in Game.enemy_spawn_list_loader
+# the enemies come in pairs of the same type, and the pairs of a type are mostly next to each other
+def random_spawn_string(rng):
+    pairs = [rng.choice("0000224466") for i in range(10)]
+    types = sorted(set(pairs), key=lambda enemy_type: rng.random())
+    return "".join(enemy_type * 2 * pairs.count(enemy_type) for enemy_type in types)
+
+
+# function to generate a level from a seed, the same seed always gives the same level
+# return the tiles, the enemy spawn string and the number of random levels tried before a valid one
+def generate_level(seed):
+    rng = random.Random(seed)
+    attempts = 0
+    while True:
+        attempts += 1
+        tiles = random_tiles(rng)
+        if level_reachable(tiles):
+            return tiles, random_spawn_string(rng), attempts
+
+
+# function to write a level file which can be read by Game.map_loader
+def write_level(path, tiles, spawn_string):
+    with open(path, "w") as file:
+        for row in tiles:
+            file.write(" ".join(row) + "\n")
+        file.write(spawn_string + "\n")
+
+
+# function to generate levels 1.txt to number.txt in a folder, seeded with seed + the level number
+def generate_levels(folder, number, seed):
+    if not os.path.isdir(folder):
+        os.makedirs(folder)
+    attempts = 0
+    for level_number in range(1, number + 1):
+        tiles, spawn_string, level_attempts = generate_level(seed + level_number)
+        write_level(os.path.join(folder, str(level_number) + ".txt"), tiles, spawn_string)
+        attempts += level_attempts
+    return attempts
+
+
+# function to count the levels 1.txt, 2.txt and so on in a folder
+def count_levels(folder):
+    number = 0
+    while os.path.exists(os.path.join(folder, str(number + 1) + ".txt")):
+        number += 1
+    return number
 
 
 # The whole Battle City has been modified as four parts: Stating Menu, Level Menu,
@@ -966,10 +2867,12 @@ class Game(object):
         self.level = game_level
 
         # enemy spawn list records the order of spawing enemies
+        # the spawn string of the level file is used if the file has one, see map_loader
         self.enemy_spawn_list = []
+        self.spawn_string = None
 
-        # counter list includes the enemy counter on the grey edge
-        self.counter_list = []
+        # number of the enemy counters on the grey edge
+        self.enemy_counters = 0
 
         # enemy list includes the enemies on the map
         self.enemy_list = []
@@ -1009,6 +2912,9 @@ class Game(object):
         self.elimination_all = False
         self.elimination_all_time = 0
 
+        # the event scheduler ends the power-ups and the matchless and spawns the enemies at their deadlines
+        self.events = EventScheduler()
+
         # last shovel time is used to end the shovel at a certain time
         self.last_shovel_time = 0
 
@@ -1032,174 +2938,251 @@ class Game(object):
         # don't need to be loaded again during the play
         self.initialize = True
 
+        # the level is loaded in steps, see prepare
+        self.prepared = False
+        self.prepared_steps = 0
+
+        # size of the battlefield in tiles, the number of enemies allowed on the map at the same time and the
+        # number of enemies of the level, 20 with the 4 enemies of the original game
+        self.cols, self.rows = arena_size
+        self.enemy_cap = enemy_cap
+        self.enemy_total = 5 * enemy_cap
+
+        # the battlefield starts right of the grey edge, all the bounds of the game are taken from it
+        self.field = Rect(48, 24, self.cols * 48, self.rows * 48)
+
+        # the enemies spawn every 6 tiles along the top, the eagle is at the middle of the bottom
+        self.spawn_positions = [(x, self.field.top) for x in range(self.field.left, self.field.right - 47, 288)]
+        self.eagle_position = self.field.left + self.cols // 2 * 48, self.field.bottom - 48
+
+        # the screen shows the part of an arena larger than the original battlefield around the player, and the
+        # enemies hunt the player within the distance of the original battlefield
+        self.view = None
+        self.hunt_distance = None
+        if self.field.width > 624 or self.field.height > 624:
+            self.view = Rect(self.field.left, self.field.top, 624, 624)
+            self.hunt_distance = 64
+
+        # the terrain grid records the environment of the battlefield, which is kept up to date by the
+        # environment groups below
+        self.terrain = TerrainGrid(self.field.left, self.field.top, self.field.width, self.field.height)
+
+        # the flow field shows the enemies the way to the eagle and to the player
+        self.flow_field = FlowField(self.terrain)
+
+        # line of sight tells the enemies when the player or the eagle can be shot
+        self.line_of_sight = LineOfSight(self.terrain)
+
+        # the layered renderer draws the sprites, the update scheduler updates the sprites which animate or think and
+        # the collision world finds what collides with what, all of them are filled by the groups below
+        self.renderer = LayeredRenderer()
+        self.scheduler = UpdateScheduler()
+        self.world = CollisionWorld(self.terrain)
+
+        # rects used again by every tank and every bullet moving in a frame, see move_tank and move_bullet
+        self.tank_test = Rect(0, 0, 48, 48)
+        self.bullet_path = Rect(0, 0, 0, 0)
+
         # create pygame sprite groups to allow group updates and paintings
-        self.bricks_group = pygame.sprite.Group()
-        self.wall_group = pygame.sprite.Group()
-        self.water_group = pygame.sprite.Group()
-        self.trees_group = pygame.sprite.Group()
-        self.ice_group = pygame.sprite.Group()
+        # the base is made of sprites of the bricks or the wall group, so the base group itself isn't drawn
+        self.bricks_group = TerrainGroup(self.terrain, TERRAIN_BRICKS, self.renderer, LAYER_TERRAIN, None, self.world)
+        self.wall_group = TerrainGroup(self.terrain, TERRAIN_STEEL, self.renderer, LAYER_TERRAIN, None, self.world)
+        self.water_group = TerrainGroup(self.terrain, TERRAIN_WATER, self.renderer, LAYER_TERRAIN, self.scheduler,
+                                        self.world)
+        self.trees_group = TerrainGroup(self.terrain, TERRAIN_TREES, self.renderer, LAYER_TREES, None, self.world)
+        self.ice_group = TerrainGroup(self.terrain, TERRAIN_ICE, self.renderer, LAYER_TERRAIN, None, self.world)
         self.base_group = pygame.sprite.Group()
-        self.eagle_group = pygame.sprite.Group()
-        self.counter_group = pygame.sprite.Group()
-        self.flag_group = pygame.sprite.Group()
-        self.player_counter_group = pygame.sprite.Group()
-        self.game_over_text_group = pygame.sprite.Group()
-        self.player_group = pygame.sprite.Group()
-        self.matchless_group = pygame.sprite.Group()
-        self.enemy_group = pygame.sprite.Group()
-        self.armor_tank_group = pygame.sprite.Group()
-        self.powerup_group = pygame.sprite.Group()
-        self.bullet_group = pygame.sprite.Group()
-        self.explosion_group = pygame.sprite.Group()
+        self.eagle_group = TerrainGroup(self.terrain, TERRAIN_EAGLE, self.renderer, LAYER_TERRAIN, None, self.world)
+        self.hud_group = GameGroup(self.renderer, LAYER_HUD)
+        self.game_over_text_group = GameGroup(self.renderer, LAYER_TEXT)
+        self.player_group = GameGroup(self.renderer, LAYER_PLAYER, self.scheduler, self.world, HIT_PLAYER)
+        self.matchless_group = GameGroup(self.renderer, LAYER_MATCHLESS, self.scheduler)
+        self.enemy_group = GameGroup(self.renderer, LAYER_ENEMIES, self.scheduler, self.world, HIT_ENEMIES)
+        self.armor_tank_group = GameGroup(self.renderer, LAYER_ENEMIES, self.scheduler, self.world, HIT_ARMOR)
+        self.powerup_group = GameGroup(self.renderer, LAYER_POWERUPS, self.scheduler, self.world, HIT_POWERUPS)
+        self.bullet_group = GameGroup(self.renderer, LAYER_BULLETS, None, self.world, HIT_BULLETS)
+        self.explosion_group = GameGroup(self.renderer, LAYER_EXPLOSIONS, self.scheduler)
 
     # function to load the map for a level
     def map_loader(self):
+        self.read_map()
+        for i in range(self.rows):
+            self.map_row(i)
+
+    # function to read the level map file, the tiles are placed by map_row
+    def read_map(self):
         # combine a few strings to make up the filename of the level map file
-        filename = "levels/" + str(self.level) + ".txt"
+        filename = os.path.join(resource_path(levels_dir), str(self.level) + ".txt")
 
         # open file
         file = open(filename)
 
         # read the file and record the environment types using list in python
-        environment_list = []
+        self.environment_list = []
         for line in file:
             line = line[0:-1]
             line_list = line.split(" ")
-            environment_list.append(line_list)
-
-        # get the type in row-column order
-        for i in range(13):
-            for j in range(13):
-                ground_type = environment_list[i][j]
-
-                # calculate the position of the top right corner of a environment unit square
-                # 48 and 24 are used to fit the grey edges
-                basic_x, basic_y = 48 * j + 48, 48 * i + 24
-
-                # ground type "00" means nothing in the unit square
-                if ground_type == "00":
-                    pass
-
-                # "01" to "05" are the bricks filled with different part
-                # "01" is half brick on the right, "02" is half brick on the bottom
-                # "03" is half brick on the left, "04" is half brick on the top
-                # "05" is a full brick
-                elif ground_type == "01" or ground_type == "02" or ground_type == "03" \
-                        or ground_type == "04" or ground_type == "05":
-
-                    # x and y are the adjustment amount specially for bricks
-                    x_list = [0]
-                    y_list = [0]
-
-                    # each full brick is made up of 16 small bricks in a 4x4 matrix
-                    # 2, 3 in x list means the 3rd and 4th columns are filled
-                    # 1, 2, 3, 4 in y list means the 1st, 2nd, 3rd and 4th rows are filled
-                    if ground_type == "01":
-                        x_list = [2, 3]
-                        y_list = [0, 1, 2, 3]
-
-                    # same apply as above
-                    elif ground_type == "02":
-                        x_list = [0, 1, 2, 3]
-                        y_list = [2, 3]
-                    elif ground_type == "03":
-                        x_list = [0, 1]
-                        y_list = [0, 1, 2, 3]
-                    elif ground_type == "04":
-                        x_list = [0, 1, 2, 3]
-                        y_list = [0, 1]
-                    elif ground_type == "05":
-                        x_list = [0, 1, 2, 3]
-                        y_list = [0, 1, 2, 3]
-
-                    # small bricks have two different type
-                    # calculate the type of the small bricks
-                    for x in x_list:
-                        for y in y_list:
-                            if (x + y) % 2 == 0:
-                                # create a type 0 small brick
-                                bricks = Bricks(0)
-                            if (x + y) % 2 == 1:
-                                # create a type 1 small brick
-                                bricks = Bricks(1)
-
-                            # place the small brick in the right position
-                            bricks.position = basic_x + 12 * x, basic_y + 12 * y
-
-                            # add the brick to the bricks group
-                            self.bricks_group.add(bricks)
-
-                # "06" to "10" are the wall filled with different part
-                # "06" is half wall on the right, "07" is half wall on the bottom
-                # "08" is half wall on the left, "09" is half wall on the top
-                # "10" is a full wall
-                elif ground_type == "06" or ground_type == "07" or ground_type == "08" \
-                        or ground_type == "09" or ground_type == "10":
-
-                    # a full wall is made up of four pieces of steel
-                    if ground_type == "10":
-
-                        # loop through the adjustment quantities
-                        for x in [0, 24]:
-                            for y in [0, 24]:
-
-                                # create a small piece of steel
-                                wall = Wall()
-
-                                # place the steel at the right position
-                                wall.position = basic_x + x, basic_y + y
-
-                                # add the steel into the wall group
-                                self.wall_group.add(wall)
-
-                    # otherwise, walls are made up of two pieces of steel
-                    else:
-                        wall1 = Wall()
-                        wall2 = Wall()
-
-                        # apply the position adjustment for each situation
-                        # place the steel
-                        if ground_type == "06":
-                            wall1.position = basic_x + 24, basic_y
-                            wall2.position = basic_x + 24, basic_y + 24
-                        elif ground_type == "07":
-                            wall1.position = basic_x, basic_y + 24
-                            wall2.position = basic_x + 24, basic_y + 24
-                        elif ground_type == "08":
-                            wall1.position = basic_x, basic_y
-                            wall2.position = basic_x, basic_y + 24
-                        elif ground_type == "09":
-                            wall1.position = basic_x, basic_y
-                            wall2.position = basic_x + 24, basic_y
-
-                        # add the steel to the wall group
-                        self.wall_group.add(wall1)
-                        self.wall_group.add(wall2)
-
-                # create a water sprite when type is "11"
-                elif ground_type == '11':
-                    water = Water()
-
-                    # place the water sprite
-                    water.position = basic_x, basic_y
-
-                    # add water sprite to the water group
-                    self.water_group.add(water)
+            self.environment_list.append(line_list)
+
+        # a 14th line is the enemy spawn string of the level
+        if len(self.environment_list) > 13 and self.environment_list[13][0].strip():
+            self.spawn_string = self.environment_list[13][0].strip()
+
+        # a larger arena repeats the level, but keeps the tiles of the spawn positions and the base empty
+        self.reserved = set()
+        if self.view:
+            self.reserved = self.reserved_tiles()
+
+    # function to place the tiles of a row of the map, in row-column order, or only the tiles of the columns from
+    # j_0 to the column before j_1
+    def map_row(self, i, j_0=0, j_1=None):
+        for j in range(j_0, self.cols if j_1 is None else j_1):
+            ground_type = self.environment_list[i % 13][j % 13]
+            if (i, j) in self.reserved:
+                continue
+
+            # calculate the position of the top right corner of a environment unit square
+            # 48 and 24 are used to fit the grey edges
+            basic_x, basic_y = 48 * j + 48, 48 * i + 24
+
+            # ground type "00" means nothing in the unit square
+            if ground_type == "00":
+                pass
 
-                # same as above
-                elif ground_type == "12":
-                    trees = Trees()
-                    trees.position = basic_x, basic_y
-                    self.trees_group.add(trees)
+            # "01" to "05" are the bricks filled with different part
+            # "01" is half brick on the right, "02" is half brick on the bottom
+            # "03" is half brick on the left, "04" is half brick on the top
+            # "05" is a full brick
+            elif ground_type == "01" or ground_type == "02" or ground_type == "03" \
+                    or ground_type == "04" or ground_type == "05":
+
+                # x and y are the adjustment amount specially for bricks
+                x_list = [0]
+                y_list = [0]
+
+                # each full brick is made up of 16 small bricks in a 4x4 matrix
+                # 2, 3 in x list means the 3rd and 4th columns are filled
+                # 1, 2, 3, 4 in y list means the 1st, 2nd, 3rd and 4th rows are filled
+                if ground_type == "01":
+                    x_list = [2, 3]
+                    y_list = [0, 1, 2, 3]
+
+                # same apply as above
+                elif ground_type == "02":
+                    x_list = [0, 1, 2, 3]
+                    y_list = [2, 3]
+                elif ground_type == "03":
+                    x_list = [0, 1]
+                    y_list = [0, 1, 2, 3]
+                elif ground_type == "04":
+                    x_list = [0, 1, 2, 3]
+                    y_list = [0, 1]
+                elif ground_type == "05":
+                    x_list = [0, 1, 2, 3]
+                    y_list = [0, 1, 2, 3]
+
+                # small bricks have two different type
+                # calculate the type of the small bricks
+                for x in x_list:
+                    for y in y_list:
+                        if (x + y) % 2 == 0:
+                            # create a type 0 small brick
+                            bricks = Bricks(0)
+                        if (x + y) % 2 == 1:
+                            # create a type 1 small brick
+                            bricks = Bricks(1)
+
+                        # place the small brick in the right position
+                        bricks.position = basic_x + 12 * x, basic_y + 12 * y
+
+                        # add the brick to the bricks group
+                        self.bricks_group.add(bricks)
+
+            # "06" to "10" are the wall filled with different part
+            # "06" is half wall on the right, "07" is half wall on the bottom
+            # "08" is half wall on the left, "09" is half wall on the top
+            # "10" is a full wall
+            elif ground_type == "06" or ground_type == "07" or ground_type == "08" \
+                    or ground_type == "09" or ground_type == "10":
+
+                # a full wall is made up of four pieces of steel
+                if ground_type == "10":
+
+                    # loop through the adjustment quantities
+                    for x in [0, 24]:
+                        for y in [0, 24]:
+
+                            # create a small piece of steel
+                            wall = Wall()
+
+                            # place the steel at the right position
+                            wall.position = basic_x + x, basic_y + y
+
+                            # add the steel into the wall group
+                            self.wall_group.add(wall)
+
+                # otherwise, walls are made up of two pieces of steel
+                else:
+                    wall1 = Wall()
+                    wall2 = Wall()
+
+                    # apply the position adjustment for each situation
+                    # place the steel
+                    if ground_type == "06":
+                        wall1.position = basic_x + 24, basic_y
+                        wall2.position = basic_x + 24, basic_y + 24
+                    elif ground_type == "07":
+                        wall1.position = basic_x, basic_y + 24
+                        wall2.position = basic_x + 24, basic_y + 24
+                    elif ground_type == "08":
+                        wall1.position = basic_x, basic_y
+                        wall2.position = basic_x, basic_y + 24
+                    elif ground_type == "09":
+                        wall1.position = basic_x, basic_y
+                        wall2.position = basic_x + 24, basic_y
+
+                    # add the steel to the wall group
+                    self.wall_group.add(wall1)
+                    self.wall_group.add(wall2)
+
+            # create a water sprite when type is "11"
+            elif ground_type == '11':
+                water = Water()
+
+                # place the water sprite
+                water.position = basic_x, basic_y
+
+                # add water sprite to the water group
+                self.water_group.add(water)
 
-                elif ground_type == "13":
-                    ice = Ice()
-                    ice.position = basic_x, basic_y
-                    self.ice_group.add(ice)
+            # same as above
+            elif ground_type == "12":
+                trees = Trees()
+                trees.position = basic_x, basic_y
+                self.trees_group.add(trees)
+
+            elif ground_type == "13":
+                ice = Ice()
+                ice.position = basic_x, basic_y
+                self.ice_group.add(ice)
+
+    # function to find the tiles of the spawn positions, of the two players and of the eagle and its base
+    # as (row, column), which are the reserved tiles of a generated level on the original battlefield
+    def reserved_tiles(self):
+        tiles = set((0, (x - self.field.left) // 48) for x, y in self.spawn_positions)
+        col = self.cols // 2
+        row = self.rows - 1
+        tiles.update([(row, col - 2), (row, col + 2), (row - 1, col - 1), (row - 1, col), (row - 1, col + 1),
+                      (row, col - 1), (row, col), (row, col + 1)])
+        return tiles
 
     # function to build the base
     def base_builder(self, base_type):
 
+        # the positions below are the positions around the eagle of the original battlefield
+        offset_x = self.eagle_position[0] - 336
+        offset_y = self.eagle_position[1] - 600
+
         # clear the existing sprites in the base group before building the base
         self.base_group.empty()
 
@@ -1215,7 +3198,7 @@ class Game(object):
                 wall = Wall()
 
                 # 48 and 24 are used to fit the grey edges
-                wall.position = position_list[i][0] + 48, position_list[i][1] + 24
+                wall.position = position_list[i][0] + 48 + offset_x, position_list[i][1] + 24 + offset_y
 
                 # add steel into both base group and wall group in order to manage them easily
                 self.base_group.add(wall)
@@ -1236,8 +3219,8 @@ class Game(object):
             for i in range(16):
                 bricks0 = Bricks(0)
                 bricks1 = Bricks(1)
-                bricks0.position = position_zero_list[i][0] + 48, position_zero_list[i][1] + 24
-                bricks1.position = position_one_list[i][0] + 48, position_one_list[i][1] + 24
+                bricks0.position = position_zero_list[i][0] + 48 + offset_x, position_zero_list[i][1] + 24 + offset_y
+                bricks1.position = position_one_list[i][0] + 48 + offset_x, position_one_list[i][1] + 24 + offset_y
                 self.base_group.add(bricks0)
                 self.bricks_group.add(bricks0)
                 self.base_group.add(bricks1)
@@ -1249,78 +3232,28 @@ class Game(object):
         # create the eagle sprite
         eagle = Eagle()
 
-        # 48 and 24 are used to fit the grey edges
-        eagle.position = 288 + 48, 576 + 24
+        # the eagle is at the middle of the bottom of the battlefield
+        eagle.position = self.eagle_position
 
         # add the eagle sprite to the eagle group
         self.eagle_group.add(eagle)
 
-    # load the flag on the grey edge
-    def flag_loader(self):
-
-        # create, place and manage the flag sprite
-        flag = Flag()
-        flag.position = 696, 528
-        self.flag_group.add(flag)
-
-        # number of the level is also shown on the screen
-        # calculate the digits and create responding number sprite
-        num_2 = self.level % 10
-        number_2 = Number(num_2)
-        number_2.position = 720, 576
-        self.flag_group.add(number_2)
-
-        # number of level may be a single digit
-        # in this case, don't need to create a second number
-        num_1 = self.level // 10
-        if num_1 != 0:
-            number_1 = Number(num_1)
-            number_1.position = 696, 576
-            self.flag_group.add(number_1)
-
-    # load the player life counter on the grey edge
-    def player_counter_loader(self):
-
-        # create the counter only if the player is still alive (having more than 0 life left)
-        if self.player_life > -1:
-            self.player_counter_group.empty()
-
-        # counter is a image
-        # load, place and manage the player counter
-        counter = Counter("player")
-        counter.position = 696, 384
-        self.player_counter_group.add(counter)
-
-        # create a number sprite to show the remaining life of the player
-        num = self.player_life
-        number = Number(num)
-        number.position = 720, 384
-        self.player_counter_group.add(number)
+        # the enemies attacking the base try to reach the nodes around the eagle
+        self.flow_field.set_goal_around("eagle", eagle.rect)
 
-        # player name is also created in order to identify the player when there is a second player
-        player_name = PlayerName(1)
-        player_name.position = 696, 360
-        self.player_counter_group.add(player_name)
+    # load the panel on the grey edge, with all of the enemy counters, the player life counter and the flag
+    def hud_loader(self):
+        self.enemy_counters = self.enemy_total
+        self.hud = HudPanel()
+        self.hud_group.add(self.hud)
+        self.player_counter_loader()
 
-    # load the counters on the grey edge
-    def enemy_counter_loader(self):
-
-        # load all of the 20 counters initially
-        for i in range(20):
-
-            # create a enemy counter sprite
-            counter = Counter()
-
-            # calculate the position based on the order of counters themselves
-            x = 720
-            if i % 2 == 0:
-                x = 696
-            y = 48 + (i // 2) * 24
+    # show the current values on the panel of the grey edge, it is only drawn again when a value has changed
+    def player_counter_loader(self):
 
-            # place the counter and add them to group and list in order to manage
-            counter.position = x, y
-            self.counter_group.add(counter)
-            self.counter_list.append(counter)
+        # the life counter stays at 0 when the player has no life left
+        # the panel has room for 20 enemy counters
+        self.hud.set_values(min(self.enemy_counters, 20), max(self.player_life, 0), self.level)
 
     # load a list of the spawning order of enemy tanks
     def enemy_spawn_list_loader(self):
@@ -1348,13 +3281,17 @@ class Game(object):
                       35: "66666666662222224444"}
 
         # find the enemy spawn list for a specific level using the dictionary above
-        self.enemy_spawn_list = list(level_dict[self.level])
+        # a level past 35 of another folder without its own spawn string uses the spawn strings again from level 1
+        spawn_string = self.spawn_string or level_dict[(self.level - 1) % len(level_dict) + 1]
 
-        # 3 random tanks in a level are award enemies
-        # generate 3 random integers between 0 and 19 (no repeat)
+        # the spawn string is repeated when a level has more enemies
+        self.enemy_spawn_list = list((spawn_string * (self.enemy_total // len(spawn_string) + 1))[:self.enemy_total])
+
+        # 3 random tanks out of 20 in a level are award enemies
+        # generate random integers between 0 and 19 (no repeat)
         award_order_list = []
-        while len(award_order_list) != 3:
-            index_num = random.randint(0, 19)
+        while len(award_order_list) != 3 * self.enemy_total // 20:
+            index_num = random.randint(0, self.enemy_total - 1)
             if index_num not in award_order_list:
                 award_order_list.append(int(index_num))
 
@@ -1375,8 +3312,9 @@ class Game(object):
         # load the sequence images for the tank
         self.player_tank.load("images/tanks.png", 48, 48, 8)
 
-        # place the tank in the starting position and give it and upwards direction
-        self.player_tank.position = 192 + 48, 576 + 24
+        # place the tank in the starting position, left of the base, and give it and upwards direction
+        x, y = self.eagle_position
+        self.player_tank.position = x - 96, y
         self.player_tank.direction = 0
 
         # add the tank to player group in order to manage
@@ -1386,12 +3324,13 @@ class Game(object):
         self.matchless_sprite = Matchless()
 
         # place and add the matchless sprite to group
-        self.matchless_sprite.position = 192 + 48, 576 + 24
+        self.matchless_sprite.position = x - 96, y
         self.matchless_group.add(self.matchless_sprite)
 
         # apply matchless and record the time
         self.player_tank.spawn_matchless = True
         self.player_tank.last_spawn_matchless_time = ticks
+        self.events.schedule("spawn matchless", ticks + 4000, self.end_matchless, self.player_tank, "spawn")
 
     # load a enemy tanks on the map
     def enemy_tank_loader(self, enemy_type, position):
@@ -1426,6 +3365,9 @@ class Game(object):
         enemy.position = position
         enemy.direction = 4
 
+        # choose what the enemy is going for
+        choose_target(enemy)
+
         # add the enemy sprite to enemy group if it is not an armor tank
         if enemy_type in [0, 1, 2, 3, 4, 5]:
             self.enemy_group.add(enemy)
@@ -1441,127 +3383,108 @@ class Game(object):
         # record the spawn time to prevent enemies from spawning at an unexpected rate
         self.last_spawn_time = ticks
 
-    # control the loading process of enemy tanks
-    def load_enemy(self):
+    # schedule the next spawn of an enemy at the first time allowed after the last elimination and spawn
+    def schedule_spawn(self):
+
         # only spawn enemy when there is enemy left for a level
+        # the gaps are 4000 and 1000 ticks with 4 enemies on the map, and shorter when more enemies are allowed
         if self.enemy_spawn_list:
+            spawn_time = self.last_spawn_time + 16000 // self.enemy_cap
 
-            # load the enemy only if it is a certain time after last elimination and spawn
-            time_after_spawn = ticks - self.last_spawn_time
-            time_after_elimination = ticks - self.last_elimination_time
-            spawn = False
-
-            # no more than 4 enemies are allowed on the map at the same time
-            if self.enemy_on_map < 4:
-                if time_after_spawn > 4000:
+            # for the first enemies, up to one more than allowed on the map, there is no consideration on
+            # elimination gap
+            if len(self.enemy_spawn_list) < self.enemy_total - self.enemy_cap:
+                spawn_time = max(spawn_time, self.last_elimination_time + 4000 // self.enemy_cap)
 
-                    # for the first 4 enemies, there is no consideration on elimination gap
-                    if len(self.enemy_spawn_list) > 15:
-                        spawn = True
+            self.events.schedule("spawn", spawn_time, self.load_enemy)
 
-                    elif time_after_elimination > 1000:
-                        spawn = True
+    # control the loading process of enemy tanks, called by the event scheduler when a spawn is allowed
+    def load_enemy(self):
 
-            if spawn:
+        # no more than the enemy cap (4 in the original game) are allowed on the map at the same time
+        # the spawn is scheduled again by the next elimination
+        if self.enemy_on_map >= self.enemy_cap:
+            return
 
-                # spawn position also follows a pattern
-                reminder = len(self.enemy_spawn_list) % 3
+        # spawn position also follows a pattern, the spawn positions are taken in turn from the left
+        position = self.spawn_positions[-len(self.enemy_spawn_list) % len(self.spawn_positions)]
 
-                # calculate the spawn position based on the remainder of dividing 3
-                position = 0 + 48, 0 + 24
-                if reminder == 2:
-                    position = 288 + 48, 0 + 24
-                elif reminder == 1:
-                    position = 576 + 48, 0 + 24
+        # get the type of enemy that need to be created
+        enemy_type = int(self.enemy_spawn_list[-1])
 
-                # get the type of enemy that need to be created
-                enemy_type = int(self.enemy_spawn_list[-1])
+        # remove it from the spawn list
+        self.enemy_spawn_list.pop()
 
-                # remove it from the spawn list
-                self.enemy_spawn_list.pop()
+        # load the enemy tank on the right position
+        self.enemy_tank_loader(enemy_type, position)
 
-                # load the enemy tank on the right position
-                self.enemy_tank_loader(enemy_type, position)
+        # remove 1 counter from the right grey edge
+        self.enemy_counters -= 1
+        self.player_counter_loader()
 
-                # remove 1 counter from the right grey edge as well as the list
-                counter = self.counter_list[-1]
-                self.counter_list.pop()
-                if counter in self.counter_group:
-                    self.counter_group.remove(counter)
+        self.schedule_spawn()
 
     # function to move a tank
     def move_tank(self, tank):
 
-        # test is a StaticSprite to test whether there is a empty space ahead
-        test = StaticSprite()
-
-        # test sprite has a area of 48x48 pixels
-        test.load("images/environment.png", 48, 48, 0, 0)
+        # test is a rect to test whether there is a empty space ahead
+        # test rect has a area of 48x48 pixels, the same rect is used for every tank
+        test = self.tank_test
 
         # calculate the position for the test sprite when the player is heading upwards
         # as tanks are only allow to fit into the gap with a depth of at least 24 pixels
         # positions need to be carefully calculated
         # more details on the document
         if tank.direction == 0:
-            test.X = tank.X
-            test.Y = (tank.Y - 24) // 24 * 24
-            distance = tank.Y - test.Y - 24
+            test.x = tank.X
+            test.y = (tank.Y - 24) // 24 * 24
+            distance = tank.Y - test.y - 24
 
         # same rules apply when the player is heading toward other directions
         elif tank.direction == 2:
-            test.X = (tank.X - 24) // 24 * 24
-            test.Y = tank.Y
-            distance = tank.X - test.X - 24
+            test.x = (tank.X - 24) // 24 * 24
+            test.y = tank.Y
+            distance = tank.X - test.x - 24
         elif tank.direction == 4:
-            test.X = tank.X
+            test.x = tank.X
             reminder = tank.Y % 24
             if reminder == 0:
-                test.Y = tank.Y + 24
+                test.y = tank.Y + 24
             else:
-                test.Y = tank.Y + 48 - reminder
+                test.y = tank.Y + 48 - reminder
 
             # distance is the value of the distance between the tank and the boundary
-            distance = test.Y - tank.Y - 24
+            distance = test.y - tank.Y - 24
         elif tank.direction == 6:
             reminder = tank.X % 24
             if reminder == 0:
-                test.X = tank.X + 24
+                test.x = tank.X + 24
             else:
-                test.X = tank.X + 48 - reminder
-            test.Y = tank.Y
-            distance = test.X - tank.X - 24
-
-        # place the test sprite
-        test.position = test.X, test.Y
-
-        # detect the collisions between test sprite and all the other prohibited sprites
-        group_list = [self.bricks_group, self.wall_group, self.water_group, self.base_group, self.eagle_group]
-        for group in group_list:
-
-            # collision is a value to show whether collisions happens
-            collision = pygame.sprite.spritecollideany(test, group)
+                test.x = tank.X + 48 - reminder
+            test.y = tank.Y
+            distance = test.x - tank.X - 24
 
-            if collision:
+        # detect the collisions between test rect and all the prohibited environment (bricks, steel, water and the
+        # eagle, the base is made of bricks or steel) on the terrain grid
+        # collision is a value to show whether collisions happens
+        collision = self.world.collides(test, tank_blocking_hits)
 
-                # if distance is still huge, larger than the minimum moving distance of a tank
-                if distance > tank.speed:
-
-                    # ignore the the gap
-                    pass
-                else:
+        if collision:
 
-                    # if the gap is smaller than the minimum moving distance, ignore the tanks' original speed
-                    # and filling into the gap
-                    tank.velocity = calc_velocity(tank.direction, distance)
+            # if distance is still huge, larger than the minimum moving distance of a tank
+            if distance > tank.speed:
 
-                    # is the tank is right in front of the boundary, stop the movement
-                    if distance == 0:
-                        tank.ready_to_move = False
-            else:
+                # ignore the the gap
                 pass
+            else:
 
-        # kill the test sprite
-        test.kill()
+                # if the gap is smaller than the minimum moving distance, ignore the tanks' original speed
+                # and filling into the gap
+                set_velocity(tank.velocity, tank.direction, distance)
+
+                # is the tank is right in front of the boundary, stop the movement
+                if distance == 0:
+                    tank.ready_to_move = False
 
     # function to move a player
     def move_player(self, player):
@@ -1703,11 +3626,11 @@ class Game(object):
             # stop animating when player is not pressing a key
             player.first_frame = player.last_frame = player.frame
 
-        # otherwise, calculate the velocity as a point object for the player
+        # otherwise, set the velocity of the player
         else:
 
             # move player in direction
-            player.velocity = calc_velocity(player.direction, player.speed)
+            set_velocity(player.velocity, player.direction, player.speed)
 
         # manually move the player
         if player.moving:
@@ -1717,9 +3640,9 @@ class Game(object):
             y = player.Y + player.velocity.y
 
             # if the player is going out onto the grey edge, stop it from moving
-            if x < 0 + 48 or x > 576 + 48:
+            if x < self.field.left or x > self.field.right - 48:
                 player.ready_to_move = False
-            if y < 0 + 24 or y > 576 + 24:
+            if y < self.field.top or y > self.field.bottom - 48:
                 player.ready_to_move = False
 
             # function defined above to check whether there are prohibit environment ahead
@@ -1733,8 +3656,8 @@ class Game(object):
                 player.Y += player.velocity.y
 
     # function to move an enemy tank
-    # this is a very basic AI system for moving the enemies based on some random generated parameters
-    # and the collisions between the enemies and the surroundings
+    # this is a basic AI system for moving the enemies, which follow the flow field towards their targets
+    # with some random turns, and react to the collisions between the enemies and the surroundings
     def move_enemy(self, enemy):
 
         if ticks > enemy.last_move_time + 30:
@@ -1742,13 +3665,33 @@ class Game(object):
         else:
             enemy.ready_to_move = False
 
-        enemy.velocity = calc_velocity(enemy.direction, enemy.speed)
+        # enemies change their mind once in a while
+        if random.randint(0, 300) == 0:
+            choose_target(enemy)
+
+        # when the enemy is on a node, the flow field shows the way to its target
+        # an enemy which hasn't moved for a while ignores the flow field and turns randomly
+        # as it may be stuck at something the flow field doesn't know about
+        followed = False
+        node = self.flow_field.node_at(enemy.X, enemy.Y)
+        if node is not None and enemy.target and ticks - enemy.last_move_time < 2500:
+            target = enemy.target
+            if target == "player" and not self.player_tank:
+                target = "eagle"
+            direction = self.flow_field.best_direction(node, target, enemy.direction)
+            if direction is not None:
+                followed = True
+                enemy.direction = direction
+
+        # the enemy doesn't move past the next node, so that it stops on every node
+        distance = self.flow_field.distance_to_node(enemy.X, enemy.Y, enemy.direction)
+        set_velocity(enemy.velocity, enemy.direction, min(enemy.speed, distance))
 
         x = enemy.X + enemy.velocity.x
         y = enemy.Y + enemy.velocity.y
-        if x < 0 + 48 or x > 576 + 48:
+        if x < self.field.left or x > self.field.right - 48:
             enemy.ready_to_move = False
-        if y < 0 + 24 or y > 576 + 24:
+        if y < self.field.top or y > self.field.bottom - 48:
             enemy.ready_to_move = False
 
         self.move_tank(enemy)
@@ -1758,8 +3701,9 @@ class Game(object):
             enemy.X += enemy.velocity.x
             enemy.Y += enemy.velocity.y
 
+        # turn randomly once in a while, or when blocked without following the flow field
         random_number = random.randint(0, 200)
-        if random_number == 0 or not enemy.ready_to_move:
+        if random_number == 0 or (not enemy.ready_to_move and not followed):
             random_direction = random.randint(0, 12)
             if random_direction < 6:
                 turn_left(enemy)
@@ -1774,7 +3718,10 @@ class Game(object):
         else:
             enemy.bullet_time_passed = True
 
-        if enemy.bullet_on_map == 0 and enemy.bullet_time_passed:
+        # fire when the player or the eagle is in sight, when blocked (usually by bricks),
+        # and otherwise once in a while
+        if enemy.bullet_on_map == 0 and enemy.bullet_time_passed and \
+                (not enemy.ready_to_move or random.randint(0, 30) == 0 or self.target_in_sight(enemy)):
             direction = enemy.direction // 2
             # create a bullet as a Bullet object
             bullet = Bullet(direction, enemy)
@@ -1798,6 +3745,25 @@ class Game(object):
             if enemy.frame < enemy.first_frame:
                 enemy.frame = enemy.first_frame
 
+    # function to check whether an enemy would hit the player or the eagle by firing now
+    def target_in_sight(self, enemy):
+        if self.line_of_sight.sight(enemy.X, enemy.Y, enemy.direction):
+            return True
+        if self.player_tank and self.line_of_sight.sight(enemy.X, enemy.Y, enemy.direction, self.player_tank.rect):
+            return True
+        return False
+
+    # function to move all the enemies on the map
+    def move_enemies(self):
+
+        # the player's node is the goal of the enemies hunting the player
+        if self.player_tank:
+            node = self.flow_field.nearest_node(self.player_tank.X, self.player_tank.Y)
+            self.flow_field.set_goal_node("player", node, self.hunt_distance)
+
+        for enemy in self.enemy_list:
+            self.move_enemy(enemy)
+
     # function to fire a bullet
     def player_fire(self, pos_x, pos_y, direction, player):
 
@@ -1817,6 +3783,24 @@ class Game(object):
         # check the bullet collision immediate, more details in bullet collision function
         self.bullet_collision(bullet, "immediate")
 
+    # move all the bullets on the map
+    def move_bullets(self):
+
+        for bullet in self.bullet_group.sprites():
+            self.move_bullet(bullet)
+
+    # function to check whether nothing that a bullet collides with is on a path, so that the bullet can move along
+    # the path at once
+    def path_clear(self, bullet, path):
+        return not self.world.collides(path, self.bullet_mask(bullet), bullet)
+
+    # function to find the mask of the things a bullet collides with, the bullets of the enemies only hit the player
+    # and the bullets of the player only hit the enemies
+    def bullet_mask(self, bullet):
+        if bullet.tank.number == 8:
+            return bullet_hits & ~(HIT_ENEMIES | HIT_ARMOR)
+        return bullet_hits & ~HIT_PLAYER
+
     # movement of the bullet
     def move_bullet(self, bullet):
 
@@ -1835,72 +3819,55 @@ class Game(object):
         # (two images for a tank in each direction, but only one image for a bullet in one direction)
         direction = bullet.direction * 2
 
-        # calculate the velocity as a point object based on bullet's moving speed and the firing direction
-        velocity = calc_velocity(direction, bullet.speed)
-
-        # x and y component of the velocity
-        x = velocity.x
-        y = velocity.y
+        # the change of x and y of each pixel the bullet moves, and the whole move of the bullet in this frame
+        step_x, step_y = direction_steps[direction]
+        x = bullet.speed * step_x
+        y = bullet.speed * step_y
+
+        # a bullet with nothing on the path of its whole move skips the collision detection at every pixel below
+        # the path is built in a rect kept for it, as this happens for every bullet in every frame
+        path = self.bullet_path
+        path.update(bullet.rect)
+        path.move_ip(x, y)
+        path.union_ip(bullet.rect)
+        if bullet.ready_to_move and self.path_clear(bullet, path):
+            bullet.X += x
+            bullet.Y += y
+            bullet.last_move_time = ticks
 
         # detect the collision for the bullet while moving
-        if bullet.ready_to_move:
-
-            # moving towards right
-            if x > 0:
-
-                # although the minimum moving distance for a bullet in this game is 12 unit pixels
-                # bullet collision detection cannot be done for only once in a movement
-                # as a distance of 12 pixels is already a huge gap in this game, if the collision detection is based on
-                # the starting point and the ending point, bullet may jump through some small environment objects on
-                # the map, such a a thin bricks wall
-                for i in range(int(x)):
-
-                    # as the bullet is eliminated immediately after a collision
-                    # only detect the collision if the bullet is still existing
-                    # to prevent unexpected collision
-                    if not bullet.exist:
-
-                        # otherwise, stop updating the position of the bullet and break the loop
-                        break
-
-                    # add 1 to the x coordinate (scan the next line)
-                    bullet.X += 1
-
-                    # way of detection is now call a normal collision detection
-                    # which is used to detect the collision when the bullet is moving normally after launching
-                    # for the type of collision detection, more details in the bullet collision function below
-                    self.bullet_collision(bullet, "normal")
-
-            # same rules apply to the bullet when it is moving in another direction
-            # moving towards left
-            elif x < 0:
-                for i in range(int(-x)):
-                    if not bullet.exist:
-                        break
-                    bullet.X -= 1
-                    self.bullet_collision(bullet, "normal")
-
-            # moving towards down
-            if y > 0:
-                for i in range(int(y)):
-                    if not bullet.exist:
-                        break
-                    bullet.Y += 1
-                    self.bullet_collision(bullet, "normal")
-
-            # moving towards up
-            elif y < 0:
-                for i in range(int(-y)):
-                    if not bullet.exist:
-                        break
-                    bullet.Y -= 1
-                    self.bullet_collision(bullet, "normal")
+        elif bullet.ready_to_move:
+
+            # although the minimum moving distance for a bullet in this game is 12 unit pixels
+            # bullet collision detection cannot be done for only once in a movement
+            # as a distance of 12 pixels is already a huge gap in this game, if the collision detection is based on
+            # the starting point and the ending point, bullet may jump through some small environment objects on
+            # the map, such a a thin bricks wall
+            pixels = bullet.speed
+
+            # as the bullet is eliminated immediately after a collision
+            # only detect the collision if the bullet is still existing
+            # to prevent unexpected collision
+            while pixels and bullet.exist:
+
+                # move by 1 pixel (scan the next line)
+                if step_x:
+                    bullet.X += step_x
+                else:
+                    bullet.Y += step_y
+                pixels -= 1
+
+                # way of detection is now call a normal collision detection
+                # which is used to detect the collision when the bullet is moving normally after launching
+                # for the type of collision detection, more details in the bullet collision function below
+                self.bullet_collision(bullet, "normal")
 
             # when the bullet status is updated, record the updating time to prevent too frequent updates
             bullet.last_move_time = ticks
 
         # kill the bullet when out of the boundary
-        if bullet.X < 0 + 48 or bullet.X > 609 + 48 or bullet.Y < 0 + 24 or bullet.Y > 624 + 24:
+        if bullet.X < self.field.left or bullet.X > self.field.right - 15 or bullet.Y < self.field.top or \
+                bullet.Y > self.field.bottom:
             x = bullet.X
             y = bullet.Y
 
@@ -1930,8 +3897,11 @@ class Game(object):
         # before the detection process, assume that there is no collision taking place
         overall_collision = False
 
+        # everything the bullet collides with is found at once, the bullet itself left out
+        hits = self.world.query(bullet.rect, self.bullet_mask(bullet), bullet)
+
         # collisions with bricks wall
-        collision_bricks = pygame.sprite.spritecollideany(bullet, self.bricks_group)
+        collision_bricks = HIT_BRICKS in hits
 
         # if a collision or multiply collisions happen(s)
         if collision_bricks:
@@ -2001,31 +3971,21 @@ class Game(object):
                     elif direction == 2:
                         pass
 
-                # temp is the sprite used to detect the bricks that need to be eliminated
-                temp = StaticSprite()
-
+                # temp is the rect used to detect the bricks that need to be eliminated
                 # if the tank is a tier 4 tank, a thicker detecting area needs to be considered
                 if bullet.tank.number in [3, 7]:
-                    temp.load("images/environment.png", 48, 11, 0, 0)
+                    temp = Rect(0, 0, 48, 11)
 
                 # tier 1, 2 or 3 tanks have normal detecting area
                 else:
-                    temp.load("images/environment.png", 48, 3, 0, 0)
+                    temp = Rect(0, 0, 48, 3)
 
                 # temp position is the combination of bullet position and the adjustment
-                temp.position = x + a, y + b
-
-                # go through the bricks list
-                for bricks in self.bricks_group.sprites():
+                temp.topleft = x + a, y + b
 
-                    # if the brick is colliding with the temp sprite
-                    if pygame.sprite.collide_rect(bricks, temp):
-
-                        # kill the brick
-                        bricks.kill()
-
-                # and the temp sprite
-                temp.kill()
+                # kill the bricks colliding with the temp rect
+                for bricks in self.bricks_group.colliding(temp):
+                    bricks.kill()
 
             # when the bullet is moving horizontally, same rules apply
             if direction == 1 or direction == 3:
@@ -2050,25 +4010,21 @@ class Game(object):
                     elif direction == 3:
                         pass
 
-                temp = StaticSprite()
-
                 if bullet.tank.number in [3, 7]:
 
                     # when the bullet is fired horizontally,
                     # detecting area has a greater height than width
-                    temp.load("images/environment.png", 11, 48, 0, 0)
+                    temp = Rect(0, 0, 11, 48)
 
                 else:
-                    temp.load("images/environment.png", 3, 48, 0, 0)
-                temp.position = x + a, y + b
+                    temp = Rect(0, 0, 3, 48)
+                temp.topleft = x + a, y + b
 
-                for bricks in self.bricks_group.sprites():
-                    if pygame.sprite.collide_rect(bricks, temp):
-                        bricks.kill()
-                temp.kill()
+                for bricks in self.bricks_group.colliding(temp):
+                    bricks.kill()
 
         # collisions with steel wall
-        collision_steel = pygame.sprite.spritecollideany(bullet, self.wall_group)
+        collision_steel = HIT_STEEL in hits
 
         # if the bullets collide with the steel wall
         if collision_steel:
@@ -2115,20 +4071,13 @@ class Game(object):
                             a, b = -18, 18
                         elif collision_type == "immediate":
                             a, b = -18, 9
-                    temp = StaticSprite()
-
                     # testing area is the same with the one used for a line of bricks as a line of steel (2 pieces)
                     # will also be detected
-                    temp.load("images/environment.png", 48, 3, 0, 0)
-                    temp.position = x + a, y + b
+                    temp = Rect(x + a, y + b, 48, 3)
 
-                    # go through the steel in the group
-                    for steel in self.wall_group.sprites():
-
-                        # kill the steel if collision happens
-                        if pygame.sprite.collide_rect(steel, temp):
-                            steel.kill()
-                    temp.kill()
+                    # kill the steel colliding with the testing area
+                    for steel in self.wall_group.colliding(temp):
+                        steel.kill()
 
                 # exact the same idea for bullet traveling horizontally
                 if direction == 1 or direction == 3:
@@ -2142,34 +4091,19 @@ class Game(object):
                             a, b = 18, -21
                         elif collision_type == "immediate":
                             a, b = 9, -21
-                    temp = StaticSprite()
-                    temp.load("images/environment.png", 3, 48, 0, 0)
-                    temp.position = x + a, y + b
+                    temp = Rect(x + a, y + b, 3, 48)
 
-                    for steel in self.wall_group.sprites():
-                        if pygame.sprite.collide_rect(steel, temp):
-                            steel.kill()
-                    temp.kill()
+                    for steel in self.wall_group.colliding(temp):
+                        steel.kill()
 
         # collisions with other bullets
-        collision_bullet = []
-
-        # as the bullet is always colliding with itself which causes a problem, a list includes all the other bullets
-        # needs to be created at the first place
-        for other_bullet in self.bullet_group.sprites():
-
-            # detect the collision between the bullet and "the other bullet" only if they are different
-            if bullet != other_bullet:
-                collision = pygame.sprite.collide_rect(bullet, other_bullet)
-
-                # if the a collision happens
-                if collision:
+        collision_bullet = hits.get(HIT_BULLETS, ())
 
-                    # assume that collision happens
-                    overall_collision = True
+        # if the a collision happens
+        if collision_bullet:
 
-                    # add the the colliding bullet to the list in order to manage
-                    collision_bullet.append(other_bullet)
+            # assume that collision happens
+            overall_collision = True
 
         # when there is another bullet in the colliding list
         if collision_bullet:
@@ -2193,8 +4127,10 @@ class Game(object):
         # detect the collision between bullet and enemies if the bullet is fired by a player
         if bullet.tank.number in [0, 1, 2, 3, 4, 5, 6, 7]:
 
-            # all the hit enemies are returned to the attacked list
-            attacked = pygame.sprite.spritecollide(bullet, self.enemy_group, True)
+            # all the hit enemies are returned to the attacked list, and they are killed
+            attacked = hits.get(HIT_ENEMIES, ())
+            for enemy in attacked:
+                enemy.kill()
 
             # assume that collision takes place if there is a collision
             if attacked:
@@ -2245,6 +4181,7 @@ class Game(object):
 
                 # record the last elimination time to prevent the program from spawning enemies at an unexpected rate
                 self.last_elimination_time = ticks
+                self.schedule_spawn()
 
                 # save the bullet position in case using after killing
                 x = bullet.X
@@ -2261,7 +4198,7 @@ class Game(object):
 
             # collision with armor
             # as armor tank has four lives, it has a slightly different collision function
-            attacked = pygame.sprite.spritecollide(bullet, self.armor_tank_group, False)
+            attacked = hits.get(HIT_ARMOR, ())
 
             # if collision happens
             if attacked:
@@ -2322,6 +4259,7 @@ class Game(object):
                                 # record the elimination time and reduce one to the on map enemy counter
                                 self.last_elimination_time = ticks
                                 self.enemy_on_map -= 1
+                                self.schedule_spawn()
 
                         # record the bullet in armor tank's hit be list
                         armor_tank.hit_by.append(bullet)
@@ -2337,7 +4275,7 @@ class Game(object):
 
             # collided player will be return to the attacked list
             # False means not to kill the player now
-            attacked = pygame.sprite.spritecollide(bullet, self.player_group, False)
+            attacked = hits.get(HIT_PLAYER, ())
 
             # if there is something in the attacked list
             if attacked:
@@ -2375,6 +4313,7 @@ class Game(object):
 
                         # reduce one to the player life counter
                         self.player_life -= 1
+                        self.player_counter_loader()
 
                         # record the elimination time in order to create another player later
                         self.last_player_elimination_time = ticks
@@ -2415,7 +4354,7 @@ class Game(object):
 
         # collision with eagle pattern
         # if the eagle in the base is killed, no matter how many lives has player had left, game overs
-        eagle_collision = pygame.sprite.spritecollide(bullet, self.eagle_group, False)
+        eagle_collision = hits.get(HIT_EAGLE, ())
 
         # if the eagle is hit
         if eagle_collision:
@@ -2448,11 +4387,11 @@ class Game(object):
                 # dead eagle also have a pattern
                 dead_eagle = StaticSprite()
                 dead_eagle.load("images/environment.png", 48, 48, 96, 48)
-                dead_eagle.position = 288 + 48, 576 + 24
+                dead_eagle.position = self.eagle_position
 
                 # create a large explosion above the eagle
                 explosion = Explosion("large")
-                explosion.position = 288 + 24, 576
+                explosion.position = self.eagle_position[0] - 24, self.eagle_position[1] - 24
                 self.explosion_group.add(explosion)
 
                 # play the sound clip for the explosion
@@ -2516,18 +4455,14 @@ class Game(object):
         while not valid_position:
 
             # generate a pair of coordinates as the position for the power-up
-            x = random.randint(48, 624)
-            y = random.randint(24, 600)
+            x = random.randint(self.field.left, self.field.right - 48)
+            y = random.randint(self.field.top, self.field.bottom - 48)
 
             # place the power-up
             powerup.position = x, y
 
-            # detect the collision between power-up and water and eagle sprite
-            on_water = pygame.sprite.spritecollide(powerup, self.water_group, False)
-            on_eagle = pygame.sprite.spritecollide(powerup, self.eagle_group, False)
-
-            # if the power-up is spawned on a valid position
-            if not on_water and not on_eagle:
+            # if the power-up isn't on water or the eagle, it is spawned on a valid position
+            if not self.world.collides(powerup.rect, HIT_WATER | HIT_EAGLE):
 
                 # validate the power-up generation
                 valid_position = True
@@ -2535,12 +4470,17 @@ class Game(object):
         # add the power-up to the group in order to update and manage
         self.powerup_group.add(powerup)
 
+        # remove the power-up from the map when time is out, killing a collected power-up again does nothing
+        self.events.schedule(powerup, powerup.spawn_time + 20000, powerup.kill)
+
     # determine whether player is colliding with a power-up
     def player_collision(self, player):
 
         # collision will be a list returned which includes the collied power-ups
-        # True allows the function to kill the power-up directly after the collision
-        collision = pygame.sprite.spritecollide(player, self.powerup_group, True)
+        # the power-ups are killed directly after the collision
+        collision = self.world.query(player.rect, HIT_POWERUPS).get(HIT_POWERUPS, ())
+        for powerup in collision:
+            powerup.kill()
 
         # when the player is colliding with a power-up
         if collision:
@@ -2576,61 +4516,42 @@ class Game(object):
                 elif type(powerup) == Timer:
                     powerup.timer(self)
 
-    # check and end the matchless when necessary
-    def end_matchless(self):
+    # keep the matchless sprite on the player while the player is matchless
+    def move_matchless(self):
+        if self.player_tank.spawn_matchless or self.player_tank.powerup_matchless:
 
-        # when the matchless is a automatic matchless after spawn
-        if self.player_tank.spawn_matchless:
+            # place the matchless sprite right on the player sprite
+            x, y = self.player_tank.position
+            self.matchless_sprite.position = x, y
 
-            # matchless only apply for 4000 ticks in this case
-            if ticks > self.player_tank.last_spawn_matchless_time + 4000:
+    # end the matchless when time is out
+    # a spawn matchless lasts 4000 ticks after spawn, a power-up matchless lasts 15000 ticks after the helmet
+    def end_matchless(self, tank, kind):
 
-                # kill the matchless when time is out
-                self.matchless_sprite.kill()
-                self.player_tank.spawn_matchless = False
-
-            # update the matchless if it is still applied
-            else:
-
-                # place the matchless sprite right on the player sprite
-                x, y = self.player_tank.position
-                self.matchless_sprite.position = x, y
-
-        # same rules apply for a power-up matchless
-        # power-up matchless lasts longer than a spawn matchless
-        elif self.player_tank.powerup_matchless:
-            if ticks > self.player_tank.last_powerup_matchless_time + 15000:
-                self.matchless_sprite.kill()
-                self.player_tank.powerup_matchless = False
-            else:
-                x, y = self.player_tank.position
-                self.matchless_sprite.position = x, y
+        # kill the matchless when time is out
+        self.matchless_sprite.kill()
+        if kind == "spawn":
+            tank.spawn_matchless = False
+        else:
+            tank.powerup_matchless = False
 
-    # end the shovel for the base when time is out
+    # end the shovel for the base 20000 ticks after applying a shovel
     def end_shovel(self):
 
-        # shovel only needs to be end if a shovel is applied to the game
-        if self.shoveled:
-
-            # when 20000 ticks have passed after the applying of a shovel
-            if ticks > self.last_shovel_time + 20000:
-
-                # remove the sprites (bricks or steel) which make up the base from both base group and
-                # the wall or bricks group to stop the update and the iteractions
-                for sprite in self.base_group.sprites():
-                    sprite.kill()
+        # remove the sprites (bricks or steel) which make up the base from both base group and
+        # the wall or bricks group to stop the update and the iteractions
+        for sprite in self.base_group.sprites():
+            sprite.kill()
 
-                # build the base completely using bricks again
-                self.base_builder("bricks")
+        # build the base completely using bricks again
+        self.base_builder("bricks")
 
-                # switch back to the normal state
-                self.shoveled = False
+        # switch back to the normal state
+        self.shoveled = False
 
-    # end the timer when time is out
-    # basics rules are the same as above
+    # end the timer 15000 ticks after applying a timer
     def end_timer(self):
-        if ticks > self.last_timer_time + 15000:
-            self.apply_timer = False
+        self.apply_timer = False
 
     # check if the player is successful
     def check_success(self):
@@ -2650,69 +4571,94 @@ class Game(object):
                     # record the time for further effects
                     self.elimination_all_time = ticks
 
-        # game is success 2000 ticks after eliminating all the enemies
-        if self.elimination_all:
-            if ticks > self.elimination_all_time + 2000:
-                self.success = True
+                    # game is success 2000 ticks after eliminating all the enemies
+                    self.events.schedule("success", self.elimination_all_time + 2000, self.succeed)
+
+    # the player wins the level, but only when on the map as the player tank is kept for the next level
+    # otherwise the success waits for the player to be loaded again 2000 ticks after the elimination, and never comes
+    # when the game is over
+    def succeed(self):
+        if self.player_tank:
+            self.success = True
+        elif self.player_life > -1:
+            self.events.schedule("success", max(self.last_player_elimination_time + 2000, ticks), self.succeed)
+
+    # jump the clock forward without playing the frames in between, the events on the way happen in order
+    # this lets a headless run go straight to the next deadline, for example the end of a timer
+    def fast_forward(self, milliseconds):
+        global ticks, clock_offset
+        end_time = ticks + milliseconds
+        next_time = self.events.next_time()
+        while next_time is not None and next_time < end_time:
+            ticks = next_time + 1
+            self.events.run(ticks)
+            next_time = self.events.next_time()
+        ticks = end_time
+        clock_offset += milliseconds
 
     # update the status of all the sprites involved
+    # only the sprites which animate or think are updated, the static sprites are left alone
     def update(self):
-
-        # most of the sprites in the groups have a fixed refreshing frequency
-        self.bricks_group.update(ticks, 30)
-        self.wall_group.update(ticks, 30)
-
-        # water flashes per 600 ticks
-        self.water_group.update(ticks, 600)
-        self.trees_group.update(ticks, 30)
-        self.ice_group.update(ticks, 30)
-        self.base_group.update(ticks, 30)
-        self.eagle_group.update(ticks, 30)
-        self.counter_group.update(ticks, 30)
-        self.flag_group.update(ticks, 30)
-        self.player_counter_group.update(ticks, 30)
-        self.game_over_text_group.update(ticks, 30)
-        self.player_group.update(ticks, 30)
-        self.matchless_group.update(ticks, 30)
-        self.enemy_group.update(ticks, 30)
-        self.armor_tank_group.update(ticks, 30, 10)
-
-        # power-ups flash per 360 ticks
-        self.powerup_group.update(ticks, 360)
-        self.bullet_group.update(ticks, 30)
-
-        # explosion has a special update function, go through all the explosions and apply the update function
-        for explosion in self.explosion_group.sprites():
-            explosion.explode(ticks, 120)
+        self.scheduler.update(ticks)
 
     # draw the updates
     def draw(self):
 
+        # the frames run to reach a frame of a replay are not shown, see ReplayReader.seek
+        if not draw_frames:
+            return
+
         # fill the screen with grey background
-        screen.fill((127, 127, 127))
+        self.screen.fill((127, 127, 127))
 
         # draw a black square as the battlefield of the game
-        pygame.draw.rect(screen, (0, 0, 0), (48, 24, 624, 624), 0)
-
-        # draw all the sprites on the screen
-        # sprites that are drawn at last will be above the sprites that were drawn at the begining
-        self.bricks_group.draw(self.screen)
-        self.wall_group.draw(self.screen)
-        self.water_group.draw(self.screen)
-        self.ice_group.draw(self.screen)
-        self.eagle_group.draw(self.screen)
-        self.counter_group.draw(self.screen)
-        self.flag_group.draw(self.screen)
-        self.player_counter_group.draw(self.screen)
-        self.player_group.draw(self.screen)
-        self.matchless_group.draw(self.screen)
-        self.enemy_group.draw(self.screen)
-        self.armor_tank_group.draw(self.screen)
-        self.bullet_group.draw(self.screen)
-        self.explosion_group.draw(self.screen)
-        self.trees_group.draw(self.screen)
-        self.powerup_group.draw(self.screen)
-        self.game_over_text_group.draw(self.screen)
+        fill_rect(self.screen, (0, 0, 0), (48, 24, 624, 624))
+
+        # draw all the sprites on the screen, layer by layer
+        # the view of a larger arena follows the player, or shows the eagle when the player is eliminated
+        if self.view:
+            if self.player_tank:
+                self.view.center = self.player_tank.rect.center
+            else:
+                self.view.center = self.eagle_position
+            self.view.clamp_ip(self.field)
+            self.renderer.draw_view(self.screen, self.view, 48, 24)
+        else:
+            self.renderer.draw(self.screen)
+
+    # function to load the next part of the level before the game starts, the parts which depend neither on the
+    # time nor on the random numbers so they can be loaded while the stage screen is shown: the file of the map, each
+    # row of the map, the base, the eagle, the panel on the right grey edge and the way to the eagle, which takes a
+    # while on a large arena. each call is a loading step (see loading_steps). return True when the level is loaded
+    def prepare(self):
+        if self.prepared:
+            return True
+        # a row of a large arena is placed 13 tiles at a time
+        step = self.prepared_steps
+        blocks = (self.cols + 12) // 13
+        if step == 0:
+            self.read_map()
+        elif step <= self.rows * blocks:
+            j_0 = (step - 1) % blocks * 13
+            self.map_row((step - 1) // blocks, j_0, min(j_0 + 13, self.cols))
+        elif step == self.rows * blocks + 1:
+            self.base_builder("bricks")
+        elif step == self.rows * blocks + 2:
+            self.eagle_builder()
+        elif step == self.rows * blocks + 3:
+            self.hud_loader()
+        else:
+            self.prepared = self.flow_field.prepare("eagle")
+        self.prepared_steps += 1
+        return self.prepared
+
+    # function to load the level for a number of loading steps (see loading_steps), return the number of steps left
+    # once the level is loaded
+    def prepare_steps(self, steps):
+        while steps and not self.prepared:
+            self.prepare()
+            steps -= 1
+        return steps
 
     # run the next step for the game
     def run(self):
@@ -2722,22 +4668,17 @@ class Game(object):
 
         if self.initialize:
 
-            # build the environment
-            self.map_loader()
-            self.base_builder("bricks")
-            self.eagle_builder()
+            # finish loading the level, which may have been started on the stage screen (see prepare)
+            while not self.prepare():
+                pass
 
             # load the enemy list which includes the order of spawning enemies
             self.enemy_spawn_list_loader()
 
-            # load a few more sprites on the right grey edge
-            self.enemy_counter_loader()
-            self.flag_loader()
-            self.player_counter_loader()
-
             # initialize the last elimination time a last spawn time
             self.last_elimination_time = ticks
             self.last_spawn_time = ticks
+            self.schedule_spawn()
 
             # load the player tank from previous game
             self.player_tank_loader(self.player_tank)
@@ -2768,17 +4709,15 @@ class Game(object):
 
                 # all the other parts runs as normal
                 # apart from which player cannot move
-                self.load_enemy()
+                self.events.run(ticks)
 
                 if not self.apply_timer:
-                    for enemy in self.enemy_list:
-                        self.move_enemy(enemy)
+                    self.move_enemies()
                 else:
                     for enemy in self.enemy_list:
                         enemy.first_frame = enemy.last_frame = enemy.frame
 
-                for bullet in self.bullet_group.sprites():
-                    self.move_bullet(bullet)
+                self.move_bullets()
 
         # when the player wins
         elif self.success:
@@ -2807,22 +4746,13 @@ class Game(object):
                     self.player_tank_loader(PlayerTank(0))
                     self.player_tank.bullet_on_map = 0
 
-            # refresh the player live counter
-            self.player_counter_loader()
-
             # all the other parts of the game run as normal
-            self.load_enemy()
-
-            self.end_shovel()
-            self.end_timer()
+            self.events.run(ticks)
 
             if not self.apply_timer:
+                self.move_enemies()
 
-                for enemy in self.enemy_list:
-                    self.move_enemy(enemy)
-
-            for bullet in self.bullet_group.sprites():
-                self.move_bullet(bullet)
+            self.move_bullets()
 
             # update and draw the next stage of the game
             self.update()
@@ -2838,21 +4768,18 @@ class Game(object):
             # check whether player wins
             self.check_success()
 
-            # load the enemy on the map when necessary
-            self.load_enemy()
+            # load the enemies and end the power-ups and the matchless when their time has come
+            self.events.run(ticks)
 
             # detect the collisions between players and power-ups
             self.player_collision(self.player_tank)
 
-            # end the power-ups when necessary
-            self.end_shovel()
-            self.end_matchless()
-            self.end_timer()
+            # keep the matchless on the player
+            self.move_matchless()
 
             # move the enemies when timer is not applied
             if not self.apply_timer:
-                for enemy in self.enemy_list:
-                    self.move_enemy(enemy)
+                self.move_enemies()
 
             # freeze the enemies and stop the
             else:
@@ -2868,13 +4795,8 @@ class Game(object):
             except():
                 pass
 
-            # remove the power-ups on the map when time is out
-            for powerup in self.powerup_group.sprites():
-                powerup.time_out(ticks)
-
             # move the bullets
-            for bullet in self.bullet_group.sprites():
-                self.move_bullet(bullet)
+            self.move_bullets()
 
 
 # Menu object is the starting menu of the Battle City
@@ -3006,8 +4928,8 @@ class Menu(object):
     # draw the sprites in the groups on the given screen
     def draw(self):
         self.screen.fill((0, 0, 0))
-        self.background_group.draw(self.screen)
-        self.pointer_group.draw(self.screen)
+        draw_sprites(self.screen, self.background_group)
+        draw_sprites(self.screen, self.pointer_group)
 
     # run the starting menu screen
     def run(self):
@@ -3032,6 +4954,9 @@ class Menu(object):
             self.update()
             self.draw()
 
+        # load the assets of the game while the menu is shown
+        warm_up_assets(loading_steps)
+
 
 # Level object controls the level choosing menu
 class Level(object):
@@ -3071,13 +4996,15 @@ class Level(object):
         # text is the "STAGE" text on the screen
         self.text = None
 
-        # numbers are the number of stage on the screen
-        self.number_1 = None
-        self.number_2 = None
+        # number is the number of stage on the screen
+        self.number = None
 
         # create the text group
         self.text_group = pygame.sprite.Group()
 
+        # the game of the chosen stage, loaded while the stage screen is shown
+        self.next_game = None
+
     def initialize(self):
 
         # stop filling the screen when the whole screening is filled
@@ -3092,19 +5019,8 @@ class Level(object):
             self.text.position = 288, 324
             self.text_group.add(self.text)
 
-            # load the numbers and place them in the right position
-            num_2 = self.choice % 10
-            self.number_2 = Number(num_2)
-            self.number_2.position = 456, 324
-            self.text_group.add(self.number_2)
-
-            # single digit number doesn't have a secondary digit
-            # load the secondary digit when necessary
-            num_1 = self.choice // 10
-            if num_1 != 0:
-                self.number_1 = Number(num_1)
-                self.number_1.position = 432, 324
-                self.text_group.add(self.number_1)
+            # load the number and place it in the right position
+            self.number = print_number(self.choice, "black", 480, 324, self.text_group)
 
         # when the screen is not fully filled, fill the screen
         else:
@@ -3124,8 +5040,8 @@ class Level(object):
             pos_2 = 0, 672 - self.filling_height, 768, self.filling_height
 
             # draw the rectangles
-            pygame.draw.rect(self.screen, block_color, pos_1, 0)
-            pygame.draw.rect(self.screen, block_color, pos_2, 0)
+            fill_rect(self.screen, block_color, pos_1)
+            fill_rect(self.screen, block_color, pos_2)
 
     # function to clear the screen when the filling process finished
     # and need to load the new level
@@ -3145,13 +5061,13 @@ class Level(object):
             # to pretend there is a battlefield under the curtain
             block_color = 127, 127, 127
             self.screen.fill(block_color)
-            pygame.draw.rect(self.screen, (0, 0, 0), (48, 24, 624, 624), 0)
+            fill_rect(self.screen, (0, 0, 0), (48, 24, 624, 624))
 
             # draw the two grey retangles
             pos_1 = 0, 0, 768, self.filling_height
             pos_2 = 0, 672-self.filling_height, 768, self.filling_height
-            pygame.draw.rect(self.screen, block_color, pos_1, 0)
-            pygame.draw.rect(self.screen, block_color, pos_2, 0)
+            fill_rect(self.screen, block_color, pos_1)
+            fill_rect(self.screen, block_color, pos_2)
 
         # when the clearing process is done
         else:
@@ -3172,8 +5088,8 @@ class Level(object):
     # same as above
     def move_up(self):
         self.choice += 1
-        if self.choice == 36:
-            self.choice = 35
+        if self.choice == level_count + 1:
+            self.choice = level_count
 
     # change the level based on keyboard events
     def change_level(self):
@@ -3204,21 +5120,21 @@ class Level(object):
                 # start the clearing process
                 self.clearing = True
 
-            # empty text group to remove the previous stage number and load the new stage number
-            self.text_group.empty()
-            self.text_group.add(self.text)
+            # show the new stage number, which is only drawn again if it has changed
+            self.number.set_value(self.choice)
 
-            # number loading process is again same with above
-            num_2 = self.choice % 10
-            self.number_2 = Number(num_2)
-            self.number_2.position = 456, 324
-            self.text_group.add(self.number_2)
+    # load the game of the chosen stage for a number of loading steps, return the number of steps left
+    # the game is created again if the choice has changed
+    def prepare_game(self, steps):
+        if self.next_game is None or self.next_game.level != self.choice:
+            self.next_game = Game(self.screen, self.choice)
+        return self.next_game.prepare_steps(steps)
 
-            num_1 = self.choice // 10
-            if num_1 != 0:
-                self.number_1 = Number(num_1)
-                self.number_1.position = 432, 324
-                self.text_group.add(self.number_1)
+    # function to check whether the game of the chosen stage can start, which waits for its level to be loaded
+    # unless the loading before the game is off
+    def game_ready(self):
+        return not loading_steps or (self.next_game is not None and self.next_game.level == self.choice and
+                                     self.next_game.prepared)
 
     # run the level choosing menu by applying the next stage
     def run(self):
@@ -3233,11 +5149,15 @@ class Level(object):
         # clear the screen when the screen needs to be cleared
         elif self.clearing:
 
-            # when the whole screen is cleared
-            if self.cleared:
+            # go on loading the level, the steps left warm up the assets
+            warm_up_assets(self.prepare_game(loading_steps))
+
+            # when the whole screen is cleared and the level is loaded
+            if self.cleared and self.game_ready():
 
-                # create a game object where choice of the level is passed through
-                game = Game(self.screen, self.choice)
+                # the game object of the chosen level, the rest of the level is loaded in its first frame when the
+                # loading before the game is off
+                game = self.next_game
 
                 # change the universal status to "game"
                 status = "game"
@@ -3260,8 +5180,8 @@ class Level(object):
             # otherwise,
             else:
 
-                # when a certain period of time is passed
-                if ticks > self.last_spawn_time + 2000:
+                # when a certain period of time is passed and the level is loaded
+                if ticks > self.last_spawn_time + 2000 and self.game_ready():
 
                     # clear the screen and play the game starting sound clip
                     self.clearing = True
@@ -3270,7 +5190,11 @@ class Level(object):
             # fill the screen with grey background, update and draw
             self.screen.fill((127, 127, 127))
             self.text_group.update(ticks, 30)
-            self.text_group.draw(self.screen)
+            draw_sprites(self.screen, self.text_group)
+
+            # load the level of the stage shown, the steps left warm up the assets left from the menu
+            # the level comes first, so the number of frames it takes doesn't depend on the assets left
+            warm_up_assets(self.prepare_game(loading_steps))
 
 
 # Board object controls the scoring board after the end of each level
@@ -3348,6 +5272,40 @@ class Board(object):
         self.power_counter = 0
         self.armor_counter = 0
 
+        # the points and the number of kills for each type of tank
+        # the numbers are created once and only drawn again when they change
+        self.basic_points = NumberText("white", 168, 264)
+        self.basic_kills = NumberText("white", 336, 264)
+        self.fast_points = NumberText("white", 168, 336)
+        self.fast_kills = NumberText("white", 336, 336)
+        self.power_points = NumberText("white", 168, 408)
+        self.power_kills = NumberText("white", 336, 408)
+        self.armor_points = NumberText("white", 168, 480)
+        self.armor_kills = NumberText("white", 336, 480)
+
+    # function to show the points and the number of kills of a row on the board
+    def show_row(self, points_text, kills_text, points, kills, group):
+        points_text.set_value(points)
+        kills_text.set_value(kills)
+        group.add(points_text, kills_text)
+
+    # function to replace all the sprites on the board with the game over image
+    def show_game_over(self):
+
+        # empty all the groups to cleat the background
+        self.background_group.empty()
+        self.basic_number_group.empty()
+        self.fast_number_group.empty()
+        self.power_number_group.empty()
+        self.armor_number_group.empty()
+        self.other_number_group.empty()
+
+        # load the game over image and place it at the right position
+        game_over = StaticSprite()
+        game_over.load("images/game_over.png", 768, 672, 0, 0)
+        game_over.position = 0, 0
+        self.background_group.add(game_over)
+
     # function to update all the sprites in the groups
     def update(self):
         self.background_group.update(ticks, 30)
@@ -3359,12 +5317,12 @@ class Board(object):
 
     # function to paint the sprites in the screen
     def draw(self):
-        self.background_group.draw(self.screen)
-        self.basic_number_group.draw(self.screen)
-        self.fast_number_group.draw(self.screen)
-        self.power_number_group.draw(self.screen)
-        self.armor_number_group.draw(self.screen)
-        self.other_number_group.draw(self.screen)
+        draw_sprites(self.screen, self.background_group)
+        draw_sprites(self.screen, self.basic_number_group)
+        draw_sprites(self.screen, self.fast_number_group)
+        draw_sprites(self.screen, self.power_number_group)
+        draw_sprites(self.screen, self.armor_number_group)
+        draw_sprites(self.screen, self.other_number_group)
 
     def run(self):
 
@@ -3431,23 +5389,11 @@ class Board(object):
                             play_sound("gameover")
                             self.game_over_sound_played = True
 
-                        # empty all the groups to cleat the background
-                        self.background_group.empty()
-                        self.basic_number_group.empty()
-                        self.fast_number_group.empty()
-                        self.power_number_group.empty()
-                        self.armor_number_group.empty()
-                        self.other_number_group.empty()
-
-                        # load the game over image and place it at the right position
-                        game_over = StaticSprite()
-                        game_over.load("images/game_over.png", 768, 672, 0, 0)
-                        game_over.position = 0, 0
-                        self.background_group.add(game_over)
+                            # the game over screen replaces the board once, then it stays until the timeout
+                            self.show_game_over()
 
-                # a special condition is that the player finished the level 35 which is the
-                # last level of the game
-                elif self.game.level == 35:
+                # a special condition is that the player finished the last level of the game
+                elif self.game.level == level_count:
 
                     # after a certain time
                     if ticks > self.spawn_time + (total + 18) * time_gap:
@@ -3484,9 +5430,8 @@ class Board(object):
                     if tank_code == "BX":
                         points = self.basic_counter * 100
 
-                        self.basic_number_group.empty()
-                        print_number(points, "white", 168, 264, self.basic_number_group)
-                        print_number(self.basic_counter, "white", 336, 264, self.basic_number_group)
+                        self.show_row(self.basic_points, self.basic_kills, points, self.basic_counter,
+                                      self.basic_number_group)
 
                     # "B" means a hit
                     # if so the number of kills and the score need to be changed
@@ -3496,55 +5441,48 @@ class Board(object):
                         self.basic_counter += 1
                         points = self.basic_counter * 100
 
-                        self.basic_number_group.empty()
-                        print_number(points, "white", 168, 264, self.basic_number_group)
-                        print_number(self.basic_counter, "white", 336, 264, self.basic_number_group)
+                        self.show_row(self.basic_points, self.basic_kills, points, self.basic_counter,
+                                      self.basic_number_group)
 
                     # same rules apply as above
                     elif tank_code == "FX":
                         points = self.fast_counter * 200
 
-                        self.fast_number_group.empty()
-                        print_number(points, "white", 168, 336, self.fast_number_group)
-                        print_number(self.fast_counter, "white", 336, 336, self.fast_number_group)
+                        self.show_row(self.fast_points, self.fast_kills, points, self.fast_counter,
+                                      self.fast_number_group)
 
                     elif tank_code == "F":
                         self.fast_counter += 1
                         points = self.fast_counter * 200
 
-                        self.fast_number_group.empty()
-                        print_number(points, "white", 168, 336, self.fast_number_group)
-                        print_number(self.fast_counter, "white", 336, 336, self.fast_number_group)
+                        self.show_row(self.fast_points, self.fast_kills, points, self.fast_counter,
+                                      self.fast_number_group)
 
                     elif tank_code == "PX":
                         points = self.power_counter * 300
 
-                        self.power_number_group.empty()
-                        print_number(points, "white", 168, 408, self.power_number_group)
-                        print_number(self.power_counter, "white", 336, 408, self.power_number_group)
+                        self.show_row(self.power_points, self.power_kills, points, self.power_counter,
+                                      self.power_number_group)
 
                     elif tank_code == "P":
                         self.power_counter += 1
                         points = self.power_counter * 300
 
-                        self.power_number_group.empty()
-                        print_number(points, "white", 168, 408, self.power_number_group)
-                        print_number(self.power_counter, "white", 336, 408, self.power_number_group)
+                        self.show_row(self.power_points, self.power_kills, points, self.power_counter,
+                                      self.power_number_group)
 
                     elif tank_code == "AX":
                         points = self.armor_counter * 400
 
-                        self.armor_number_group.empty()
-                        print_number(points, "white", 168, 480, self.armor_number_group)
-                        print_number(self.armor_counter, "white", 336, 480, self.armor_number_group)
+                        self.show_row(self.armor_points, self.armor_kills, points, self.armor_counter,
+                                      self.armor_number_group)
 
                     elif tank_code == "A":
                         self.armor_counter += 1
                         points = self.armor_counter * 400
 
-                        self.armor_number_group.empty()
-                        print_number(points, "white", 168, 480, self.armor_number_group)
-                        print_number(self.armor_counter, "white", 336, 480, self.armor_number_group)
+                        self.show_row(self.armor_points, self.armor_kills, points, self.armor_counter,
+                                      self.armor_number_group)
 
                 # when the appear order is greater than the length of elimination list
                 # a final total number of kills need to be printed
@@ -3563,46 +5501,60 @@ class Board(object):
             self.update()
             self.draw()
 
-# initialize pygame
-pygame.init()
+# the state of the whole program
+# status can be "menu", "level", "game", "board"
+# but at the start of the game, the progarm is entering the staring menu atuomatically
+status = "menu"
 
-# initialize pygame sound mixer
-pygame.mixer.init()
+# objects controlling each status, created when the status is entered
+menu = None
+level = None
+game = None
+board = None
 
-# create a screen with a given size
-screen = pygame.display.set_mode((768, 672))
+# score, live and player tank, which are carried from one level to the next
+score = 0
+life = 2
+player_1 = None
 
-# name the window as "Battle City"
-pygame.display.set_caption("Battle City")
+# ticks is used as a time parameter to prevent the game from refreshing at a high rate
+ticks = 0
 
-# set up the pygame timer
-timer = pygame.time.Clock()
+# milliseconds added to the pygame clock by fast forwarding, see Game.fast_forward
+clock_offset = 0
 
-# create the Menu object which controls the staring menu of the game
-menu = Menu(screen)
+# keys records the keys being pressed and release records the keys being released in a frame
+keys = None
+release = []
 
-# other objects are currently not assigned
-level = None
-game = None
-board = None
+# time between the import of this file and the first frame on the screen, in seconds
+first_frame_time = None
 
-# status can be "menu", "level", "game", "board"
-# but at the start of the game, the progarm is entering the staring menu atuomatically
-status = "menu"
+# draw_frames is False while frames are run without being shown
+draw_frames = True
 
-# set up score, live and player tank
-score = 0
-life = 2
-player_1 = PlayerTank(0)
 
-# set up the loop to keep the pygame running
-while True:
+# function to start a new session from the starting menu
+def new_session():
+    global status, menu, level, game, board, score, life, player_1
+
+    # create the Menu object which controls the staring menu of the game
+    menu = Menu(init_display())
+    level = None
+    game = None
+    board = None
+    status = "menu"
 
-    # set up fps
-    timer.tick(30)
+    # set up score, live and player tank
+    score = 0
+    life = 2
+    player_1 = PlayerTank(0)
 
-    # ticks is used as a time parameter to prevent the game from refreshing at a high rate
-    ticks = pygame.time.get_ticks()
+
+# function to read the keyboard for the next frame
+# return False when the player wants to quit the game
+def read_input():
+    global keys, release
 
     # release list records the keys being releasing in a loop
     release = []
@@ -3612,7 +5564,7 @@ while True:
 
         # quit the game if a QUIT event is detected
         if event.type == QUIT:
-            sys.exit()
+            return False
 
         # record the keys being releasing to the release list
         if event.type == KEYUP:
@@ -3624,13 +5576,179 @@ while True:
                 release.append("w")
             elif event.key == pygame.K_RETURN:
                 release.append("RETURN")
+            elif event.key == pygame.K_f:
+                release.append("f")
 
     # detect the keys being pressed
     keys = pygame.key.get_pressed()
 
     # quit the game if Esc is pressed
     if keys[K_ESCAPE]:
-        sys.exit()
+        return False
+
+    return True
+
+
+# Telemetry records each frame in a ring buffer in memory, which a background thread writes to a file as JSON lines.
+# the frame only appends a tuple to the buffer, the records are turned into text and written by the thread.
+# if the thread can't keep up, the oldest records are dropped and counted
+class Telemetry(object):
+
+    # names of the values of a record, see frame_record
+    fields = ("frame", "ticks", "frame_ms", "status", "players", "enemies", "bullets", "explosions", "powerups",
+              "bricks", "steel", "enemies_on_map", "score", "sounds", "sounds_played")
+
+    # initialize Telemetry class with the path of the file, the size of the buffer and the seconds between writes
+    def __init__(self, path, size=4096, interval=0.5):
+        self.records = collections.deque(maxlen=size)
+        self.dropped = 0
+        self.interval = interval
+        self.file = open(path, "w")
+
+        # the thread writes the records until the telemetry is closed
+        self.closing = threading.Event()
+        self.thread = threading.Thread(target=self.write_loop)
+        self.thread.daemon = True
+        self.thread.start()
+
+    # add the record of a frame, which is a tuple of the values named in fields
+    def record(self, values):
+        if len(self.records) == self.records.maxlen:
+            self.dropped += 1
+        self.records.append(values)
+
+    # write the records in the buffer to the file
+    def write(self):
+        lines = []
+        while self.records:
+            lines.append(json.dumps(dict(zip(self.fields, self.records.popleft()))))
+        if lines:
+            self.file.write("\n".join(lines) + "\n")
+            self.file.flush()
+
+    def write_loop(self):
+        while not self.closing.wait(self.interval):
+            self.write()
+
+    # stop the thread and write the last records
+    def close(self):
+        self.closing.set()
+        self.thread.join()
+        self.write()
+        if self.dropped:
+            self.file.write(json.dumps({"dropped": self.dropped}) + "\n")
+        self.file.close()
+
+
+# function to make the telemetry record of a frame from the state of the game
+# the sounds are the sounds asked for in the frame and sounds_played the sounds heard, see Mixer
+def frame_record(frame_count, frame_time, sounds, sounds_played):
+    if status == "game" and game:
+        return (frame_count, ticks, round(frame_time * 1000, 3), status, len(game.player_group),
+                len(game.enemy_group) + len(game.armor_tank_group), len(game.bullet_group),
+                len(game.explosion_group), len(game.powerup_group), len(game.bricks_group), len(game.wall_group),
+                game.enemy_on_map, score + game.score, sounds, sounds_played)
+    return frame_count, ticks, round(frame_time * 1000, 3), status, 0, 0, 0, 0, 0, 0, 0, 0, score, sounds, sounds_played
+
+
+# command of the encoder which the exported frames are sent to, {file} is the video file, {width}, {height},
+# {format} and {rate} describe the raw frames written to its standard input
+export_command = ("ffmpeg -loglevel error -y -f rawvideo -pixel_format {format} -video_size {width}x{height} "
+                  "-framerate {rate} -i - -pix_fmt yuv420p {file}")
+
+
+# function to find the name of the raw pixel format of a surface which can be sent to the encoder as it is
+# return None if the pixels have to be converted, for example when the rows are padded
+def raw_pixel_format(surface):
+    if surface.get_bytesize() != 4 or surface.get_pitch() != surface.get_width() * 4:
+        return None
+    masks = surface.get_masks()[:3]
+    if sys.byteorder == "big":
+        masks = tuple(reversed(masks))
+    if masks == (0xff0000, 0xff00, 0xff):
+        return "bgr0"
+    if masks == (0xff, 0xff00, 0xff0000):
+        return "rgb0"
+    return None
+
+
+# FrameExporter sends the frames to an encoder process from a background thread.
+# the frames are copied into a fixed number of buffers which go round between the frame and the thread, so a
+# frame waits for a free buffer (wait) or is dropped and counted when the encoder can't keep up
+class FrameExporter(object):
+
+    # initialize FrameExporter class with the path of the video, the surface of the frames, the command of the
+    # encoder, the number of buffers and whether the frames wait for the encoder
+    def __init__(self, path, surface, command=export_command, rate=30, buffers=8, wait=False):
+        size = surface.get_size()
+        self.wait = wait
+        self.exported = 0
+        self.dropped = 0
+        self.start_time = None
+        self.error = None
+
+        # the pixels are copied as they are if the encoder can read them, otherwise they are converted to RGB
+        self.format = raw_pixel_format(surface)
+        pixel_size = 4 if self.format else 3
+        self.free = queue.Queue()
+        for i in range(buffers):
+            self.free.put(bytearray(size[0] * size[1] * pixel_size))
+        self.pending = queue.Queue()
+
+        # the parts of the command are filled in after it is split, so the path may have spaces
+        values = {"file": path, "width": size[0], "height": size[1], "format": self.format or "rgb24", "rate": rate}
+        self.process = subprocess.Popen([part.format(**values) for part in shlex.split(command)],
+                                        stdin=subprocess.PIPE)
+        self.thread = threading.Thread(target=self.write_loop)
+        self.thread.daemon = True
+        self.thread.start()
+
+    # copy a frame into a free buffer for the thread
+    def add(self, surface):
+        if self.start_time is None:
+            self.start_time = time.perf_counter()
+        try:
+            buffer = self.free.get(self.wait and self.error is None)
+        except queue.Empty:
+            self.dropped += 1
+            return
+        if self.format:
+            with memoryview(surface.get_view("0")) as pixels:
+                memoryview(buffer)[:] = pixels
+        else:
+            buffer[:] = pygame.image.tobytes(surface, "RGB")
+        self.pending.put(buffer)
+
+    # write the frames to the encoder until the exporter is closed, a buffer is free again once it is written
+    def write_loop(self):
+        while True:
+            buffer = self.pending.get()
+            if buffer is None:
+                return
+            if self.error is None:
+                try:
+                    self.process.stdin.write(buffer)
+                    self.exported += 1
+                except OSError as error:
+                    self.error = error
+            self.free.put(buffer)
+
+    # write the last frames, wait for the encoder to finish and return the frames exported each second
+    def close(self):
+        self.pending.put(None)
+        self.thread.join()
+        try:
+            self.process.stdin.close()
+        except OSError:
+            pass
+        self.process.wait()
+        if self.start_time is None:
+            return 0.0
+        return self.exported / max(time.perf_counter() - self.start_time, 1e-9)
+
+
+# function to run one frame of the current status
+def run_frame():
 
     # run a certain type of status when the game is in one of the four statuses
     if status == "menu":
@@ -3642,5 +5760,681 @@ while True:
     elif status == "board":
         board.run()
 
-    # update the display of the game
-    pygame.display.update()
+
+# speeds of the game which F goes through while playing, a speed is the number of steps of the game run in a frame
+# of the window and 0 runs as many steps as fit in max_speed_time. the steps after the first one of a frame are
+# 33 ms each with the same keys held, so the game plays as it would at the normal speed, and only the last step of
+# a frame is drawn and heard
+game_speeds = [1, 2, 10, 0]
+speed_step_ticks = 33
+max_speed_time = 0.025
+
+
+# function to show the speed of the game in the title of the window
+def show_speed(speed):
+    if speed == 1:
+        pygame.display.set_caption("Battle City")
+    elif speed:
+        pygame.display.set_caption("Battle City (%dx)" % speed)
+    else:
+        pygame.display.set_caption("Battle City (max speed)")
+
+
+# function to run the steps of the game of a frame of the window at a speed, each step is recorded if there is a
+# replay writer
+def run_steps(speed, writer=None):
+    global ticks, clock_offset, release, mixer_ready, draw_frames
+
+    start = time.perf_counter()
+    sound = mixer_ready
+    step = 0
+    while True:
+        step += 1
+
+        # at the max speed, the last step is the one which would end after the time, from the mean time of a step
+        if speed:
+            last = step == speed
+        else:
+            elapsed = time.perf_counter() - start
+            last = step > 1 and elapsed + elapsed / (step - 1) > max_speed_time
+
+        # the keys released in the frame only count for the first step
+        if step > 1:
+            ticks += speed_step_ticks
+            clock_offset += speed_step_ticks
+            release = []
+
+        mixer_ready = sound if last else False
+        draw_frames = last
+        if writer:
+            writer.record()
+        run_frame()
+        if last:
+            return step
+
+
+# replay files start with a header of the magic bytes, the version, the random seed, the number of frames between
+# two keyframes, the render scale, the size of the arena, the number of enemies on the map and the length of the name
+# of the levels folder, which follows the header
+replay_magic = b"BCRP"
+replay_version = 4
+replay_header = struct.Struct("<4sHIHHHHHH")
+
+# a keyframe starts with the number of its frame, the ticks of the frame and the size of the compressed state which
+# follows, see save_state
+replay_keyframe = struct.Struct("<IQI")
+
+# the file ends with the index of the keyframes, each one with its frame and its position in the file, and a footer
+# with the position of the index, the number of keyframes, the number of frames and the magic bytes
+replay_index_entry = struct.Struct("<II")
+replay_footer = struct.Struct("<III4s")
+
+# keys which can be pressed in a frame, each one is a bit of the key mask of the frame
+replay_keys = (K_w, K_a, K_s, K_d, K_o, K_UP, K_LEFT, K_DOWN, K_RIGHT, K_RETURN)
+
+# keys which can be released in a frame, each one is one of the high bits of the flag byte of the frame
+replay_releases = ("SPACE", "s", "w", "RETURN")
+
+# bits of the flag byte, which tell which values follow the byte
+REPLAY_KEYS_CHANGED = 1
+REPLAY_TICKS_CHANGED = 2
+REPLAY_RELEASE_SHIFT = 4
+
+
+# function to write a number as a varint, 7 bits in each byte with the high bit set if more bytes follow
+def write_varint(data, number):
+    while number > 127:
+        data.append(number & 127 | 128)
+        number >>= 7
+    data.append(number)
+
+
+# function to read a varint from the position of the data, return the number and the position after it
+def read_varint(data, position):
+    number = 0
+    shift = 0
+    while True:
+        byte = data[position]
+        position += 1
+        number |= (byte & 127) << shift
+        if byte < 128:
+            return number, position
+        shift += 7
+
+
+# StatePickler saves the objects of the program without the pixels of the images it shares with the caches.
+# the screen, the sheets, the frames and the digits are saved by their names, the other surfaces are saved with their
+# pixels in a list next to the state
+class StatePickler(pickle.Pickler):
+    def __init__(self, file):
+        pickle.Pickler.__init__(self, file, pickle.HIGHEST_PROTOCOL)
+        self.surfaces = []
+        self.private = {}
+
+        # names of the surfaces in the caches, found from the surfaces
+        self.names = {id(screen): ("screen",)}
+        filenames = {}
+        for filename, image in image_cache.items():
+            self.names[id(image)] = ("image", filename)
+            filenames[id(image)] = filename
+        for (sheet, x, y, width, height), image in frame_cache.items():
+            if id(sheet) in filenames:
+                self.names[id(image)] = ("frame", filenames[id(sheet)], x, y, width, height)
+        for (num, num_color), image in glyph_cache.items():
+            self.names[id(image)] = ("glyph", num, num_color)
+
+    def persistent_id(self, obj):
+        if isinstance(obj, pygame.Surface):
+            return self.surface_name(obj)
+        return None
+
+    # the name of a surface, subsurfaces are named by their parent and their position in it
+    def surface_name(self, surface):
+        if id(surface) in self.names:
+            return self.names[id(surface)]
+        parent = surface.get_parent()
+        if parent is not None:
+            return ("sub", self.surface_name(parent)) + tuple(Rect(surface.get_offset(), surface.get_size()))
+        if id(surface) not in self.private:
+            self.private[id(surface)] = len(self.surfaces)
+            alpha = surface.get_flags() & SRCALPHA != 0
+            self.surfaces.append((surface.get_size(), alpha, surface.get_colorkey(),
+                                  pygame.image.tobytes(surface, "RGBA" if alpha else "RGB")))
+        return "private", self.private[id(surface)]
+
+
+# StateUnpickler loads the objects saved by StatePickler, the surfaces are taken from the caches or rebuilt
+class StateUnpickler(pickle.Unpickler):
+    def __init__(self, file, surfaces):
+        pickle.Unpickler.__init__(self, file)
+        self.surfaces = surfaces
+        self.loaded = {}
+
+    def persistent_load(self, name):
+        if name not in self.loaded:
+            self.loaded[name] = self.load_surface(name)
+        return self.loaded[name]
+
+    def load_surface(self, name):
+        if name[0] == "screen":
+            return screen
+        if name[0] == "image":
+            return get_image(name[1])
+        if name[0] == "frame":
+            return cut_frame(get_image(name[1]), Rect(name[2:]))
+        if name[0] == "glyph":
+            return get_glyph(name[1], name[2])
+        if name[0] == "sub":
+            return self.persistent_load(name[1]).subsurface(Rect(name[2:]))
+        size, alpha, colorkey, pixels = self.surfaces[name[1]]
+        if alpha:
+            surface = pygame.image.frombytes(pixels, size, "RGBA").convert_alpha()
+        else:
+            surface = pygame.image.frombytes(pixels, size, "RGB").convert()
+        if colorkey is not None:
+            surface.set_colorkey(colorkey, RLEACCEL)
+        return surface
+
+
+# function to save the state of the whole program between two frames as compressed bytes
+def save_state():
+    state = {"status": status, "menu": menu, "level": level, "game": game, "board": board, "score": score,
+             "life": life, "player_1": player_1, "ticks": ticks, "clock_offset": clock_offset,
+             "random": random.getstate()}
+    data = io.BytesIO()
+    pickler = StatePickler(data)
+    pickler.dump(state)
+    return zlib.compress(pickle.dumps((pickler.surfaces, data.getvalue()), pickle.HIGHEST_PROTOCOL))
+
+
+# function to go back to a state saved by save_state
+def load_state(data):
+    global status, menu, level, game, board, score, life, player_1, ticks, clock_offset
+
+    surfaces, state_data = pickle.loads(zlib.decompress(data))
+    state = StateUnpickler(io.BytesIO(state_data), surfaces).load()
+    status = state["status"]
+    menu = state["menu"]
+    level = state["level"]
+    game = state["game"]
+    board = state["board"]
+    score = state["score"]
+    life = state["life"]
+    player_1 = state["player_1"]
+    ticks = state["ticks"]
+    clock_offset = state["clock_offset"]
+    random.setstate(state["random"])
+
+
+# ReplayWriter records a session in a file, the keys of every frame and a keyframe with the whole state every
+# interval frames, so a replay can start at any keyframe instead of the first frame
+class ReplayWriter(object):
+
+    # initialize ReplayWriter class with the path of the file, the seed of the session and the frames between keyframes
+    def __init__(self, path, seed, interval=150):
+        self.file = open(path, "wb")
+        self.interval = interval
+        self.frame_count = 0
+        self.keyframes = []
+        folder = levels_dir.encode("utf-8")
+        self.file.write(replay_header.pack(replay_magic, replay_version, seed, interval, render_scale, arena_size[0],
+                                           arena_size[1], enemy_cap, len(folder)) + folder)
+
+        # the keys and the time between frames are only written when they change, see record
+        self.key_mask = 0
+        self.ticks = 0
+        self.ticks_delta = 0
+
+    # record the frame which is about to run, after its time and its keys are set
+    def record(self):
+        if self.frame_count % self.interval == 0:
+            self.write_keyframe()
+
+        key_mask = 0
+        for bit, key in enumerate(replay_keys):
+            if keys[key]:
+                key_mask |= 1 << bit
+        flags = 0
+        for bit, name in enumerate(replay_releases):
+            if name in release:
+                flags |= 1 << (bit + REPLAY_RELEASE_SHIFT)
+
+        # the time is written as the change of the time between frames, zigzag encoded
+        delta = ticks - self.ticks
+        change = (delta - self.ticks_delta) * 2
+        if change < 0:
+            change = -change - 1
+        data = bytearray()
+        if key_mask != self.key_mask:
+            flags |= REPLAY_KEYS_CHANGED
+            write_varint(data, key_mask)
+        if change:
+            flags |= REPLAY_TICKS_CHANGED
+            write_varint(data, change)
+        self.file.write(bytes([flags]) + data)
+        self.key_mask = key_mask
+        self.ticks = ticks
+        self.ticks_delta = delta
+        self.frame_count += 1
+
+    # write the state before the frame, the keys and the time start again from the state
+    def write_keyframe(self):
+        data = save_state()
+        self.keyframes.append((self.frame_count, self.file.tell()))
+        self.file.write(replay_keyframe.pack(self.frame_count, ticks, len(data)) + data)
+        self.key_mask = 0
+        self.ticks = ticks
+        self.ticks_delta = 0
+
+    # write the index of the keyframes and close the file
+    def close(self):
+        index_position = self.file.tell()
+        for keyframe in self.keyframes:
+            self.file.write(replay_index_entry.pack(*keyframe))
+        self.file.write(replay_footer.pack(index_position, len(self.keyframes), self.frame_count, replay_magic))
+        self.file.close()
+
+
+# ReplayReader plays a file written by ReplayWriter, frame by frame from any frame of the recording
+class ReplayReader(object):
+
+    # initialize ReplayReader class with the path of the file, which is read at once
+    def __init__(self, path):
+        with open(path, "rb") as replay_file:
+            self.data = replay_file.read()
+        (magic, version, self.seed, self.interval, self.render_scale, cols, rows, self.enemy_cap,
+         folder_size) = replay_header.unpack_from(self.data)
+        if magic != replay_magic or version != replay_version:
+            raise ValueError("%s is not a replay of this version of the game" % path)
+        self.arena_size = cols, rows
+        self.levels_dir = self.data[replay_header.size:replay_header.size + folder_size].decode("utf-8")
+        index_position, keyframe_count, self.frame_count, magic = replay_footer.unpack_from(
+            self.data, len(self.data) - replay_footer.size)
+        if magic == replay_magic:
+            self.keyframes = [replay_index_entry.unpack_from(self.data, index_position + i * replay_index_entry.size)
+                              for i in range(keyframe_count)]
+
+        # a recording which was not closed, such as when the game was killed, has no index and its keyframes are
+        # found by reading the file in order
+        else:
+            self.keyframes, index_position, self.frame_count = self.scan_keyframes(replay_header.size + folder_size)
+            if not self.keyframes:
+                raise ValueError("%s was not closed and has no keyframe to start from" % path)
+            keyframe_count = len(self.keyframes)
+
+        # the ticks, the key mask and the release flags of every frame, read from the frames after each keyframe
+        self.inputs = []
+        for i, (frame, position) in enumerate(self.keyframes):
+            end = self.keyframes[i + 1][1] if i + 1 < keyframe_count else index_position
+            self.read_inputs(position, end)
+
+        # frame is the next frame to run, None until the replay is at a frame, see seek
+        self.frame = None
+
+    # find the keyframes from the first one at the position, each keyframe is followed by interval frames. the file
+    # may end in the middle of a keyframe or a frame, which is left out with everything after it
+    # return the keyframes, the end of the last whole frame and the number of frames
+    def scan_keyframes(self, position):
+        keyframes = []
+        end = position
+        frame_count = 0
+        while position + replay_keyframe.size <= len(self.data):
+            frame, frame_ticks, size = replay_keyframe.unpack_from(self.data, position)
+            if frame != frame_count or position + replay_keyframe.size + size > len(self.data):
+                break
+            keyframes.append((frame, position))
+            position += replay_keyframe.size + size
+            end = position
+            for i in range(self.interval):
+                if position >= len(self.data):
+                    return keyframes, end, frame_count
+                try:
+                    flags = self.data[position]
+                    position += 1
+                    if flags & REPLAY_KEYS_CHANGED:
+                        position = read_varint(self.data, position)[1]
+                    if flags & REPLAY_TICKS_CHANGED:
+                        position = read_varint(self.data, position)[1]
+                except IndexError:
+                    return keyframes, end, frame_count
+                end = position
+                frame_count += 1
+        return keyframes, end, frame_count
+
+    # read the frames from the keyframe at the position to the end position
+    def read_inputs(self, position, end):
+        frame, frame_ticks, size = replay_keyframe.unpack_from(self.data, position)
+        position += replay_keyframe.size + size
+        key_mask = 0
+        delta = 0
+        while position < end:
+            flags = self.data[position]
+            position += 1
+            if flags & REPLAY_KEYS_CHANGED:
+                key_mask, position = read_varint(self.data, position)
+            if flags & REPLAY_TICKS_CHANGED:
+                change, position = read_varint(self.data, position)
+                delta += -(change + 1) // 2 if change & 1 else change // 2
+            frame_ticks += delta
+            self.inputs.append((frame_ticks, key_mask, flags >> REPLAY_RELEASE_SHIFT))
+
+    # go to a frame, the state of the nearest keyframe before it is loaded and the frames in between are run
+    # without sound, the frame is the next one to run by step
+    def seek(self, frame):
+        global mixer_ready, draw_frames
+
+        frame = max(0, min(frame, self.frame_count))
+
+        # a frame after the current one and before the next keyframe is reached by running the frames in between
+        keyframe, position = self.keyframes[0]
+        for keyframe_frame, keyframe_position in self.keyframes:
+            if keyframe_frame <= frame:
+                keyframe, position = keyframe_frame, keyframe_position
+        if self.frame is None or not keyframe <= self.frame <= frame:
+            size = replay_keyframe.unpack_from(self.data, position)[2]
+            position += replay_keyframe.size
+            load_state(self.data[position:position + size])
+            self.frame = keyframe
+
+        sound = mixer_ready
+        mixer_ready = False
+        draw_frames = False
+        while self.frame < frame:
+            self.step()
+        mixer_ready = sound
+        draw_frames = True
+
+    # run the next frame with its time and its keys, return False at the end of the recording
+    def step(self):
+        global ticks, keys, release
+
+        if self.frame >= self.frame_count:
+            return False
+        ticks, key_mask, release_flags = self.inputs[self.frame]
+        keys = collections.defaultdict(bool)
+        for bit, key in enumerate(replay_keys):
+            if key_mask & 1 << bit:
+                keys[key] = True
+        release = [name for bit, name in enumerate(replay_releases) if release_flags & 1 << bit]
+        run_frame()
+        self.frame += 1
+        return True
+
+
+# frames jumped by the left and right keys when watching a replay, and the highest speed of a replay
+replay_seek_frames = 300
+replay_max_speed = 100
+
+
+# function to watch a replay from a frame at a speed, quit after a given number of frames shown if it isn't 0
+# at a higher speed, only the last of the frames run in a frame of the window is drawn and heard.
+# without a window, the frames are run as fast as possible and the replay ends with the recording
+def play_replay(reader, speed, start, frames=0, exporter=None):
+    timer = pygame.time.Clock()
+    reader.seek(start)
+    paused = False
+    frame_count = 0
+    while True:
+        if not headless:
+            timer.tick(30)
+        elif reader.frame >= reader.frame_count:
+            return
+
+        # the keys control the replay instead of the game
+        for event in pygame.event.get():
+            if event.type == QUIT or event.type == KEYDOWN and event.key == K_ESCAPE:
+                return
+            if event.type == KEYDOWN:
+                if event.key == K_LEFT:
+                    reader.seek(reader.frame - replay_seek_frames - 1)
+                    reader.step()
+                elif event.key == K_RIGHT:
+                    reader.seek(reader.frame + replay_seek_frames - 1)
+                    reader.step()
+                elif event.key == K_UP:
+                    speed = min(speed * 2, replay_max_speed)
+                elif event.key == K_DOWN:
+                    speed = max(speed // 2, 1)
+                elif event.key == K_SPACE:
+                    paused = not paused
+
+        # the replay stays at the last frame when the recording ends
+        if not paused:
+            reader.seek(reader.frame + speed - 1)
+            reader.step()
+
+        present()
+        if exporter:
+            exporter.add(display)
+        frame_count += 1
+        if frame_count == frames:
+            return
+
+
+# function to wait for the encoder to finish the video and print how the export went
+def close_exporter(exporter):
+    if exporter:
+        rate = exporter.close()
+        print("exported %d frames at %.1f fps, %d dropped" % (exporter.exported, rate, exporter.dropped))
+        if exporter.error:
+            print("the encoder stopped reading the frames: %s" % exporter.error)
+
+
+# entry point of the game
+def main(argv=None):
+    global ticks, mixer_ready, first_frame_time, use_asset_pack, render_scale, window_size, levels_dir, level_count
+    global sound_mixer, arena_size, enemy_cap
+
+    # read the command line options
+    parser = argparse.ArgumentParser(description="Battle City Remake")
+    parser.add_argument("--headless", action="store_true",
+                        help="run without a window and without sound")
+    parser.add_argument("--frames", type=int, default=0,
+                        help="quit after the given number of frames (0 runs until the window is closed)")
+    parser.add_argument("--timing", action="store_true",
+                        help="print the time from importing the game to the first frame")
+    parser.add_argument("--build-assets", action="store_true",
+                        help="build the asset pack of pre-scaled images and quit")
+    parser.add_argument("--no-asset-pack", action="store_true",
+                        help="decode the PNG files even if there is an asset pack")
+    parser.add_argument("--scale", type=float, default=3,
+                        help="size of the window as a multiple of the 256x224 NES frame (default 3)")
+    parser.add_argument("--native", action="store_true",
+                        help="compose the frames at the native resolution and scale them to the window at the end")
+    parser.add_argument("--levels", metavar="FOLDER",
+                        help="play the levels of another folder, or write the generated levels to it")
+    parser.add_argument("--generate-levels", type=int, metavar="N",
+                        help="generate N random levels which can all be finished and quit")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="seed of the generated levels, level n is generated with the seed + n")
+    parser.add_argument("--telemetry", metavar="FILE",
+                        help="write a JSON line for every frame to a file")
+    parser.add_argument("--arena", metavar="COLSxROWS",
+                        help="size of the battlefield in tiles, at least 13x13, filled with copies of the level")
+    parser.add_argument("--speed", default="1", metavar="N",
+                        help="run N steps of the game in each frame, or \"max\" for as many as fit, F changes the "
+                             "speed while playing (default 1)")
+    parser.add_argument("--enemies", type=int, default=enemy_cap,
+                        help="number of enemies allowed on the map at the same time (default %d)" % enemy_cap)
+    parser.add_argument("--channels", type=int, default=channel_budget,
+                        help="number of sounds which can be heard at the same time (default %d)" % channel_budget)
+    parser.add_argument("--record", metavar="FILE",
+                        help="record the session in a replay file")
+    parser.add_argument("--replay", metavar="FILE",
+                        help="watch a replay file, left and right jump 10 seconds, up and down change the speed")
+    parser.add_argument("--replay-speed", type=int, default=1,
+                        help="speed of the replay, from 1 to %d times (default 1)" % replay_max_speed)
+    parser.add_argument("--replay-start", type=int, default=0, metavar="FRAME",
+                        help="frame to start the replay from")
+    parser.add_argument("--export", metavar="FILE",
+                        help="send the frames to a video encoder, without a window the frames wait for the encoder")
+    parser.add_argument("--encoder", default=export_command, metavar="COMMAND",
+                        help="command of the encoder reading the raw frames, with {file}, {width}, {height}, "
+                             "{format} and {rate} (default ffmpeg)")
+    args = parser.parse_args(argv)
+
+    # build the asset pack without starting the game
+    if args.build_assets:
+        init_display(True)
+        print("asset pack written to " + build_asset_pack())
+        return
+
+    # generate levels without starting the game
+    if args.generate_levels:
+        folder = resource_path(args.levels or "generated_levels")
+        start = time.perf_counter()
+        attempts = generate_levels(folder, args.generate_levels, args.seed)
+        print("%d levels written to %s in %.2f s (%d random levels tried)"
+              % (args.generate_levels, folder, time.perf_counter() - start, attempts))
+        return
+
+    # play the levels of another folder
+    if args.levels:
+        levels_dir = args.levels
+        level_count = count_levels(resource_path(levels_dir))
+
+    # set up the size of the arena and the number of enemies
+    if args.arena:
+        try:
+            cols, rows = [int(number) for number in args.arena.lower().split("x")]
+        except ValueError:
+            parser.error("--arena needs a size such as 104x104")
+        if cols < 13 or rows < 13:
+            parser.error("--arena needs at least 13x13 tiles")
+        arena_size = cols, rows
+    if args.enemies < 1:
+        parser.error("--enemies needs at least 1 enemy")
+    enemy_cap = args.enemies
+
+    # the speed of the game, 0 is the max speed
+    speed = 0
+    if args.speed != "max":
+        speed = int(args.speed) if args.speed.isdigit() else 0
+        if speed < 1:
+            parser.error("--speed needs a number of steps such as 2 or 10, or max")
+
+    # a replay is played with the settings it was recorded with
+    reader = None
+    if args.replay:
+        try:
+            reader = ReplayReader(args.replay)
+        except (OSError, ValueError, struct.error) as error:
+            parser.error(str(error))
+        if not 1 <= args.replay_speed <= replay_max_speed:
+            parser.error("--replay-speed needs a speed from 1 to %d" % replay_max_speed)
+        levels_dir = reader.levels_dir
+        level_count = count_levels(resource_path(levels_dir))
+        arena_size = reader.arena_size
+        enemy_cap = reader.enemy_cap
+
+    # decode the PNG files when asked to
+    if args.no_asset_pack:
+        use_asset_pack = False
+
+    # no sound is played in a headless run
+    if args.headless:
+        mixer_ready = False
+    sound_mixer = Mixer(args.channels)
+
+    # set up the size of the window and the resolution of the frames
+    window_size = (int(round(nes_size[0] * args.scale)), int(round(nes_size[1] * args.scale)))
+    if args.native:
+        render_scale = 1
+    if reader:
+        render_scale = reader.render_scale
+
+    # create the screen
+    init_display(args.headless)
+
+    # export the frames shown in the window when asked to
+    exporter = None
+    if args.export:
+        try:
+            exporter = FrameExporter(args.export, display, args.encoder, wait=args.headless)
+        except (OSError, ValueError, KeyError, IndexError) as error:
+            parser.error("--encoder can't be started: %s" % error)
+
+    # the telemetry, the replay and the export are closed even when the game fails, so what was recorded up to the
+    # failure can be read
+    writer = None
+    telemetry = None
+    try:
+
+        # watch the replay instead of playing
+        if reader:
+            play_replay(reader, args.replay_speed, args.replay_start, args.frames, exporter)
+            return
+
+        # set up the pygame timer
+        timer = pygame.time.Clock()
+        show_speed(speed)
+
+        # a recorded session starts from a seed written in the replay, see ReplayWriter
+        if args.record:
+            seed = random.randrange(1 << 32)
+            random.seed(seed)
+            writer = ReplayWriter(args.record, seed)
+
+        # enter the staring menu
+        new_session()
+
+        # record the frames when asked to
+        if args.telemetry:
+            telemetry = Telemetry(args.telemetry)
+
+        # set up the loop to keep the pygame running
+        frame_count = 0
+        while True:
+
+            # set up fps
+            timer.tick(30)
+            ticks = pygame.time.get_ticks() + clock_offset
+
+            # stop the loop when the player quits
+            if not read_input():
+                break
+
+            # F goes to the next speed, which is shown in the title of the window
+            if "f" in release:
+                if speed in game_speeds:
+                    speed = game_speeds[(game_speeds.index(speed) + 1) % len(game_speeds)]
+                else:
+                    speed = 1
+                show_speed(speed)
+
+            frame_start = time.perf_counter()
+            requested_before = sound_mixer.requested
+            played_before = sound_mixer.played
+            run_steps(speed, writer)
+
+            # update the display of the game
+            present()
+            if exporter:
+                exporter.add(display)
+            frame_count += 1
+
+            if telemetry:
+                telemetry.record(frame_record(frame_count, time.perf_counter() - frame_start,
+                                              sound_mixer.requested - requested_before,
+                                              sound_mixer.played - played_before))
+
+            # record the time of the first frame
+            if first_frame_time is None:
+                first_frame_time = time.perf_counter() - import_time
+                if args.timing:
+                    print("first frame: %.1f ms" % (first_frame_time * 1000))
+
+            # stop after a given number of frames
+            if frame_count == args.frames:
+                break
+    finally:
+        if telemetry:
+            telemetry.close()
+        if writer:
+            writer.close()
+        close_exporter(exporter)
+        pygame.quit()
+
+
+if __name__ == "__main__":
+    main()
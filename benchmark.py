@@ -0,0 +1,1446 @@
+# Benchmarks for Battle City Remake
+# run "python benchmark.py <name>" to run one benchmark, or "python benchmark.py" to run all of them
+
+# import the library needed
+import os
+import sys
+import time
+import subprocess
+import argparse
+import tracemalloc
+import tempfile
+import collections
+import shlex
+import hashlib
+import gc
+
+# the game is found next to this file
+base_dir = os.path.dirname(os.path.abspath(__file__))
+game_file = os.path.join(base_dir, "BattleCityRemake.py")
+
+
+# function to return the median of a list of numbers
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+# function to measure the time from the start of a new python process to the first frame
+# return None when the game can't be started, for example when there is no screen for a window
+def measure_first_frame(extra_args):
+    command = [sys.executable, game_file, "--frames", "1", "--timing"] + extra_args
+    result = subprocess.run(command, capture_output=True, text=True)
+    for line in result.stdout.splitlines():
+        if line.startswith("first frame:"):
+            return float(line.split()[2])
+    return None
+
+
+# function to measure the time of importing the game without starting it
+def measure_import():
+    command = [sys.executable, "-c",
+               "import time; t = time.perf_counter(); import BattleCityRemake; "
+               "print((time.perf_counter() - t) * 1000)"]
+    result = subprocess.run(command, capture_output=True, text=True, cwd=base_dir)
+    return float(result.stdout.splitlines()[-1])
+
+
+# import-to-first-frame time for the interactive and the headless paths
+def bench_startup(repeat):
+    print("startup (median of %d runs)" % repeat)
+
+    import_times = [measure_import() for i in range(repeat)]
+    print("  import only:            %8.1f ms" % median(import_times))
+
+    for name, extra_args in [("interactive", []), ("headless", ["--headless"])]:
+        frame_times = [measure_first_frame(extra_args) for i in range(repeat)]
+        if None in frame_times:
+            print("  %-11s first frame:  unavailable (no display)" % name)
+        else:
+            print("  %-11s first frame: %8.1f ms" % (name, median(frame_times)))
+
+
+# function to run a piece of python code with the game imported in a new process
+# the code prints one number, which is returned
+def run_snippet(code):
+    command = [sys.executable, "-c", "import time\nimport BattleCityRemake as bc\n" + code]
+    result = subprocess.run(command, capture_output=True, text=True, cwd=base_dir)
+    return float(result.stdout.splitlines()[-1])
+
+
+# code which loads every sheet and prints the time taken in milliseconds
+load_all_images = """
+bc.use_asset_pack = %s
+bc.init_display(True)
+t = time.perf_counter()
+for name in sorted(bc.os.listdir(bc.resource_path("images"))):
+    if name.endswith(".png"):
+        bc.get_image("images/" + name)
+print((time.perf_counter() - t) * 1000)
+"""
+
+
+# startup with the asset pack compared with decoding and scaling the PNG files
+def bench_assets(repeat):
+    if not os.path.exists(os.path.join(base_dir, "images", "assets.pack")):
+        subprocess.run([sys.executable, game_file, "--build-assets"], capture_output=True)
+
+    print("assets (median of %d runs)" % repeat)
+    for name, flag, extra_args in [("PNG files", False, ["--no-asset-pack"]), ("asset pack", True, [])]:
+        load_times = [run_snippet(load_all_images % flag) for i in range(repeat)]
+        frame_times = [measure_first_frame(["--headless"] + extra_args) for i in range(repeat)]
+        print("  %-10s  load all sheets: %7.1f ms  first frame: %7.1f ms"
+              % (name, median(load_times), median(frame_times)))
+
+
+# function to import the game for the benchmarks which run in this process
+# the game is headless and without sound
+def load_game():
+    sys.path.insert(0, base_dir)
+    import BattleCityRemake as bc
+    bc.mixer_ready = False
+    bc.init_display(True)
+    return bc
+
+
+# function to count the sprites created while a function runs
+def count_sprites(bc, function):
+    created = [0]
+    original_init = bc.pygame.sprite.Sprite.__init__
+
+    def counting_init(sprite, *groups):
+        created[0] += 1
+        original_init(sprite, *groups)
+
+    bc.pygame.sprite.Sprite.__init__ = counting_init
+    try:
+        function()
+    finally:
+        bc.pygame.sprite.Sprite.__init__ = original_init
+    return created[0]
+
+
+# allocations during a whole visit of the scoring board, after a won and after a lost level
+def bench_board(repeat):
+    bc = load_game()
+    print("board (one visit of the scoring board)")
+
+    for result in ["won", "lost"]:
+
+        # a finished level with some eliminations of each type of tank
+        last_game = bc.Game(bc.screen, 12)
+        last_game.eliminate_basic, last_game.eliminate_fast = 8, 6
+        last_game.eliminate_power, last_game.eliminate_armor = 4, 2
+        if result == "won":
+            last_game.success = True
+        else:
+            last_game.game_over = True
+
+        frames = [0]
+
+        def visit():
+            bc.status = "board"
+            bc.board = bc.Board(bc.screen, last_game)
+            while bc.status == "board":
+                bc.ticks += 33
+                bc.board.run()
+                frames[0] += 1
+
+        tracemalloc.start()
+        sprites = count_sprites(bc, visit)
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print("  level %s: %4d frames, %4d sprites created, %6.1f KiB peak python memory"
+              % (result, frames[0], sprites, peak / 1024))
+
+        # frame times of the visits, the scores and the game over screen are timed separately
+        frame_times = {"scores": [], "game over": []}
+        for run in range(repeat):
+            bc.status = "board"
+            bc.board = bc.Board(bc.screen, last_game)
+            while bc.status == "board":
+                bc.ticks += 33
+                screen = "scores"
+                if bc.board.game_over_sound_played:
+                    screen = "game over"
+                start = time.perf_counter()
+                bc.board.run()
+                frame_times[screen].append(time.perf_counter() - start)
+        for screen, times in frame_times.items():
+            if times:
+                print("    %-9s  %6.3f ms mean, %6.3f ms worst frame"
+                      % (screen, sum(times) / len(times) * 1000, max(times) * 1000))
+
+
+# function to set up a game of a level without starting the enemies and the player
+def build_game(bc, game_level):
+    game = bc.Game(bc.screen, game_level)
+    game.map_loader()
+    game.base_builder("bricks")
+    game.eagle_builder()
+    return game
+
+
+# cost of the enemy AI for each tick with more and more enemies
+# the flow field is shared, so only the cheap look-up of each enemy grows with the number of enemies
+def bench_ai(repeat):
+    bc = load_game()
+    game = build_game(bc, 1)
+    flow_field = game.flow_field
+    ticks = 300
+
+    # the nodes where the player and the enemies can stand
+    distances = flow_field.distances("eagle")
+    nodes = [node for node in range(len(distances))
+             if distances[node] < flow_field.unreachable and flow_field.costs[node] == 1]
+
+    print("ai (%d ticks, the player changes node every tick)" % ticks)
+    for enemy_count in [4, 16, 64, 256]:
+        enemies = [(nodes[i * 7 % len(nodes)], ["eagle", "player"][i % 2]) for i in range(enemy_count)]
+        shared_time = 0.0
+        enemy_time = 0.0
+        for tick in range(ticks):
+
+            # the shared part: moving goal of the player
+            start = time.perf_counter()
+            flow_field.set_goal("player", {nodes[tick * 13 % len(nodes)]: None})
+            flow_field.distances("player")
+            flow_field.distances("eagle")
+            shared_time += time.perf_counter() - start
+
+            # the part of each enemy: choosing a direction
+            start = time.perf_counter()
+            for node, target in enemies:
+                flow_field.best_direction(node, target, 4)
+            enemy_time += time.perf_counter() - start
+
+        print("  %3d enemies: shared %6.3f ms/tick, enemies %6.3f ms/tick (%5.2f us each), total %6.3f ms/tick"
+              % (enemy_count, shared_time / ticks * 1000, enemy_time / ticks * 1000,
+                 enemy_time / ticks / enemy_count * 1000000, (shared_time + enemy_time) / ticks * 1000))
+
+    # a separate search for each enemy would cost a full calculation per enemy
+    field = flow_field.fields["eagle"]
+    start = time.perf_counter()
+    for i in range(repeat * 10):
+        flow_field.calculate(field)
+    full_time = (time.perf_counter() - start) / (repeat * 10)
+    print("  one full calculation: %.3f ms (a search per enemy would cost this for every enemy)"
+          % (full_time * 1000))
+
+    # destroying bricks only improves the distances around them
+    bricks = game.bricks_group.sprites()
+    start = time.perf_counter()
+    for brick in bricks[:100]:
+        brick.kill()
+        flow_field.distances("eagle")
+    print("  incremental update after destroying a brick: %.3f ms" % ((time.perf_counter() - start) / 100 * 1000))
+
+    # the shovel turns the base around the eagle to steel, the tanks must still find their way to it
+    def reachable():
+        return sum(1 for distance in flow_field.distances("eagle") if distance < flow_field.unreachable)
+    counts = [reachable()]
+    for base_type in ["wall", "bricks"]:
+        game.base_builder(base_type)
+        counts.append(reachable())
+    print("  nodes reaching the eagle: %d, with the steel base %d, with the bricks back %d" % tuple(counts))
+    if counts[1] <= len(flow_field.fields["eagle"]["goals"]) or counts[2] < counts[1]:
+        print("  the eagle can't be reached while the base is made of steel")
+        sys.exit(1)
+
+
+# cost of the enemies' decisions to fire, with the rays kept between ticks and scanned again every tick
+def bench_sight(repeat):
+    bc = load_game()
+    game = build_game(bc, 35)
+    flow_field = game.flow_field
+    line_of_sight = game.line_of_sight
+    ticks = 300
+
+    # the player stands in front of the base
+    game.player_tank = bc.PlayerTank(0)
+    game.player_tank.rect = bc.Rect(240, 600, 48, 48)
+
+    # the tanks stand on nodes where a tank fits, facing every direction
+    distances = flow_field.distances("eagle")
+    nodes = [node for node in range(len(distances)) if flow_field.costs[node] == 1]
+
+    print("sight (%d ticks, each tank checks the player and the eagle every tick)" % ticks)
+    for tank_count in [4, 16, 64, 256]:
+        tanks = []
+        for i in range(tank_count):
+            tank = bc.BasicTank()
+            node = nodes[i * 7 % len(nodes)]
+            tank.rect = bc.Rect(48 + node % flow_field.cols * 24, 24 + node // flow_field.cols * 24, 48, 48)
+            tank.direction = i % 4 * 2
+            tanks.append(tank)
+
+        results = []
+        for name, keep in [("cached", True), ("scanned", False)]:
+            start = time.perf_counter()
+            in_sight = 0
+            for tick in range(ticks):
+                if not keep:
+                    line_of_sight.vertical_rays.clear()
+                    line_of_sight.horizontal_rays.clear()
+                for tank in tanks:
+                    in_sight += game.target_in_sight(tank)
+            results.append((name, (time.perf_counter() - start) / ticks * 1000, in_sight // ticks))
+        print("  %3d tanks: " % tank_count + ", ".join("%s %6.3f ms/tick" % (name, cost) for name, cost, count
+                                                       in results) + " (%d in sight)" % results[0][2])
+
+
+# collision queries of each type with more and more tanks and bullets on a 52x52 arena, the collision world compared
+# with looking through the groups one by one with pygame.sprite, which must find the same sprites
+def bench_collide(repeat):
+    bc = load_game()
+    bc.arena_size = (52, 52)
+    game = build_game(bc, 14)
+    bc.arena_size = (13, 13)
+    world = game.world
+    field = game.field
+    rng = bc.random.Random(0)
+    queries = 100 * repeat
+
+    # a sprite to ask pygame.sprite about a rect
+    probe = bc.pygame.sprite.Sprite()
+
+    # the groups looked through for each mask
+    terrain_groups = [game.bricks_group, game.wall_group, game.water_group, game.eagle_group]
+    bullet_groups = [(bc.HIT_BRICKS, game.bricks_group), (bc.HIT_STEEL, game.wall_group),
+                     (bc.HIT_EAGLE, game.eagle_group), (bc.HIT_BULLETS, game.bullet_group),
+                     (bc.HIT_ENEMIES, game.enemy_group), (bc.HIT_ARMOR, game.armor_tank_group)]
+
+    def random_rect(width, height):
+        return bc.Rect(rng.randrange(field.left, field.right - width), rng.randrange(field.top, field.bottom - height),
+                       width, height)
+
+    def terrain_any(rect):
+        probe.rect = rect
+        return any(bc.pygame.sprite.spritecollideany(probe, group) for group in terrain_groups)
+
+    def sprites_any(rect):
+        probe.rect = rect
+        return any(bc.pygame.sprite.spritecollideany(probe, group) for group in
+                   [game.bullet_group, game.enemy_group])
+
+    def bullet_hits(rect):
+        probe.rect = rect
+        hits = {}
+        for bit, group in bullet_groups:
+            found = bc.pygame.sprite.spritecollide(probe, group, False)
+            if found:
+                hits[bit] = found
+        return hits
+
+    # the environment of the terrain groups is found in another order, the other sprites in the order of the groups
+    def same_hits(hits, expected):
+        return hits.keys() == expected.keys() and all(
+            hits[bit] == expected[bit] if bit & bc.sprite_hits else set(hits[bit]) == set(expected[bit])
+            for bit in hits)
+
+    print("collide (%d queries of each type, %d terrain sprites)"
+          % (queries, sum(len(group) for group in terrain_groups)))
+    total = 0
+    for count in [4, 64, 512]:
+
+        # add tanks and bullets up to the count, at random positions
+        while len(game.enemy_group) < count:
+            tank = bc.BasicTank()
+            tank.load("images/tanks.png", 48, 48, 8)
+            tank.rect = random_rect(48, 48)
+            game.enemy_group.add(tank)
+            bullet = bc.Bullet(rng.randrange(4), tank)
+            bullet.position = random_rect(12, 12).topleft
+            game.bullet_group.add(bullet)
+
+        # the query types: the test rect of a moving tank against the environment blocking it, the path of a bullet
+        # against the moving sprites, and everything a bullet of the player collides with
+        types = [("terrain any", 48, 48, lambda rect: world.collides(rect, bc.tank_blocking_hits), terrain_any, None),
+                 ("sprites any", 12, 36, lambda rect: world.collides(rect, bc.HIT_BULLETS | bc.HIT_ENEMIES),
+                  sprites_any, None),
+                 ("bullet query", 12, 12, lambda rect: world.query(rect, bc.bullet_hits & ~bc.HIT_PLAYER), bullet_hits,
+                  same_hits)]
+        results = []
+        for name, width, height, query, scan, same in types:
+            rects = [random_rect(width, height) for i in range(queries)]
+            start = time.perf_counter()
+            found = [query(rect) for rect in rects]
+            world_time = (time.perf_counter() - start) / queries
+            start = time.perf_counter()
+            expected = [scan(rect) for rect in rects]
+            scan_time = (time.perf_counter() - start) / queries
+            different = sum(not (same(a, b) if same else bool(a) == bool(b)) for a, b in zip(found, expected))
+            total += different
+            results.append("%s %6.1f us (groups %7.1f us)%s"
+                           % (name, world_time * 1000000, scan_time * 1000000,
+                              ", %d different" % different if different else ""))
+        print("  %3d tanks and bullets: " % count + ", ".join(results))
+
+    if total:
+        sys.exit(1)
+
+
+# update calls for each frame with the update scheduler, compared with updating every group of the game
+def bench_update(repeat):
+    bc = load_game()
+    frames = 1000
+    print("update (%d frames of a level in play)" % frames)
+
+    for game_level in [1, 14, 35]:
+        game = build_game(bc, game_level)
+
+        # a player, the enemies of a wave and a power-up
+        game.player_tank_loader(bc.PlayerTank(0))
+        for i, enemy_type in enumerate([0, 2, 4, 1]):
+            game.enemy_tank_loader(enemy_type, (48 + i * 192, 24))
+        game.spawn_powerup()
+
+        # every group of the game, as they were all updated before the scheduler
+        groups = [game.bricks_group, game.wall_group, game.water_group, game.trees_group, game.ice_group,
+                  game.base_group, game.eagle_group, game.hud_group, game.game_over_text_group, game.player_group,
+                  game.matchless_group, game.enemy_group, game.armor_tank_group, game.powerup_group,
+                  game.bullet_group, game.explosion_group]
+        all_calls = sum(len(group) for group in groups)
+
+        start = time.perf_counter()
+        for frame in range(frames):
+            for group in groups:
+                group.update(frame * 33, 30)
+        all_time = (time.perf_counter() - start) / frames
+
+        start = time.perf_counter()
+        for frame in range(frames):
+            game.scheduler.update(frame * 33)
+        scheduled_time = (time.perf_counter() - start) / frames
+
+        print("  level %2d: all groups %4d calls %6.3f ms/frame, scheduler %3d calls %6.3f ms/frame"
+              % (game_level, all_calls, all_time * 1000, game.scheduler.calls, scheduled_time * 1000))
+
+
+# frame time of drawing the battle with the layered renderer, compared with drawing every group in turn
+def bench_draw(repeat):
+    bc = load_game()
+    frames = 300
+    print("draw (%d frames of a level in play, median of %d runs)" % (frames, repeat))
+
+    for game_level in [1, 14, 35]:
+        game = build_game(bc, game_level)
+        game.enemy_spawn_list_loader()
+        game.hud_loader()
+        game.player_tank_loader(bc.PlayerTank(0))
+        for i, enemy_type in enumerate([0, 2, 4, 1]):
+            game.enemy_tank_loader(enemy_type, (48 + i * 192, 24))
+        game.spawn_powerup()
+        game.update()
+
+        # the groups in the order they were drawn before the layered renderer
+        groups = [game.bricks_group, game.wall_group, game.water_group, game.ice_group, game.eagle_group,
+                  game.hud_group, game.player_group, game.matchless_group, game.enemy_group, game.armor_tank_group,
+                  game.bullet_group, game.explosion_group, game.trees_group, game.powerup_group,
+                  game.game_over_text_group]
+
+        group_times = []
+        layered_times = []
+        for run in range(repeat):
+            start = time.perf_counter()
+            for frame in range(frames):
+                for group in groups:
+                    group.draw(bc.screen)
+            group_times.append((time.perf_counter() - start) / frames)
+
+            start = time.perf_counter()
+            for frame in range(frames):
+                game.renderer.draw(bc.screen)
+            layered_times.append((time.perf_counter() - start) / frames)
+
+        sprites = sum(len(layer) for layer in game.renderer.layers)
+        print("  level %2d (%4d sprites): groups %6.3f ms/frame, layered renderer %6.3f ms/frame"
+              % (game_level, sprites, median(group_times) * 1000, median(layered_times) * 1000))
+
+
+# code which plays a level at a render scale and prints the memory of the sheets and the time of a frame
+render_frames = """
+import collections
+bc.render_scale = %d
+bc.mixer_ready = False
+bc.init_display(True)
+bc.ticks = 1000
+bc.new_session()
+bc.keys = collections.defaultdict(bool)
+game = bc.Game(bc.screen, 14)
+game.run()
+for frame in range(30):
+    bc.ticks += 33
+    game.run()
+sheets = sum(image.get_width() * image.get_height() * 4 for image in bc.image_cache.values())
+start = time.perf_counter()
+for frame in range(300):
+    bc.ticks += 33
+    game.run()
+    bc.present()
+print(sheets / 1024.0)
+print((time.perf_counter() - start) / 300 * 1000)
+"""
+
+
+# memory of the sheets and time of a frame shown in the 768x672 window, composed at 3x and at native resolution
+def bench_render(repeat):
+    print("render (level 14 in a 768x672 window, median of %d runs)" % repeat)
+    for name, scale in [("3x frame", 3), ("native frame", 1)]:
+        results = []
+        for run in range(repeat):
+            command = [sys.executable, "-c", "import time\nimport BattleCityRemake as bc\n" + render_frames % scale]
+            result = subprocess.run(command, capture_output=True, text=True, cwd=base_dir)
+            results.append([float(line) for line in result.stdout.splitlines()[-2:]])
+        print("  %-12s  sheets %7.1f KiB, %6.3f ms/frame"
+              % (name, results[0][0], median([frame_time for sheets, frame_time in results])))
+
+
+# frame size of each sheet in the coordinates of the game, the sheets are cut in a grid of frames of this size
+sheet_frames = {"bullet.png": (15, 15), "environment.png": (48, 48), "explosions.png": (96, 96),
+                "letters.png": (24, 24), "power_ups.png": (48, 48), "tanks.png": (48, 48),
+                "board_d.png": (768, 672), "board_s.png": (768, 672), "game_over.png": (768, 672),
+                "menu.png": (768, 672)}
+
+
+# blits per millisecond of the frames of each sheet, as alpha subsurfaces and as converted frames
+def bench_blit(repeat):
+    bc = load_game()
+    print("blit (frames of each sheet drawn on the screen, median of %d runs)" % repeat)
+
+    for name in sorted(sheet_frames):
+        sheet = bc.get_image("images/" + name)
+        width, height = sheet_frames[name]
+        rects = [bc.Rect(x, y, width, height) for y in range(0, sheet.get_height() - height + 1, height)
+                 for x in range(0, sheet.get_width() - width + 1, width)]
+        subsurfaces = [(sheet.subsurface(rect), (rect.x % 600, rect.y % 500)) for rect in rects]
+        frames = [(bc.get_frame(sheet, rect), (rect.x % 600, rect.y % 500)) for rect in rects]
+        kinds = {}
+        for rect in rects:
+            kind = bc.classify_frame(sheet.subsurface(rect))
+            kinds[kind] = kinds.get(kind, 0) + 1
+
+        # about the same number of pixels is drawn for every sheet
+        count = max(1, 20000000 // (width * height * len(rects)))
+        results = []
+        for blits in [subsurfaces, frames]:
+            times = []
+            for run in range(repeat):
+                start = time.perf_counter()
+                for i in range(count):
+                    bc.screen.blits(blits, False)
+                times.append(time.perf_counter() - start)
+            results.append(count * len(rects) / median(times) / 1000)
+        print("  %-16s %3d frames (%s): alpha %8.1f blits/ms, converted %8.1f blits/ms (%.1fx)"
+              % (name, len(rects), ", ".join("%d %s" % (kinds[kind], kind) for kind in sorted(kinds)),
+                 results[0], results[1], results[1] / results[0]))
+
+
+# levels generated and validated per minute, and the time of validating one level
+def bench_levels(repeat):
+    bc = load_game()
+    count = 2000
+    print("levels (%d generated levels, median of %d runs)" % (count, repeat))
+
+    times = []
+    attempts = 0
+    for run in range(repeat):
+        attempts = 0
+        start = time.perf_counter()
+        for seed in range(count):
+            attempts += bc.generate_level(seed)[2]
+        times.append(time.perf_counter() - start)
+    print("  generated: %8.0f levels/min, %.2f random levels tried for each valid level"
+          % (count / median(times) * 60, attempts / float(count)))
+
+    # the levels shipped with the game can all be finished
+    shipped = []
+    for level_number in range(1, 36):
+        with open(os.path.join(base_dir, "levels", str(level_number) + ".txt")) as file:
+            shipped.append([line.split() for line in file][:13])
+    start = time.perf_counter()
+    valid = 0
+    for i in range(repeat * 100):
+        valid = sum(bc.level_reachable(tiles) for tiles in shipped)
+    validate_time = (time.perf_counter() - start) / (repeat * 100 * len(shipped))
+    print("  validation: %.3f ms/level, %d of %d shipped levels reachable" % (validate_time * 1000, valid, len(shipped)))
+
+
+# overhead of the telemetry on the frames of a level in play, the records are written by the thread meanwhile
+def bench_telemetry(repeat):
+    bc = load_game()
+    frames = 600
+    path = os.path.join(tempfile.gettempdir(), "battle_city_telemetry.jsonl")
+    print("telemetry (%d frames of level 14, median of %d runs)" % (frames, repeat))
+
+    results = {}
+    for run in range(repeat):
+        for name in ["without", "with"]:
+
+            # the same frames are played each time
+            bc.random.seed(run)
+            bc.ticks = 1000
+            bc.new_session()
+            bc.keys = collections.defaultdict(bool)
+            bc.status = "game"
+            bc.game = bc.Game(bc.screen, 14)
+
+            telemetry = None
+            if name == "with":
+                telemetry = bc.Telemetry(path, interval=0.1)
+            start = time.perf_counter()
+            for frame in range(frames):
+                bc.ticks += 33
+                frame_start = time.perf_counter()
+                requested_before = bc.sound_mixer.requested
+                played_before = bc.sound_mixer.played
+                bc.run_frame()
+                if telemetry:
+                    telemetry.record(bc.frame_record(frame, time.perf_counter() - frame_start,
+                                                     bc.sound_mixer.requested - requested_before,
+                                                     bc.sound_mixer.played - played_before))
+            results.setdefault(name, []).append((time.perf_counter() - start) / frames)
+            if telemetry:
+                telemetry.close()
+
+    without, with_telemetry = median(results["without"]), median(results["with"])
+    print("  without %6.3f ms/frame, with %6.3f ms/frame, overhead %+.1f%%"
+          % (without * 1000, with_telemetry * 1000, (with_telemetry / without - 1) * 100))
+
+    # the part paid by each frame: making the record and adding it to the buffer
+    telemetry = bc.Telemetry(path)
+    start = time.perf_counter()
+    for frame in range(100000):
+        telemetry.record(bc.frame_record(frame, 0.001, 0, 0))
+    record_time = (time.perf_counter() - start) / 100000
+    telemetry.close()
+    print("  one record: %.2f us (%.2f%% of a 33 ms frame)" % (record_time * 1000000, record_time / 0.033 * 100))
+    os.remove(path)
+
+
+# sprites created and drawings of the panel on the grey edge, while the player is dead and nothing else changes
+def bench_hud(repeat):
+    bc = load_game()
+    frames = 60
+    print("hud (%d frames of level 14 after the player is eliminated)" % frames)
+
+    bc.random.seed(0)
+    bc.ticks = 1000
+    bc.new_session()
+    bc.keys = collections.defaultdict(bool)
+    bc.status = "game"
+    bc.game = game = bc.Game(bc.screen, 14)
+    bc.run_frame()
+
+    # no enemy spawns, and the player is eliminated, so the values on the panel stay the same
+    game.events.cancel("spawn")
+    game.player_tank.kill()
+    game.player_tank = None
+    game.last_player_elimination_time = bc.ticks
+    redraws = game.hud.redraws
+
+    def play():
+        for frame in range(frames):
+            bc.ticks += 33
+            bc.run_frame()
+
+    sprites = count_sprites(bc, play)
+    redraws = game.hud.redraws - redraws
+    print("  %d sprites created, panel drawn %d times" % (sprites, redraws))
+
+    # a change of the values draws the panel again, the same values are only compared
+    times = []
+    for run in range(repeat):
+        start = time.perf_counter()
+        for i in range(1000):
+            game.hud.set_values(i % 20, 2, 14)
+        times.append((time.perf_counter() - start) / 1000)
+    changed_time = median(times)
+    times = []
+    for run in range(repeat):
+        start = time.perf_counter()
+        for i in range(1000):
+            game.hud.set_values(19, 2, 14)
+        times.append((time.perf_counter() - start) / 1000)
+    print("  value changed: %.1f us, value unchanged: %.2f us" % (changed_time * 1000000, median(times) * 1000000))
+
+    if sprites or redraws:
+        print("  FAILED: the panel is rebuilt on frames where nothing changed")
+        sys.exit(1)
+
+
+# sounds of heavy combat, each one played on the oldest channel compared with the mixer of the game
+def bench_sound(repeat):
+    os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+    bc = load_game()
+    bc.mixer_ready = None
+    if not bc.init_mixer():
+        print("sound (skipped, no audio device)")
+        return
+    frames = 300
+    print("sound (%d frames of sounds, %d channels)" % (frames, bc.channel_budget))
+
+    # the sounds asked for in one frame of each kind of combat
+    bursts = {"grenade on 4 enemies": ["explosion"] * 4 + ["bonus"],
+              "bricks hit": ["fire"] * 2 + ["brick"] * 6 + ["steel"] * 2,
+              "heavy combat": ["fire"] * 4 + ["brick"] * 4 + ["steel"] + ["explosion"] * 2}
+    for name, burst in bursts.items():
+
+        # before the mixer, each sound was played on the oldest channel
+        start = time.perf_counter()
+        for frame in range(frames):
+            for sound in burst:
+                bc.pygame.mixer.find_channel(True).play(bc.get_sound(sound))
+        oldest_time = (time.perf_counter() - start) / frames
+        bc.pygame.mixer.stop()
+
+        mixer = bc.Mixer(bc.channel_budget)
+        start = time.perf_counter()
+        for frame in range(frames):
+            bc.ticks += 33
+            for sound in burst:
+                mixer.play(sound)
+        mixer_time = (time.perf_counter() - start) / frames
+        bc.pygame.mixer.stop()
+
+        print("  %-20s oldest channel %4d played %6.1f us/frame, mixer %4d of %4d played (%d coalesced, "
+              "%d stolen, %d dropped) %6.1f us/frame"
+              % (name, frames * len(burst), oldest_time * 1000000, mixer.played, mixer.requested, mixer.coalesced,
+                 mixer.stolen, mixer.dropped, mixer_time * 1000000))
+
+
+# frame times of large arenas full of enemies, the player drives around and fires, its spawn shield never ends and
+# the base is made of steel, so the battle goes on for all the frames
+def bench_arena(repeat):
+    bc = load_game()
+    frames = 600
+    print("arena (%d frames after %d frames of warm-up, level 14)" % (frames, frames // 4))
+
+    for cols, cap in [(13, 4), (52, 50), (104, 200)]:
+        bc.arena_size = (cols, cols)
+        bc.enemy_cap = cap
+        bc.random.seed(0)
+        bc.ticks = 1000
+        bc.new_session()
+        bc.keys = collections.defaultdict(bool)
+        bc.status = "game"
+
+        start = time.perf_counter()
+        bc.game = game = bc.Game(bc.screen, 14)
+        bc.run_frame()
+        load_time = time.perf_counter() - start
+
+        game.events.cancel("spawn matchless")
+        for sprite in game.base_group.sprites():
+            sprite.kill()
+        game.base_builder("wall")
+
+        # the enemies spawn up to the cap
+        game.fast_forward(20000)
+
+        rng = bc.random.Random(1)
+        move = bc.K_w
+        frame_times = []
+        for frame in range(frames + frames // 4):
+            if frame % 15 == 0:
+                move = rng.choice([bc.K_w, bc.K_a, bc.K_s, bc.K_d])
+            bc.keys = collections.defaultdict(bool)
+            bc.keys[move] = True
+            bc.release = ["SPACE"] if frame % 9 == 0 else []
+            bc.ticks += 33
+            start = time.perf_counter()
+            bc.run_frame()
+            if frame >= frames // 4:
+                frame_times.append(time.perf_counter() - start)
+        bc.release = []
+
+        frame_times.sort()
+        mean = sum(frame_times) / len(frame_times)
+        p95 = frame_times[len(frame_times) * 95 // 100]
+        print("  %3dx%-3d %3d enemies (%5d sprites): load %5.2f s, %6.2f ms/frame (%4.0f fps), p95 %6.2f ms, "
+              "max %6.2f ms, %s 30 fps"
+              % (cols, cols, game.enemy_on_map, sum(len(layer) for layer in game.renderer.layers), load_time,
+                 mean * 1000, 1 / mean, p95 * 1000, frame_times[-1] * 1000, "holds" if p95 < 1 / 30 else "misses"))
+
+    bc.arena_size = (13, 13)
+    bc.enemy_cap = 4
+
+
+# memory allocated by each frame of a steady battle, traced by tracemalloc: the most memory taken above the start of
+# the frame at any moment of the frame (the lists and the dictionaries built for the frame), and the memory still
+# taken at the end (the caches filling up). the mean of the frames must stay within alloc_budget
+alloc_budget = 8 * 1024
+
+
+def bench_alloc(repeat):
+    bc = load_game()
+    frames = 600
+    print("alloc (%d frames after %d frames of warm-up, level 14, budget %d bytes per frame)"
+          % (frames, frames // 4, alloc_budget))
+
+    over = 0
+    for cols, cap in [(13, 4), (52, 50)]:
+        bc.arena_size = (cols, cols)
+        bc.enemy_cap = cap
+        bc.random.seed(0)
+        bc.ticks = 1000
+        bc.new_session()
+        bc.keys = collections.defaultdict(bool)
+        bc.status = "game"
+        bc.game = game = bc.Game(bc.screen, 14)
+        bc.run_frame()
+        game.events.cancel("spawn matchless")
+        for sprite in game.base_group.sprites():
+            sprite.kill()
+        game.base_builder("wall")
+        game.fast_forward(20000)
+
+        rng = bc.random.Random(1)
+        move = bc.K_w
+        peaks = []
+        kept = 0
+        for frame in range(frames + frames // 4):
+            if frame % 15 == 0:
+                move = rng.choice([bc.K_w, bc.K_a, bc.K_s, bc.K_d])
+            bc.keys = collections.defaultdict(bool)
+            bc.keys[move] = True
+            bc.release = ["SPACE"] if frame % 9 == 0 else []
+            bc.ticks += 33
+            if frame == frames // 4:
+                tracemalloc.start()
+            if frame < frames // 4:
+                bc.run_frame()
+                continue
+            tracemalloc.reset_peak()
+            start = tracemalloc.get_traced_memory()[0]
+            bc.run_frame()
+            current, peak = tracemalloc.get_traced_memory()
+            peaks.append(peak - start)
+            kept += current - start
+        tracemalloc.stop()
+        bc.release = []
+
+        peaks.sort()
+        mean = sum(peaks) / len(peaks)
+        over += mean > alloc_budget
+        print("  %3dx%-3d %3d enemies: %6.0f bytes per frame, p95 %6d, max %6d, %5.0f bytes kept per frame, %s"
+              % (cols, cols, game.enemy_on_map, mean, peaks[len(peaks) * 95 // 100], peaks[-1], kept / frames,
+                 "within the budget" if mean <= alloc_budget else "OVER the budget"))
+
+    bc.arena_size = (13, 13)
+    bc.enemy_cap = 4
+    if over:
+        sys.exit(1)
+
+
+# cost of the deadlines for each frame, polling every deadline compared with the event scheduler
+def bench_events(repeat):
+    bc = load_game()
+    frames = 3000
+    print("events (%d frames of 33 ms, deadlines spread over the frames)" % frames)
+
+    for count in [10, 100, 1000]:
+        deadlines = [(i * 7919) % (frames * 33) for i in range(count)]
+
+        # polling, as each power-up checked its own time every frame
+        expired = set()
+        start = time.perf_counter()
+        for frame in range(frames):
+            current_time = frame * 33
+            for i in range(count):
+                if i not in expired and current_time > deadlines[i]:
+                    expired.add(i)
+        polling_time = (time.perf_counter() - start) / frames
+
+        events = bc.EventScheduler()
+        for i in range(count):
+            events.schedule(i, deadlines[i], expired.discard, i)
+        start = time.perf_counter()
+        for frame in range(frames):
+            events.run(frame * 33)
+        scheduled_time = (time.perf_counter() - start) / frames
+
+        print("  %4d deadlines: polling %7.2f us/frame, event scheduler %5.2f us/frame"
+              % (count, polling_time * 1000000, scheduled_time * 1000000))
+
+
+# size of the replay files and time to jump to a frame, on a minute of play recorded on each stage
+# the frame reached by a jump is checked against the frame seen while recording
+def bench_replay(repeat):
+    bc = load_game()
+    frames = 1800
+    path = os.path.join(tempfile.gettempdir(), "battle_city_replay.bcr")
+    print("replay (%d frames on each of the %d stages, %d jumps to random frames each)" % (frames, bc.level_count, repeat))
+
+    sizes = []
+    keyframe_sizes = []
+    record_times = []
+    seek_times = []
+    fast_times = []
+    mismatches = 0
+    for stage in range(1, bc.level_count + 1):
+        rng = bc.random.Random(stage)
+        targets = set(rng.randrange(1, frames + 1) for i in range(repeat))
+        hashes = {}
+
+        bc.random.seed(stage)
+        bc.ticks = 1000
+        bc.new_session()
+        bc.status = "game"
+        bc.game = bc.Game(bc.screen, stage)
+
+        # the player moves and fires at random
+        writer = bc.ReplayWriter(path, stage)
+        move = bc.K_w
+        for frame in range(1, frames + 1):
+            if frame % 15 == 0:
+                move = rng.choice([bc.K_w, bc.K_a, bc.K_s, bc.K_d])
+            bc.keys = collections.defaultdict(bool)
+            bc.keys[move] = True
+            bc.release = ["SPACE"] if frame % 9 == 0 else []
+            bc.ticks += 33
+            start = time.perf_counter()
+            writer.record()
+            record_times.append(time.perf_counter() - start)
+            bc.run_frame()
+            if frame in targets:
+                hashes[frame] = hash(bc.pygame.image.tobytes(bc.screen, "RGB"))
+        writer.close()
+        sizes.append(os.path.getsize(path))
+        bc.release = []
+
+        # jump to the frames in a new order, each frame is run again from the nearest keyframe
+        reader = bc.ReplayReader(path)
+
+        # a recording which was not closed has the same keyframes and frames, found without the index, and a cut
+        # frame at the end is left out
+        with open(path, "rb") as replay_file:
+            data = replay_file.read()
+        data = data[:bc.replay_footer.unpack_from(data, len(data) - bc.replay_footer.size)[0]]
+        for cut, frame_count in [(0, frames), (1, frames - 1)]:
+            with open(path, "wb") as replay_file:
+                replay_file.write(data[:len(data) - cut])
+            unclosed = bc.ReplayReader(path)
+            if (unclosed.keyframes != reader.keyframes or unclosed.frame_count != frame_count
+                    or unclosed.inputs != reader.inputs[:frame_count]):
+                print("  stage %2d: the recording cut by %d bytes is read as %d frames and %d keyframes"
+                      % (stage, cut, unclosed.frame_count, len(unclosed.keyframes)))
+                mismatches += 1
+        keyframe_sizes.append(reader.keyframes[-1][1] - reader.keyframes[-2][1])
+        stage_times = []
+        for frame in sorted(targets, key=lambda target: rng.random()):
+            reader.frame = None
+            start = time.perf_counter()
+            reader.seek(frame - 1)
+            reader.step()
+            stage_times.append(time.perf_counter() - start)
+            if hash(bc.pygame.image.tobytes(bc.screen, "RGB")) != hashes[frame]:
+                mismatches += 1
+        seek_times.extend(stage_times)
+
+        # a frame of the window at the highest speed runs the frames in between without drawing them
+        reader.seek(0)
+        start = time.perf_counter()
+        while reader.frame < reader.frame_count:
+            reader.seek(reader.frame + bc.replay_max_speed - 1)
+            reader.step()
+        fast_times.append((time.perf_counter() - start) / (frames / bc.replay_max_speed))
+
+        print("  stage %2d: %6.1f KB/min, jump %5.1f ms mean %5.1f ms max"
+              % (stage, sizes[-1] / 1024 * 1800 / frames, sum(stage_times) / len(stage_times) * 1000,
+                 max(stage_times) * 1000))
+
+    record_times.sort()
+    print("  file: %.1f KB/min mean, %.1f KB/min max, %.1f KB per keyframe every %d frames"
+          % (sum(sizes) / len(sizes) / 1024 * 1800 / frames, max(sizes) / 1024 * 1800 / frames,
+             sum(keyframe_sizes) / len(keyframe_sizes) / 1024, reader.interval))
+    print("  recording: %.3f ms/frame mean, %.1f ms max (keyframe)"
+          % (sum(record_times) / len(record_times) * 1000, record_times[-1] * 1000))
+    print("  jump: %.1f ms mean, %.1f ms max over %d jumps, %d frames different from the recording"
+          % (sum(seek_times) / len(seek_times) * 1000, max(seek_times) * 1000, len(seek_times), mismatches))
+    print("  %dx: %.1f ms per frame of the window, %s 30 fps"
+          % (bc.replay_max_speed, max(fast_times) * 1000, "holds" if max(fast_times) < 1 / 30 else "misses"))
+    os.remove(path)
+    if mismatches:
+        sys.exit(1)
+
+
+# program reading the exported frames like an encoder, which writes the number of frames and a hash of their pixels
+# to a file, the second argument is the time it takes to encode a frame
+export_sink = """
+import sys, time, hashlib
+size, delay, path = int(sys.argv[1]), float(sys.argv[2]), sys.argv[3]
+digest = hashlib.md5()
+frames = 0
+while True:
+    frame = sys.stdin.buffer.read(size)
+    if len(frame) < size:
+        break
+    digest.update(frame)
+    frames += 1
+    time.sleep(delay)
+open(path, "w").write("%d %s" % (frames, digest.hexdigest()))
+"""
+
+
+# cost of exporting the frames of a level in play to an encoder, with an encoder which keeps up and one which doesn't
+def bench_export(repeat):
+    bc = load_game()
+    frames = 300
+    surface = bc.display
+    frame_size = surface.get_width() * surface.get_height() * 4
+    print("export (%d frames of level 14, %dx%d, %s pixels)"
+          % (frames, surface.get_width(), surface.get_height(), bc.raw_pixel_format(surface)))
+
+    # copying the pixels of a frame compared with converting them to RGB
+    buffer = bytearray(frame_size)
+    start = time.perf_counter()
+    for i in range(repeat * 100):
+        bc.pygame.image.tobytes(surface, "RGB")
+    convert_time = (time.perf_counter() - start) / (repeat * 100)
+    start = time.perf_counter()
+    for i in range(repeat * 100):
+        with memoryview(surface.get_view("0")) as pixels:
+            memoryview(buffer)[:] = pixels
+    copy_time = (time.perf_counter() - start) / (repeat * 100)
+    print("  one frame: converted to RGB %.3f ms, copied as it is %.3f ms" % (convert_time * 1000, copy_time * 1000))
+
+    path = os.path.join(tempfile.gettempdir(), "battle_city_export.txt")
+    failed = False
+    for name, delay, wait in [("without export", None, False), ("fast encoder, waiting", 0, True),
+                              ("slow encoder, waiting", 0.01, True), ("slow encoder, dropping", 0.01, False)]:
+        bc.random.seed(0)
+        bc.ticks = 1000
+        bc.new_session()
+        bc.keys = collections.defaultdict(bool)
+        bc.status = "game"
+        bc.game = bc.Game(bc.screen, 14)
+        bc.run_frame()
+
+        exporter = None
+        if delay is not None:
+            command = "%s -c %s %d %s {file}" % (shlex.quote(sys.executable), shlex.quote(export_sink), frame_size,
+                                                  delay)
+            exporter = bc.FrameExporter(path, surface, command, wait=wait)
+
+        # the frames received by the encoder are checked when no frame is dropped
+        digest = hashlib.md5() if exporter and wait else None
+        frame_times = []
+        start = time.perf_counter()
+        for frame in range(frames):
+            bc.ticks += 33
+            frame_start = time.perf_counter()
+            bc.run_frame()
+            bc.present()
+            if exporter:
+                exporter.add(surface)
+            frame_times.append(time.perf_counter() - frame_start)
+            if digest:
+                digest.update(surface.get_view("0").raw)
+        if exporter:
+            rate = exporter.close()
+        else:
+            rate = frames / (time.perf_counter() - start)
+        frame_times.sort()
+        print("  %-23s %6.1f fps, %3d dropped, frame %5.2f ms mean, %5.2f ms max"
+              % (name, rate, exporter.dropped if exporter else 0, sum(frame_times) / frames * 1000,
+                 frame_times[-1] * 1000))
+        if digest:
+            with open(path) as result:
+                if result.read() != "%d %s" % (frames, digest.hexdigest()):
+                    failed = True
+    os.remove(path)
+    if failed:
+        print("  the encoder didn't receive the frames shown")
+        sys.exit(1)
+
+
+# cost of an observation of the battle from the state of the game, compared with drawing the screen and reading its
+# pixels, on the frames of a level in play
+def bench_observe(repeat):
+    bc = load_game()
+    frames = 600
+    try:
+        bc.import_numpy()
+    except ImportError:
+        print("observe: skipped, NumPy is not installed")
+        return
+    numpy = bc.numpy
+
+    # mark the squares covered by a rectangle on a channel of an array
+    def cover(expected, channel, rect):
+        col_0, row_0, col_1, row_1 = bc.game.terrain.squares(rect)
+        expected[channel, row_0:row_1, col_0:col_1] = 1
+
+    results = collections.defaultdict(list)
+    mismatches = 0
+    sprite_mismatches = 0
+    bullet_ways = set()
+    for run in range(repeat):
+        bc.random.seed(run)
+        bc.ticks = 1000
+        bc.new_session()
+        bc.keys = collections.defaultdict(bool)
+        bc.status = "game"
+        bc.game = game = bc.Game(bc.screen, 14)
+        bc.run_frame()
+        observation = bc.Observation(game)
+
+        # the screen is drawn by the frame, and read at once as the pixels of the observation
+        def draw_and_read(draw=game.draw):
+            start = time.perf_counter()
+            draw()
+            screen_pixels[0] = bc.pygame.image.tobytes(bc.screen, "RGB")
+            results["screen"].append(time.perf_counter() - start)
+        game.draw = draw_and_read
+        screen_pixels = [b""]
+
+        rng = bc.random.Random(run)
+        move = bc.K_w
+        last_positions = {}
+        for frame in range(frames):
+            if frame % 15 == 0:
+                move = rng.choice([bc.K_w, bc.K_a, bc.K_s, bc.K_d])
+            bc.keys = collections.defaultdict(bool)
+            bc.keys[move] = True
+            bc.release = ["SPACE"] if frame % 9 == 0 else []
+            bc.ticks += 33
+            bc.run_frame()
+            if bc.status != "game":
+                break
+
+            start = time.perf_counter()
+            array = observation.update()
+            results["observation"].append(time.perf_counter() - start)
+
+            # the terrain channels made again from the whole grid, which must be the same as the changed ones
+            changed = array[:bc.terrain_kinds].copy()
+            start = time.perf_counter()
+            for kind in range(bc.terrain_kinds):
+                numpy.not_equal(observation.counts[kind], 0, out=array[kind])
+            results["terrain rebuilt"].append(time.perf_counter() - start)
+            if not numpy.array_equal(changed, array[:bc.terrain_kinds]):
+                mismatches += 1
+
+            # the other channels drawn again from the sprites, a bullet by the way it moved since the last frame
+            # (up, left, down or right), or by its direction when it has just been fired
+            expected = numpy.zeros_like(array)
+            for player in game.player_group:
+                cover(expected, bc.OBSERVE_PLAYER, player.rect)
+            for enemy in game.enemy_group:
+                cover(expected, bc.OBSERVE_ENEMIES + enemy.enemy_type // 2, enemy.rect)
+            for enemy in game.armor_tank_group:
+                cover(expected, bc.OBSERVE_ENEMIES + 3, enemy.rect)
+            positions = {}
+            for bullet in game.bullet_group:
+                x, y = positions[bullet] = bullet.X, bullet.Y
+                if bullet in last_positions and (x, y) != last_positions[bullet]:
+                    last_x, last_y = last_positions[bullet]
+                    way = 0 if y < last_y else 1 if x < last_x else 2 if y > last_y else 3
+                else:
+                    way = bullet.direction
+                cover(expected, bc.OBSERVE_BULLETS + way, bullet.rect)
+                bullet_ways.add(way)
+            last_positions = positions
+            for powerup in game.powerup_group:
+                cover(expected, bc.OBSERVE_POWERUPS + bc.observed_powerups.index(type(powerup)), powerup.rect)
+            if not numpy.array_equal(expected[bc.OBSERVE_PLAYER:], array[bc.OBSERVE_PLAYER:]):
+                sprite_mismatches += 1
+        bc.release = []
+
+    print("observe (%d frames of level 14, %d runs, %s array of %d bytes, screen of %d bytes)"
+          % (frames, repeat, "x".join(str(size) for size in array.shape), array.nbytes, len(screen_pixels[0])))
+    for name in ["observation", "terrain rebuilt", "screen"]:
+        print("  %-15s %7.1f us/frame" % (name, sum(results[name]) / len(results[name]) * 1000000))
+    print("  the observation costs %.1f%% of drawing and reading the screen"
+          % (sum(results["observation"]) / sum(results["screen"]) * 100))
+    print("  bullets seen going %s" % ", ".join(name for way, name in enumerate(["up", "left", "down", "right"])
+                                             if way in bullet_ways))
+    if mismatches:
+        print("  %d frames with terrain channels different from the grid" % mismatches)
+    if sprite_mismatches:
+        print("  %d frames with tank, bullet or power-up channels different from the sprites" % sprite_mismatches)
+    if mismatches or sprite_mismatches or len(bullet_ways) < 4:
+        sys.exit(1)
+
+
+# code which plays a level in a batch of games drawing into one block of shared memory, then prints the frames of
+# all the games each second, the time of a gray and halved copy of the block, the time it would take to copy every
+# frame into the block, and 1 if the games draw into the block itself
+play_batch = """
+import random
+from multiprocessing import shared_memory
+bc.render_scale = %d
+bc.mixer_ready = False
+bc.init_display(True)
+numpy = bc.import_numpy()
+count, steps = %d, %d
+width, height = bc.nes_size[0] * bc.render_scale, bc.nes_size[1] * bc.render_scale
+block = shared_memory.SharedMemory(create=True, size=count * height * width * 4)
+frames = numpy.ndarray((count, height, width, 4), numpy.uint8, buffer=block.buf)
+batch = bc.GameBatch(frames, 14)
+rng = random.Random(0)
+actions = [0] * count
+for step in range(steps // 4 + steps):
+    if step == steps // 4:
+        start = time.perf_counter()
+    if step %% 15 == 0:
+        actions = [rng.randrange(10) for i in range(count)]
+    batch.step(actions)
+step_time = (time.perf_counter() - start) / steps
+gray = numpy.empty((count, height // 2, width // 2), numpy.uint8)
+start = time.perf_counter()
+for i in range(20):
+    batch.grayscale(gray, 2)
+gray_time = (time.perf_counter() - start) / 20
+start = time.perf_counter()
+for i in range(20):
+    for frame, surface in zip(frames, batch.surfaces):
+        frame.reshape(-1)[:] = numpy.frombuffer(bc.pygame.image.tobytes(surface, "RGBX"), numpy.uint8)
+copy_time = (time.perf_counter() - start) / 20
+shared = all(surface._pixels_address == frame.ctypes.data for frame, surface in zip(frames, batch.surfaces))
+print(batch.episodes)
+print(count / step_time)
+print(gray_time * 1000)
+print(copy_time * 1000)
+print(int(shared))
+del batch, frames
+block.close()
+block.unlink()
+"""
+
+
+# frames of a batch of games drawing their pixels into one block of shared memory, at the native and 3x resolutions
+def bench_batch(repeat):
+    count = 64
+    steps = 150 * repeat
+    print("batch (%d games of level 14 playing at random, %d steps)" % (count, steps))
+    for name, scale in [("native 256x224", 1), ("3x 768x672", 3)]:
+        command = [sys.executable, "-c", "import time\nimport BattleCityRemake as bc\n" +
+                   play_batch % (scale, count, steps)]
+        result = subprocess.run(command, capture_output=True, text=True, cwd=base_dir)
+        if result.returncode:
+            print("  %s: failed\n%s" % (name, result.stderr))
+            sys.exit(1)
+        episodes, rate, gray_time, copy_time, shared = [float(line) for line in result.stdout.splitlines()[-5:]]
+        print("  %-14s %7.0f frames/s (%5.1f steps/s of the batch), %3d games played, gray at half size %5.2f ms, "
+              "copying the frames would cost %6.2f ms a step, %s"
+              % (name, rate, rate / count, episodes, gray_time, copy_time,
+                 "drawn in place" if shared else "NOT drawn in place"))
+        if not shared:
+            sys.exit(1)
+
+
+# code which plays from the start of the menu to 600 frames of stage 1, firing at random, and prints the worst frame
+# of the menu, the worst frame of the game and the number of frames and sounds loaded while the game is played
+# without the warm-up, the queue of the assets to warm up starts empty
+play_session = """
+bc.os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+bc.init_display(True)
+bc.warm_up_queue = None if %d else bc.collections.deque()
+bc.random.seed(0)
+bc.new_session()
+rng = bc.random.Random(0)
+move = bc.K_w
+worst = {"menu": 0, "game": 0}
+loaded = None
+game_frames = 0
+while game_frames < 600 and bc.status != "board":
+    bc.ticks += 33
+    bc.keys = bc.collections.defaultdict(bool)
+    bc.release = []
+    if bc.status == "menu" and bc.menu.initializing is False:
+        bc.keys[bc.K_RETURN] = True
+    elif bc.status == "level" and not bc.level.initializing and not bc.level.clearing:
+        bc.release = ["RETURN"]
+    elif bc.status == "game":
+        if loaded is None:
+            loaded = len(bc.frame_cache) + len(bc.sound_cache)
+        if game_frames %% 15 == 0:
+            move = rng.choice([bc.K_w, bc.K_a, bc.K_s, bc.K_d])
+        bc.keys[move] = True
+        if game_frames %% 9 == 0:
+            bc.release = ["SPACE"]
+        game_frames += 1
+    status = bc.status
+    start = time.perf_counter()
+    bc.run_frame()
+    worst[status] = max(worst.get(status, 0), time.perf_counter() - start)
+print(worst["menu"] * 1000)
+print(worst["game"] * 1000)
+print(len(bc.frame_cache) + len(bc.sound_cache) - loaded)
+"""
+
+
+# frame times of the menu and the first stage, with the assets loaded while the menu is shown and with the assets
+# loaded when they are first used
+def bench_warmup(repeat):
+    print("warmup (menu and 600 frames of stage 1, worst of %d runs)" % repeat)
+    for name, warm_up in [("warm-up", True), ("no warm-up", False)]:
+        results = []
+        for run in range(repeat):
+            command = [sys.executable, "-c", "import time\nimport BattleCityRemake as bc\n" +
+                       play_session % warm_up]
+            result = subprocess.run(command, capture_output=True, text=True, cwd=base_dir)
+            if result.returncode:
+                print("  %s: failed\n%s" % (name, result.stderr))
+                sys.exit(1)
+            results.append([float(line) for line in result.stdout.splitlines()[-3:]])
+        menu_time, game_time, loaded = [max(values) for values in zip(*results)]
+        print("  %-10s  worst menu frame %5.1f ms, worst game frame %5.1f ms, %3d frames and sounds loaded in the game"
+              % (name, menu_time, game_time, loaded))
+
+
+# frame times from the stage screen to the first frames of the game, with the level loaded on the stage screen and
+# with the whole level loaded in the first frame of the game
+def bench_scenes(repeat):
+    bc = load_game()
+    print("scenes (stage screen of level 14 and the first 30 frames of the game, worst of %d runs)" % repeat)
+    steps = bc.loading_steps
+
+    for cols in [13, 52, 104]:
+        bc.arena_size = (cols, cols)
+        results = {}
+        for name, loading_steps in [("on the stage screen", steps), ("in the first frame", 0)]:
+            bc.loading_steps = loading_steps
+            worst = []
+            for run in range(repeat):
+                bc.random.seed(run)
+                bc.ticks = 1000
+                bc.new_session()
+                bc.keys = collections.defaultdict(bool)
+                bc.status = "level"
+                bc.level = bc.Level(bc.screen, 14, False)
+
+                # the garbage of the runs before is collected first, so it isn't collected in the middle of this run
+                gc.collect()
+
+                frame_times = []
+                stage_frames = 0
+                game_frames = 0
+                while game_frames < 30:
+                    bc.ticks += 33
+                    start = time.perf_counter()
+                    bc.run_frame()
+                    frame_times.append((time.perf_counter() - start, bc.status))
+                    if bc.status == "game":
+                        game_frames += 1
+                    else:
+                        stage_frames += 1
+                worst.append(max(frame_times) + (stage_frames,))
+            results[name] = max(worst)
+        prepared, unprepared = results["on the stage screen"], results["in the first frame"]
+        print("  %3dx%-3d  worst frame %6.1f ms (%s, %3d frames of stage screen), %6.1f ms (%s, %3d frames) when the "
+              "level is loaded in the first frame"
+              % (cols, cols, prepared[0] * 1000, prepared[1], prepared[2], unprepared[0] * 1000, unprepared[1],
+                 unprepared[2]))
+
+    bc.loading_steps = steps
+    bc.arena_size = (13, 13)
+
+
+# keys for a frame of the window, held for all the steps of the frame, from the menu to stage 1 and then driving
+# around and firing at random
+def session_keys(bc, frame, rng, move):
+    keys = collections.defaultdict(bool)
+    release = []
+    if bc.status == "menu":
+        if frame == 1:
+            release = ["RETURN"]
+        if frame > 5:
+            keys[bc.K_RETURN] = True
+    elif bc.status == "level":
+        if frame % 10 == 5:
+            release = ["RETURN"]
+    elif bc.status == "game":
+        if frame % 6 == 0:
+            move[0] = rng.choice([bc.K_w, bc.K_a, bc.K_s, bc.K_d])
+        keys[move[0]] = True
+        if frame % 4 == 0:
+            release = ["SPACE"]
+    return keys, release
+
+
+# function to play a session of a number of steps at a speed, the steps of a frame of the window either run with
+# run_steps, or one by one as frames at the normal speed with the keys of the frame of the window
+# return what the game looks like at the end and the time taken
+def play_speed(bc, speed, steps, one_by_one):
+    bc.random.seed(0)
+    bc.ticks = 1000
+    bc.new_session()
+    rng = bc.random.Random(1)
+    move = [bc.K_w]
+    start = time.perf_counter()
+    for frame in range(steps // speed):
+        bc.ticks += 33
+        bc.keys, release = session_keys(bc, frame, rng, move)
+        if one_by_one:
+            for step in range(speed):
+                if step:
+                    bc.ticks += 33
+                bc.release = release if step == 0 else []
+                bc.run_frame()
+        else:
+            bc.release = release
+            bc.run_steps(speed)
+    elapsed = time.perf_counter() - start
+    game = bc.game
+    state = (bc.status, bc.score, game and (game.level, game.score, game.enemy_on_map, len(game.enemy_spawn_list),
+                                            game.player_tank and tuple(game.player_tank.rect)), bc.random.getstate())
+    return state, elapsed
+
+
+# frames of the window at higher speeds, which must end the same as the same steps played one by one
+def bench_speed(repeat):
+    bc = load_game()
+    steps = 600 * repeat
+    print("speed (%d steps of the game from the menu into stage 1)" % steps)
+    different = 0
+    for speed in [1, 2, 10]:
+        expected, normal_time = play_speed(bc, speed, steps, True)
+        state, elapsed = play_speed(bc, speed, steps, False)
+        same = state == expected
+        different += not same
+        print("  %2dx  %5.2f ms per frame of the window, %6.0f steps/s (%6.0f steps/s drawing every step), %s"
+              % (speed, elapsed / (steps // speed) * 1000, steps / elapsed, steps / normal_time,
+                 "same as step by step" if same else "DIFFERENT from step by step"))
+
+    # at the max speed, the steps of a frame fit in max_speed_time
+    frame_steps = []
+    frame_times = []
+    for frame in range(100):
+        bc.ticks += 33
+        start = time.perf_counter()
+        frame_steps.append(bc.run_steps(0))
+        frame_times.append(time.perf_counter() - start)
+    print("  max  %5.2f ms per frame of the window, %6.0f steps/s, %d to %d steps per frame"
+          % (sum(frame_times) / len(frame_times) * 1000, sum(frame_steps) / sum(frame_times), min(frame_steps),
+             max(frame_steps)))
+    if different:
+        sys.exit(1)
+
+
+# all the benchmarks by name
+benchmarks = {"startup": bench_startup, "assets": bench_assets, "board": bench_board, "ai": bench_ai, "sight": bench_sight,
+              "collide": bench_collide,
+              "update": bench_update, "events": bench_events, "hud": bench_hud, "sound": bench_sound,
+              "arena": bench_arena, "alloc": bench_alloc,
+              "draw": bench_draw, "render": bench_render,
+              "blit": bench_blit, "levels": bench_levels,
+              "telemetry": bench_telemetry, "replay": bench_replay,
+              "export": bench_export, "observe": bench_observe, "batch": bench_batch,
+              "scenes": bench_scenes, "warmup": bench_warmup, "speed": bench_speed}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Battle City Remake benchmarks")
+    parser.add_argument("names", nargs="*", help="benchmarks to run: " + ", ".join(benchmarks))
+    parser.add_argument("--repeat", type=int, default=5, help="number of repetitions for each measurement")
+    args = parser.parse_args(argv)
+
+    for name in args.names or list(benchmarks):
+        benchmarks[name](args.repeat)
+
+
+if __name__ == "__main__":
+    main()